@@ -0,0 +1,11 @@
+"""Benchmarks of the signing and message pipeline.
+
+Run by `python -m benchmarks` or `tox -e benchmarks`, see `python -m benchmarks --help`.
+Absolute results depend on the machine, so no baseline is committed. To check a change for regressions, store the
+baseline on the base revision and check the changed revision on the same machine::
+
+    git checkout master && tox -e benchmarks -- --save
+    git checkout - && tox -e benchmarks -- --check
+
+The baseline is stored in `benchmarks/baseline.json`, which is ignored by git.
+"""
@@ -0,0 +1,125 @@
+"""Run the benchmarks and compare them to the baseline."""
+
+import json
+import os
+import platform
+import sys
+from argparse import ArgumentParser
+from typing import Any, Optional
+
+from benchmarks.cases import KEEP_ALIVE_CASES, get_cases
+from benchmarks.runner import Result, run
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+def get_environment() -> dict[str, str]:
+    """Return the description of the machine, the results are comparable only on the same one."""
+    return {"python": platform.python_version(), "machine": platform.machine(), "node": platform.node()}
+
+
+def load_baseline(path: str) -> Optional[dict[str, Any]]:
+    """Return the stored baseline, None if there is no baseline."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as baseline:
+        return json.load(baseline)
+
+
+def save_baseline(path: str, results: list[Result]) -> None:
+    """Store the results as the baseline."""
+    content: dict[str, Any] = get_environment()
+    content["cases"] = {result.name: result._asdict() for result in results}
+    with open(path, "w") as baseline:
+        json.dump(content, baseline, indent=2, sort_keys=True)
+        baseline.write("\n")
+
+
+def compare(result: Result, baseline: Optional[dict[str, Any]], tolerance: float) -> tuple[str, bool]:
+    """Return the comparison with the baseline and whether it is a regression beyond the tolerance."""
+    if baseline is None:
+        return "new", False
+    speed = result.ops_per_sec / baseline["ops_per_sec"]
+    memory = result.peak_bytes / baseline["peak_bytes"] if baseline["peak_bytes"] else 1
+    regression = speed < 1 - tolerance or memory > 1 + tolerance
+    return "{:.2f}x speed {:.2f}x memory".format(speed, memory), regression
+
+
+def keep_alive_difference(results: list[Result]) -> Optional[str]:
+    """Return the time saved per call by the keep-alive, if both of the cases were run."""
+    speeds = {result.name: result.ops_per_sec for result in results}
+    if not all(name in speeds for name in KEEP_ALIVE_CASES):
+        return None
+    kept, closed = (speeds[name] for name in KEEP_ALIVE_CASES)
+    return "Keep-alive saves {:.2f} ms per call ({:.2f}x speed)".format(1000 / closed - 1000 / kept, kept / closed)
+
+
+def main(args: Optional[list[str]] = None) -> int:
+    """Run the benchmarks, return the exit code."""
+    parser = ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("-k", dest="pattern", default="", help="only run the cases containing the pattern")
+    parser.add_argument("--baseline", default=BASELINE, help="path of the baseline file")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="fail on regressions beyond the tolerance, the baseline has to be stored on this machine",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative tolerance of regressions")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed runs, the best one is reported")
+    options = parser.parse_args(args)
+
+    baseline = load_baseline(options.baseline)
+    if options.check and baseline is None:
+        parser.error("no baseline in {}, store it by --save on the base revision".format(options.baseline))
+    baselines: dict[str, Any] = {}
+    if baseline is not None:
+        baselines = baseline["cases"]
+        environment = get_environment()
+        if any(baseline.get(key) != value for key, value in environment.items()):
+            print(
+                "Baseline was not stored in this environment ({}), the results are not comparable".format(
+                    ", ".join("{}={}".format(key, baseline.get(key)) for key in environment)
+                ),
+                file=sys.stderr,
+            )
+    results = []
+    regressions = []
+    print("{:<32} {:>12} {:>12} {:>12}  {}".format("case", "ops/sec", "peak KiB", "retained KiB", "vs. baseline"))
+    for name, func in get_cases():
+        if options.pattern not in name:
+            continue
+        result = run(name, func, options.repeat)
+        comparison, regression = compare(result, baselines.get(name), options.tolerance)
+        if regression:
+            regressions.append(name)
+        results.append(result)
+        print(
+            "{:<32} {:>12.1f} {:>12.1f} {:>12.1f}  {}{}".format(
+                name,
+                result.ops_per_sec,
+                result.peak_bytes / 1024,
+                result.retained_bytes / 1024,
+                comparison,
+                " REGRESSION" if regression else "",
+            )
+        )
+    difference = keep_alive_difference(results)
+    if difference is not None:
+        print(difference)
+    if options.save:
+        if options.pattern:
+            # Keep the baselines of the cases which were not run
+            stored = {name: Result(**values) for name, values in baselines.items()}
+            stored.update((result.name, result) for result in results)
+            results = list(stored.values())
+        save_baseline(options.baseline, results)
+        print("Baseline stored in {}".format(options.baseline))
+    if options.check and regressions:
+        print("Regressions: {}".format(", ".join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Benchmark cases using the fixtures from `cz_nia/tests`."""
+
+import datetime
+import os
+import re
+from base64 import b64decode
+from collections.abc import Iterator
+from copy import copy
+from functools import partial
+from typing import Callable
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+from zeep.transports import Transport
+
+from cz_nia.functions import get_pseudonym
+from cz_nia.message import (
+    ChangeAuthenticatorMessage,
+    IdentificationMessage,
+    NotificationMessage,
+    WriteAuthenticatorMessage,
+)
+from cz_nia.settings import CzNiaAppSettings
+from cz_nia.standin import STANDIN_CERTIFICATE, StandinServer
+from cz_nia.tests.utils import load_xml
+from cz_nia.wsse import BinarySignature, SAMLTokenSignature
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "cz_nia", "tests")
+DATA_DIR = os.path.join(TESTS_DIR, "data")
+SETTINGS = CzNiaAppSettings(
+    {
+        "identity_wsdl": "file://" + os.path.join(DATA_DIR, "IPSTS_nice.wsdl"),
+        "federation_wsdl": "file://" + os.path.join(DATA_DIR, "FPSTS_nice.wsdl"),
+        "public_wsdl": "file://" + os.path.join(DATA_DIR, "Public_nice.wsdl"),
+        "federation_address": "https://tnia.eidentita.cz/FPSTS/issue.svc",
+        "public_address": "https://tnia.eidentita.cz/ws/submission/public.svc/token",
+        "certificate": os.path.join(DATA_DIR, "NIA.pem"),
+        "key": os.path.join(DATA_DIR, "NIA_key.pem"),
+        "password": None,
+    }
+)
+RESPONSES = {
+    "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate": "IPSTS_response.xml",
+    "https://tnia.eidentita.cz/FPSTS/Issue.svc": "FPSTS_response.xml",
+    "https://tnia.eidentita.cz/WS/submission/Public.svc/token": "Sub_response.xml",
+}
+USER_DATA = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+AUTHENTICATOR_DATA = {
+    "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+    "identification": "some_vip",
+    "level_of_authentication": "High",
+    "verified": "true",
+    "id_data": {"number": "42", "type": "P"},
+    "state": "Aktivni",
+    "message": "some message to the authorities",
+}
+ENVELOPE = """
+    <soap-env:Envelope xmlns:soap-env="http://www.w3.org/2003/05/soap-envelope">
+        <soap-env:Header>
+            <wsa:Action xmlns:wsa="http://www.w3.org/2005/08/addressing">Submit</wsa:Action>
+        </soap-env:Header>
+        <soap-env:Body>
+            <Submit xmlns="http://www.government-gateway.cz/wcf/submission"><tclass>TR_ZTOTOZNENI</tclass></Submit>
+        </soap-env:Body>
+    </soap-env:Envelope>
+    """
+# Cases calling the HTTPS stand-in with and without the keep-alive
+KEEP_ALIVE_CASES = ("get_pseudonym_tls_keep_alive", "get_pseudonym_tls_no_keep_alive")
+# Number of the copies of the notifications in the large page
+LARGE_PAGE_COPIES = 100
+
+
+def read(filename: str, directory: str = DATA_DIR) -> bytes:
+    """Return the content of the file."""
+    with open(os.path.join(directory, filename), "rb") as data:
+        return data.read()
+
+
+def response_body(filename: str) -> bytes:
+    """Return the decoded body of the Submission response."""
+    match = re.search(rb"<BodyBase64XML>(.*)</BodyBase64XML>", read(filename), re.DOTALL)
+    assert match is not None
+    return b64decode(match.group(1))
+
+
+def large_page() -> bytes:
+    """Return the notifications page with copies of the notifications in the fixture."""
+    body = response_body("notifications.xml")
+    start = body.index(b"<SeznamNotifikaceIdp>") + len(b"<SeznamNotifikaceIdp>")
+    end = body.index(b"</SeznamNotifikaceIdp>")
+    return body[:start] + body[start:end] * LARGE_PAGE_COPIES + body[end:]
+
+
+class FixtureTransport(Transport):
+    """Transport responding with the fixtures without any network communication."""
+
+    def __init__(self):
+        super().__init__()
+        self.responses = {address: read(filename) for address, filename in RESPONSES.items()}
+
+    def post(self, address, message, headers):
+        response = Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict({"Content-Type": "application/soap+xml; charset=utf-8"})
+        response._content = self.responses[address]
+        return response
+
+
+def get_cases() -> Iterator[tuple[str, Callable[[], object]]]:
+    """Yield the names and functions of the benchmark cases."""
+    messages = (
+        ("identification", IdentificationMessage(USER_DATA)),
+        ("write_authenticator", WriteAuthenticatorMessage(AUTHENTICATOR_DATA)),
+        ("change_authenticator", ChangeAuthenticatorMessage(AUTHENTICATOR_DATA)),
+        ("notification", NotificationMessage({"id": 12})),
+    )
+    for name, message in messages:
+        yield "pack_" + name, message.pack
+
+    notification = NotificationMessage({"id": 12})
+    small = response_body("notifications.xml")
+    large = large_page()
+    yield "unpack_notifications_small", lambda: notification.unpack(small)
+    yield "unpack_notifications_large", lambda: notification.unpack(large)
+
+    binary = BinarySignature(SETTINGS.KEY, SETTINGS.CERTIFICATE, SETTINGS.PASSWORD)
+    saml = SAMLTokenSignature(load_xml(read("assertion.xml", TESTS_DIR).decode()))
+    yield "binary_signature_apply", lambda: binary.apply(load_xml(ENVELOPE), {})
+    yield "saml_signature_apply", lambda: saml.apply(load_xml(ENVELOPE), {})
+
+    transport = FixtureTransport()
+    direct = copy(SETTINGS)
+    direct.SUBMISSION_DIRECT = True
+    yield "get_pseudonym", lambda: get_pseudonym(SETTINGS, USER_DATA, transport)
+    yield "get_pseudonym_direct", lambda: get_pseudonym(direct, USER_DATA, transport)
+
+    # The stand-in runs until the cases are exhausted or the generator is closed
+    with StandinServer(certificate=STANDIN_CERTIFICATE) as server:
+        for name, keep_alive in zip(KEEP_ALIVE_CASES, (True, False)):
+            settings = server.get_settings(keep_alive=keep_alive)
+            yield name, partial(get_pseudonym, settings, USER_DATA, server.get_transport(settings))
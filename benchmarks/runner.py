@@ -0,0 +1,50 @@
+"""Measurement of the benchmark cases."""
+
+import gc
+import timeit
+import tracemalloc
+from typing import Callable, NamedTuple
+
+
+class Result(NamedTuple):
+    """Result of the benchmark case.
+
+    The `peak_bytes` is the peak of the memory allocated by a single call, `retained_bytes` is the memory left
+    allocated after the call returned, e.g. in caches.
+    Only the allocations by the Python allocator are traced, i.e. not the ones in libxml2.
+    """
+
+    name: str
+    ops_per_sec: float
+    peak_bytes: int
+    retained_bytes: int
+
+
+def measure_speed(func: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> float:
+    """Return the number of calls per second from the best of the `repeat` runs of at least `min_time` seconds."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(number, int(number * min_time / 0.2))
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def measure_memory(func: Callable[[], object]) -> tuple[int, int]:
+    """Return the peak and retained memory allocated by a single call."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before, after - before
+
+
+def run(name: str, func: Callable[[], object], repeat: int = 5, min_time: float = 0.2) -> Result:
+    """Warm up the function and return its result."""
+    # Fill the caches of the parsed documents, keys and templates
+    func()
+    peak, retained = measure_memory(func)
+    return Result(name, measure_speed(func, repeat, min_time), peak, retained)
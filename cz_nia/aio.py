@@ -0,0 +1,416 @@
+"""Asynchronous API for communication with NIA.
+
+Requires `httpx`, which is installed with the `aio` extra.
+"""
+
+from asyncio import AbstractEventLoop, get_running_loop
+from collections.abc import AsyncGenerator
+from copy import copy
+from threading import Lock
+from typing import Any, Optional
+
+from httpx import AsyncClient as HttpxClient, HTTPError, Limits
+from lxml.etree import Element
+from xmlsec import Error as XmlsecError
+from zeep import AsyncClient
+from zeep.cache import SqliteCache
+from zeep.exceptions import Error
+from zeep.transports import AsyncTransport
+from zeep.wsdl import Document
+
+from cz_nia.cache import PseudonymCache
+from cz_nia.exceptions import NiaException
+from cz_nia.functions import (
+    _DOCUMENTS,
+    _SUBMISSION_TEMPLATES,
+    SETTINGS,
+    _assertion_size,
+    _decode_body,
+    _federation_request,
+    _get_document as _get_sync_document,
+    _get_history,
+    _get_submission_template,
+    _get_token_assertion,
+    _identity_request,
+    _log_history,
+    _submission_bodies,
+    _submission_envelope,
+    _submission_result,
+    _SubmissionTemplate,
+    _transport_key,
+    get_transport as get_sync_transport,
+)
+from cz_nia.instrumentation import FPSTS, IPSTS, SUBMISSION, Observer, phase
+from cz_nia.message import (
+    ChangeAuthenticatorMessage,
+    IdentificationMessage,
+    NiaMessage,
+    NotificationMessage,
+    NotificationResult,
+    NotificationStream,
+    NotificationStreamMessage,
+    WriteAuthenticatorMessage,
+)
+from cz_nia.settings import CzNiaAppSettings
+from cz_nia.tokens import AsyncSingleFlight, Token, get_assertion_expiry
+from cz_nia.wsse.signature import BinarySignature, SAMLTokenSignature
+
+# Transports shared by all calls within the event loop with the same transport settings
+_TRANSPORTS: dict[AbstractEventLoop, dict[tuple, AsyncTransport]] = {}
+# Asynchronous generators closing the transports of the event loop when it shuts down, see `_close_at_shutdown`
+_FINALIZERS: dict[AbstractEventLoop, AsyncGenerator[None, None]] = {}
+_TRANSPORTS_LOCK = Lock()
+
+
+def _create_transport(settings: CzNiaAppSettings) -> AsyncTransport:
+    """Create an asynchronous transport with a connection pool according to settings."""
+    limits = Limits(max_keepalive_connections=settings.POOL_MAXSIZE if settings.KEEP_ALIVE else 0)
+    return AsyncTransport(
+        client=HttpxClient(limits=limits, timeout=None),
+        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT),
+        timeout=settings.TRANSPORT_TIMEOUT,
+    )
+
+
+async def _close_at_shutdown(loop: AbstractEventLoop) -> AsyncGenerator[None, None]:
+    """Close and drop the transports of the event loop once the generator is closed.
+
+    The generator is left suspended, so the loop closes it when it shuts down its asynchronous generators,
+    e.g. at the end of `asyncio.run`.
+    """
+    try:
+        yield
+    finally:
+        with _TRANSPORTS_LOCK:
+            transports = _TRANSPORTS.pop(loop, {})
+            _FINALIZERS.pop(loop, None)
+        for transport in transports.values():
+            await transport.aclose()
+
+
+def _start_finalizer(loop: AbstractEventLoop) -> AsyncGenerator[None, None]:
+    """Start `_close_at_shutdown` for the running event loop without awaiting it."""
+    finalizer = _close_at_shutdown(loop)
+    # The first step registers the generator in the loop and stops at the yield without any awaiting
+    try:
+        finalizer.asend(None).send(None)
+    except StopIteration:
+        pass
+    return finalizer
+
+
+def _drop_closed_loops() -> None:
+    """Drop the transports of the event loops closed without the shutdown, they can not be closed anymore."""
+    with _TRANSPORTS_LOCK:
+        closed = [loop for loop in _TRANSPORTS if loop.is_closed()]
+        for loop in closed:
+            del _TRANSPORTS[loop]
+        finalizers = [_FINALIZERS.pop(loop) for loop in closed if loop in _FINALIZERS]
+    for finalizer in finalizers:
+        # There are no transports left to close, so the generator finishes without any awaiting.
+        # Otherwise it would be finalized by its closed loop when collected.
+        try:
+            finalizer.aclose().send(None)
+        except StopIteration:
+            pass
+
+
+def get_transport(settings: CzNiaAppSettings) -> AsyncTransport:
+    """Return the asynchronous transport shared by all calls within the running event loop with the same settings.
+
+    Connections in the pool are bound to the event loop, so each loop has its own transports.
+    They are closed when the loop shuts down its asynchronous generators, e.g. at the end of `asyncio.run`,
+    or by `aclose_transports`.
+    Must be called from a coroutine.
+    """
+    loop = get_running_loop()
+    key = _transport_key(settings)
+    _drop_closed_loops()
+    with _TRANSPORTS_LOCK:
+        transports = _TRANSPORTS.get(loop)
+        if transports is None:
+            transports = _TRANSPORTS[loop] = {}
+            _FINALIZERS[loop] = _start_finalizer(loop)
+        if key not in transports:
+            transports[key] = _create_transport(settings)
+        return transports[key]
+
+
+async def aclose_transports() -> None:
+    """Close and drop the transports shared within the running event loop."""
+    with _TRANSPORTS_LOCK:
+        finalizer = _FINALIZERS.get(get_running_loop())
+    if finalizer is not None:
+        await finalizer.aclose()
+
+
+async def _get_document(settings: CzNiaAppSettings, wsdl: str) -> Document:
+    """Return the parsed WSDL document shared with the synchronous API.
+
+    Zeep loads WSDL synchronously even for the asynchronous transport,
+    so the document is loaded in the default executor using the synchronous transport, not to block the loop.
+    """
+    document = _DOCUMENTS.get(wsdl)
+    if document is None:
+        document = await get_running_loop().run_in_executor(
+            None, _get_sync_document, wsdl, get_sync_transport(settings)
+        )
+    return document
+
+
+async def _get_template(settings: CzNiaAppSettings) -> _SubmissionTemplate:
+    """Return the Submission template, loaded in the default executor like `_get_document`."""
+    template = _SUBMISSION_TEMPLATES.get(settings.PUBLIC_WSDL)
+    if template is None:
+        template = await get_running_loop().run_in_executor(
+            None, _get_submission_template, settings.PUBLIC_WSDL, get_sync_transport(settings)
+        )
+    return template
+
+
+async def _get_client(
+    settings: CzNiaAppSettings, wsdl: str, transport: AsyncTransport, wsse: Any, plugins: list
+) -> AsyncClient:
+    """Return an asynchronous client for the WSDL."""
+    document = await _get_document(settings, wsdl)
+    return AsyncClient(document, wsse=wsse, settings=SETTINGS, transport=transport, plugins=plugins)
+
+
+async def _call_identity(settings: CzNiaAppSettings, transport: AsyncTransport) -> Element:
+    """Call IPSTS (Identity provider) service and return the assertion."""
+    plugins, history = _get_history(settings)
+    client = await _get_client(
+        settings,
+        settings.IDENTITY_WSDL,
+        transport,
+        BinarySignature(
+            settings.KEY,
+            settings.CERTIFICATE,
+            settings.PASSWORD,
+            verify_responses=settings.VERIFY_RESPONSES,
+            observer=settings.OBSERVER,
+        ),
+        plugins,
+    )
+    # Call the service
+    service = client.bind("SecurityTokenService", "WS2007HttpBinding_IWSTrust13Sync2")
+    with phase(settings.OBSERVER, IPSTS) as measured:
+        try:
+            response = await service.Trust13Issue(_value_1=_identity_request(client, settings))
+        except (Error, XmlsecError, HTTPError) as err:
+            _log_history(history, settings, "IPSTS", success=False)
+            raise NiaException(err) from err
+        assertion = _get_token_assertion(response)
+        measured.size = _assertion_size(settings, assertion)
+    _log_history(history, settings, "IPSTS")
+    return assertion
+
+
+async def _call_federation(settings: CzNiaAppSettings, transport: AsyncTransport, assertion: Element) -> Element:
+    """Call FPSTS (Federation provider) service and return the assertion."""
+    plugins, history = _get_history(settings)
+    client = await _get_client(
+        settings,
+        settings.FEDERATION_WSDL,
+        transport,
+        SAMLTokenSignature(assertion, verify_responses=settings.VERIFY_RESPONSES, observer=settings.OBSERVER),
+        plugins,
+    )
+    # Call the service
+    service = client.bind("SecurityTokenService", "WS2007FederationHttpBinding_IWSTrust13Sync")
+    with phase(settings.OBSERVER, FPSTS) as measured:
+        try:
+            response = await service.Trust13Issue(_value_1=_federation_request(client, settings))
+        except (Error, XmlsecError, HTTPError) as err:
+            _log_history(history, settings, "FPSTS", success=False)
+            raise NiaException(err) from err
+        assertion = _get_token_assertion(response)
+        measured.size = _assertion_size(settings, assertion)
+    _log_history(history, settings, "FPSTS")
+    return assertion
+
+
+async def _call_submission(
+    settings: CzNiaAppSettings, transport: AsyncTransport, assertion, message: NiaMessage
+) -> bytes:
+    """Call Submission service and return the body.
+
+    See `cz_nia.functions._call_submission` for the `SUBMISSION_DIRECT` setting.
+    """
+    plugins, history = _get_history(settings)
+    wsse = SAMLTokenSignature(assertion, verify_responses=settings.VERIFY_RESPONSES, observer=settings.OBSERVER)
+    bodies = [message.pack(settings.VALIDATION_RATE, settings.OBSERVER)]
+    with phase(settings.OBSERVER, SUBMISSION) as measured:
+        if settings.SUBMISSION_DIRECT:
+            template = await _get_template(settings)
+            try:
+                envelope, headers = _submission_envelope(template, wsse, history, message.action, bodies)
+                response = await transport.post_xml(template.address, envelope, headers)
+                body = _submission_result(template, response, wsse, history)
+            except (Error, XmlsecError, HTTPError) as err:
+                _log_history(history, settings, "Submission", success=False)
+                raise NiaException(err) from err
+        else:
+            client = await _get_client(settings, settings.PUBLIC_WSDL, transport, wsse, plugins)
+            # Call the service
+            service = client.bind("Public", "Token")
+            try:
+                response = await service.Submit(message.action, _submission_bodies(client, bodies), "")
+            except (Error, XmlsecError, HTTPError) as err:
+                _log_history(history, settings, "Submission", success=False)
+                raise NiaException(err) from err
+            body = response.BodyBase64XML
+        measured.size = len(body)
+    _log_history(history, settings, "Submission")
+    return _decode_body(body)
+
+
+async def _submit(settings: CzNiaAppSettings, transport: Optional[AsyncTransport], message: NiaMessage) -> Any:
+    """Run the whole call chain for the message and return the unpacked response."""
+    if transport is None:
+        transport = get_transport(settings)
+    fp_assertion = await _call_identity(settings, transport)
+    sub_assertion = await _call_federation(settings, transport, fp_assertion)
+    body = await _call_submission(settings, transport, sub_assertion, message)
+    return message.unpack(body, settings.OBSERVER)
+
+
+async def get_pseudonym(
+    settings: CzNiaAppSettings, user_data: dict[str, Any], transport: Optional[AsyncTransport] = None
+) -> str:
+    """Get pseudonym from NIA servers for given user data."""
+    return await _submit(settings, transport, IdentificationMessage(user_data))
+
+
+async def write_authenticator(settings: CzNiaAppSettings, data, transport: Optional[AsyncTransport] = None):
+    """Write the issued VIP."""
+    return await _submit(settings, transport, WriteAuthenticatorMessage(data))
+
+
+async def change_authenticator(
+    settings: CzNiaAppSettings, data: dict[str, str], transport: Optional[AsyncTransport] = None
+):
+    """Write a change to the VIP."""
+    return await _submit(settings, transport, ChangeAuthenticatorMessage(data))
+
+
+async def get_notification(
+    settings: CzNiaAppSettings, data: Optional[dict[str, str]] = None, transport: Optional[AsyncTransport] = None
+) -> NotificationResult:
+    """Get notifications."""
+    return await _submit(settings, transport, NotificationMessage(data, records=settings.NOTIFICATION_RECORDS))
+
+
+async def stream_notification(
+    settings: CzNiaAppSettings, data: Optional[dict[str, str]] = None, transport: Optional[AsyncTransport] = None
+) -> NotificationStream:
+    """Get notifications parsed incrementally, see `NotificationStream`."""
+    return await _submit(settings, transport, NotificationStreamMessage(data, records=settings.NOTIFICATION_RECORDS))
+
+
+class AsyncNiaClient:
+    """Asynchronous client reusing the assertions from IPSTS and FPSTS until they expire.
+
+    Counterpart of `cz_nia.client.NiaClient` for use within a single event loop.
+    """
+
+    def __init__(
+        self,
+        settings: CzNiaAppSettings,
+        transport: Optional[AsyncTransport] = None,
+        pseudonym_cache: Optional[PseudonymCache] = None,
+        observer: Optional[Observer] = None,
+    ):
+        """Store the settings and use the transport shared within the running event loop unless a transport is provided.
+
+        Pseudonyms are cached in the `pseudonym_cache`, by default the one according to settings, if enabled.
+        The `observer` of the phases of the calls overrides the one in settings.
+        """
+        if observer is not None:
+            settings = copy(settings)
+            settings.OBSERVER = observer
+        self.settings = settings
+        self._transport = transport
+        if pseudonym_cache is None:
+            pseudonym_cache = PseudonymCache.from_settings(settings)
+        self.pseudonym_cache = pseudonym_cache
+        self._identity_token: Optional[Token] = None
+        self._federation_token: Optional[Token] = None
+        self._flight: AsyncSingleFlight[Token] = AsyncSingleFlight()
+
+    @property
+    def transport(self) -> AsyncTransport:
+        """Return the provided transport or the one shared within the running event loop."""
+        if self._transport is None:
+            return get_transport(self.settings)
+        return self._transport
+
+    def invalidate(self) -> None:
+        """Drop the cached assertions."""
+        self._identity_token = None
+        self._federation_token = None
+
+    async def _renew_token(self, margin: float) -> Token:
+        """Request a new assertion for the Submission service and replace the current one.
+
+        The assertion from IPSTS is reused if it is valid for at least `margin` seconds.
+        """
+        identity_token = self._identity_token
+        if identity_token is None or not identity_token.is_valid(margin):
+            fp_assertion = await _call_identity(self.settings, self.transport)
+            identity_token = self._identity_token = Token(fp_assertion, get_assertion_expiry(fp_assertion))
+        sub_assertion = await _call_federation(self.settings, self.transport, identity_token.assertion)
+        token = self._federation_token = Token(sub_assertion, get_assertion_expiry(sub_assertion))
+        return token
+
+    async def _get_valid_token(self, margin: float) -> Token:
+        """Return the current assertion if valid for at least `margin` seconds, otherwise renew it.
+
+        The validity is checked again within the flight, as the previous flight may have just renewed the assertion.
+        """
+        token = self._federation_token
+        if token is not None and token.is_valid(margin):
+            return token
+        return await self._renew_token(margin)
+
+    async def get_assertion(self) -> Element:
+        """Return a valid assertion for the Submission service, request a new one if necessary.
+
+        Concurrent calls share a single request, including its failure.
+        """
+        margin = self.settings.TOKEN_EXPIRY_MARGIN
+        token = self._federation_token
+        if token is None or not token.is_valid(margin):
+            token = await self._flight.do(lambda: self._get_valid_token(margin))
+        return token.assertion
+
+    async def submit(self, message: NiaMessage) -> Any:
+        """Send the message to the Submission service and return the unpacked response."""
+        body = await _call_submission(self.settings, self.transport, await self.get_assertion(), message)
+        return message.unpack(body, self.settings.OBSERVER)
+
+    async def get_pseudonym(self, user_data: dict[str, Any]) -> str:
+        """Get pseudonym from NIA servers for given user data, unless it is in the pseudonym cache."""
+        if self.pseudonym_cache is None:
+            return await self.submit(IdentificationMessage(user_data))
+        pseudonym = self.pseudonym_cache.get(user_data)
+        if pseudonym is None:
+            pseudonym = await self.submit(IdentificationMessage(user_data))
+            self.pseudonym_cache.set(user_data, pseudonym)
+        return pseudonym
+
+    async def write_authenticator(self, data):
+        """Write the issued VIP."""
+        return await self.submit(WriteAuthenticatorMessage(data))
+
+    async def change_authenticator(self, data: dict[str, str]):
+        """Write a change to the VIP."""
+        return await self.submit(ChangeAuthenticatorMessage(data))
+
+    async def get_notification(self, data: Optional[dict[str, str]] = None) -> NotificationResult:
+        """Get notifications."""
+        return await self.submit(NotificationMessage(data, records=self.settings.NOTIFICATION_RECORDS))
+
+    async def stream_notification(self, data: Optional[dict[str, str]] = None) -> NotificationStream:
+        """Get notifications parsed incrementally, see `NotificationStream`."""
+        return await self.submit(NotificationStreamMessage(data, records=self.settings.NOTIFICATION_RECORDS))
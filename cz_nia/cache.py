@@ -0,0 +1,100 @@
+"""In-memory cache of the pseudonyms."""
+
+import hmac
+import os
+import unicodedata
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+from typing import Any, Optional
+
+from cz_nia.settings import CzNiaAppSettings
+
+# Fields of the user data sent in IdentificationMessage
+IDENTITY_FIELDS = ("first_name", "last_name", "birth_date", "address")
+
+
+def _normalize(value: Any) -> str:
+    """Return the normalized value of the identity field.
+
+    Only differences irrelevant to NIA are removed, i.e. unicode normalization forms and whitespace.
+    Case and diacritics are kept, NIA compares them.
+    """
+    if value is None:
+        return ""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return " ".join(unicodedata.normalize("NFC", str(value)).split())
+
+
+class PseudonymCache:
+    """Thread-safe cache of the pseudonyms with time to live and least recently used eviction.
+
+    Entries are keyed by a HMAC of the identity data, so the cache does not hold any personal data except pseudonyms.
+    Only successful identifications are stored, so the cache never causes additional calls to NIA.
+    """
+
+    def __init__(self, ttl: float, max_entries: int = 1000, secret: Optional[bytes] = None):
+        """Set up the cache.
+
+        Entries expire after `ttl` seconds, at most `max_entries` are kept.
+        The `secret` for the HMAC is generated randomly unless provided.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._secret = secret if secret is not None else os.urandom(32)
+        self._entries: OrderedDict[bytes, tuple[float, str]] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls, settings: CzNiaAppSettings) -> Optional["PseudonymCache"]:
+        """Return the cache according to settings or `None` if it is disabled."""
+        if not settings.PSEUDONYM_CACHE_TTL:
+            return None
+        secret = settings.PSEUDONYM_CACHE_SECRET
+        if isinstance(secret, str):
+            secret = secret.encode()
+        return cls(settings.PSEUDONYM_CACHE_TTL, settings.PSEUDONYM_CACHE_SIZE, secret)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_key(self, user_data: dict[str, Any]) -> bytes:
+        """Return the key of the user data."""
+        # Unit separator can't be part of the normalized values
+        message = "\x1f".join(_normalize(user_data.get(field)) for field in IDENTITY_FIELDS)
+        return hmac.new(self._secret, message.encode(), sha256).digest()
+
+    def get(self, user_data: dict[str, Any]) -> Optional[str]:
+        """Return the cached pseudonym or `None` if it isn't cached or has expired."""
+        key = self.get_key(user_data)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_data: dict[str, Any], pseudonym: str) -> None:
+        """Store the pseudonym, evict the least recently used entries if the cache is full."""
+        key = self.get_key(user_data)
+        with self._lock:
+            self._entries[key] = (monotonic() + self.ttl, pseudonym)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all entries and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,260 @@
+"""Long-lived client for communication with NIA."""
+
+import logging
+from collections.abc import Iterator, Sequence
+from copy import copy
+from threading import Event, Thread
+from typing import Any, Optional
+
+from lxml.etree import Element
+from zeep.transports import Transport
+
+from cz_nia.cache import PseudonymCache
+from cz_nia.exceptions import NiaException
+from cz_nia.functions import (
+    _call_federation,
+    _call_identity,
+    _call_submission,
+    _iter_pages,
+    _submit_batch,
+    get_transport,
+)
+from cz_nia.instrumentation import Observer
+from cz_nia.message import (
+    ChangeAuthenticatorMessage,
+    IdentificationMessage,
+    NiaMessage,
+    NotificationData,
+    NotificationMessage,
+    NotificationResult,
+    NotificationStream,
+    NotificationStreamMessage,
+    WriteAuthenticatorMessage,
+)
+from cz_nia.settings import CzNiaAppSettings
+from cz_nia.tokens import SingleFlight, SqliteTokenStore, Token, get_assertion_expiry
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class NiaClient:
+    """Client reusing the assertions from IPSTS and FPSTS until they expire.
+
+    Every call to the public functions in `cz_nia.functions` requests new assertions from both STS services.
+    The client keeps them and only calls the Submission service for as long as they are valid.
+    """
+
+    def __init__(
+        self,
+        settings: CzNiaAppSettings,
+        transport: Optional[Transport] = None,
+        token_store: Optional[SqliteTokenStore] = None,
+        pseudonym_cache: Optional[PseudonymCache] = None,
+        observer: Optional[Observer] = None,
+    ):
+        """Store the settings and use the shared transport unless a transport is provided.
+
+        Assertions are shared with other processes through the `token_store`,
+        by default the one in `TOKEN_STORE_PATH` if set.
+        Pseudonyms are cached in the `pseudonym_cache`, by default the one according to settings, if enabled.
+        The `observer` of the phases of the calls overrides the one in settings.
+        """
+        if observer is not None:
+            settings = copy(settings)
+            settings.OBSERVER = observer
+        self.settings = settings
+        if transport is None:
+            transport = get_transport(settings)
+        self.transport = transport
+        if token_store is None and settings.TOKEN_STORE_PATH:
+            token_store = SqliteTokenStore(settings.TOKEN_STORE_PATH)
+        self.token_store = token_store
+        if pseudonym_cache is None:
+            pseudonym_cache = PseudonymCache.from_settings(settings)
+        self.pseudonym_cache = pseudonym_cache
+        self._identity_token: Optional[Token] = None
+        self._federation_token: Optional[Token] = None
+        self._flight: SingleFlight[Token] = SingleFlight()
+        self._refresher: Optional[TokenRefresher] = None
+
+    def __enter__(self) -> "NiaClient":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def start_refresh(self, margin: Optional[float] = None) -> None:
+        """Start renewing the assertions in background before they expire.
+
+        Assertions are renewed when they expire within `margin` seconds, `TOKEN_REFRESH_MARGIN` by default.
+        """
+        if self._refresher is not None:
+            return
+        if margin is None:
+            margin = self.settings.TOKEN_REFRESH_MARGIN
+        self._refresher = TokenRefresher(self, margin)
+        self._refresher.start()
+
+    def close(self) -> None:
+        """Stop the background refresh, if running."""
+        if self._refresher is not None:
+            self._refresher.stop()
+            self._refresher = None
+
+    @property
+    def token(self) -> Optional[Token]:
+        """Return the current assertion for the Submission service."""
+        return self._federation_token
+
+    def invalidate(self) -> None:
+        """Drop the cached assertions."""
+        self._identity_token = None
+        self._federation_token = None
+
+    def _request_token(self, margin: float) -> Token:
+        """Request a new assertion for the Submission service.
+
+        The assertion from IPSTS is reused if it is valid for at least `margin` seconds.
+        """
+        identity_token = self._identity_token
+        if identity_token is None or not identity_token.is_valid(margin):
+            fp_assertion = _call_identity(self.settings, self.transport)
+            identity_token = self._identity_token = Token(fp_assertion, get_assertion_expiry(fp_assertion))
+        sub_assertion = _call_federation(self.settings, self.transport, identity_token.assertion)
+        return Token(sub_assertion, get_assertion_expiry(sub_assertion))
+
+    def _get_token(self, margin: float) -> Token:
+        """Return the assertion valid for at least `margin` seconds from the token store or request a new one."""
+        if self.token_store is None:
+            return self._request_token(margin)
+        key = "{} {}".format(self.settings.CERTIFICATE, self.settings.PUBLIC_ADDRESS)
+        return self.token_store.get_or_request(key, margin, lambda: self._request_token(margin))
+
+    def _renew_token(self, margin: float) -> Token:
+        """Replace the current assertion by the one from `_get_token`."""
+        token = self._federation_token = self._get_token(margin)
+        return token
+
+    def _get_valid_token(self, margin: float) -> Token:
+        """Return the current assertion if valid for at least `margin` seconds, otherwise renew it.
+
+        The validity is checked again within the flight, as the previous flight may have just renewed the assertion.
+        """
+        token = self._federation_token
+        if token is not None and token.is_valid(margin):
+            return token
+        return self._renew_token(margin)
+
+    def get_assertion(self) -> Element:
+        """Return a valid assertion for the Submission service, request a new one if necessary.
+
+        Concurrent calls share a single request, including its failure.
+        """
+        margin = self.settings.TOKEN_EXPIRY_MARGIN
+        token = self._federation_token
+        if token is None or not token.is_valid(margin):
+            token = self._flight.do(lambda: self._get_valid_token(margin))
+        return token.assertion
+
+    def refresh(self, margin: float = 0) -> None:
+        """Renew the assertion for the Submission service.
+
+        The assertion is taken from the token store if another process already renewed it,
+        i.e. it is valid for at least `margin` seconds, otherwise a new one is requested.
+        Calls in progress keep using the current assertion, it is replaced only once the new one is available.
+        """
+        self._flight.do(lambda: self._renew_token(margin))
+
+    def submit(self, message: NiaMessage) -> Any:
+        """Send the message to the Submission service and return the unpacked response."""
+        body = _call_submission(self.settings, self.transport, self.get_assertion(), message)
+        return message.unpack(body, self.settings.OBSERVER)
+
+    def submit_batch(self, messages: Sequence[NiaMessage]) -> list[Any]:
+        """Send the messages of the same action in a single request to the Submission service.
+
+        Results are in the order of the messages, `NiaException` takes place of the failed ones.
+        """
+        return _submit_batch(self.settings, self.transport, self.get_assertion(), messages)
+
+    def get_pseudonym(self, user_data: dict[str, Any]) -> str:
+        """Get pseudonym from NIA servers for given user data, unless it is in the pseudonym cache."""
+        if self.pseudonym_cache is None:
+            return self.submit(IdentificationMessage(user_data))
+        pseudonym = self.pseudonym_cache.get(user_data)
+        if pseudonym is None:
+            pseudonym = self.submit(IdentificationMessage(user_data))
+            self.pseudonym_cache.set(user_data, pseudonym)
+        return pseudonym
+
+    def write_authenticator(self, data):
+        """Write the issued VIP."""
+        return self.submit(WriteAuthenticatorMessage(data))
+
+    def change_authenticator(self, data: dict[str, str]):
+        """Write a change to the VIP."""
+        return self.submit(ChangeAuthenticatorMessage(data))
+
+    def get_notification(self, data: Optional[dict[str, str]] = None) -> NotificationResult:
+        """Get notifications."""
+        return self.submit(NotificationMessage(data, records=self.settings.NOTIFICATION_RECORDS))
+
+    def get_notification_page(self, last_id: Optional[int] = None) -> NotificationResult:
+        """Get notifications following the notification with `last_id`."""
+        return self.get_notification(None if last_id is None else {"id": str(last_id)})
+
+    def iter_notifications(self, start_id: Optional[int] = None) -> Iterator[NotificationData]:
+        """Yield all notifications after `start_id`, requesting the following pages as necessary.
+
+        The next page is requested in background while the notifications from the current one are consumed.
+        """
+        return _iter_pages(self.get_notification_page, start_id)
+
+    def stream_notification(self, data: Optional[dict[str, str]] = None) -> NotificationStream:
+        """Get notifications parsed incrementally, see `NotificationStream`."""
+        return self.submit(NotificationStreamMessage(data, records=self.settings.NOTIFICATION_RECORDS))
+
+
+class TokenRefresher:
+    """Renew the assertions of the client in a background thread before they expire."""
+
+    # Seconds to wait before the next attempt if the refresh fails or the expiry is unknown
+    retry_interval = 30.0
+
+    def __init__(self, client: NiaClient, margin: float):
+        """Prepare the thread, assertions are renewed when they expire within `margin` seconds."""
+        self.client = client
+        self.margin = margin
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="cz_nia-token-refresher", daemon=True)
+
+    def start(self) -> None:
+        """Start the background thread."""
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop the background thread and wait for it to finish."""
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def get_delay(self) -> float:
+        """Return the number of seconds until the next refresh."""
+        token = self.client.token
+        if token is None:
+            # No assertion yet, get one right away
+            return 0
+        remaining = token.remaining()
+        if remaining is None:
+            return self.retry_interval
+        return max(remaining - self.margin, 0)
+
+    def _run(self) -> None:
+        """Refresh the assertions until stopped."""
+        delay = self.get_delay()
+        while not self._stopped.wait(delay):
+            try:
+                self.client.refresh(self.margin)
+            except NiaException as err:
+                _LOGGER.warning("Refresh of NIA assertions failed: %s", err)
+            # Do not retry immediately if the refresh failed or the new assertions are short-lived
+            delay = max(self.get_delay(), self.retry_interval)
@@ -0,0 +1,133 @@
+"""Consumer of the notifications with a durable checkpoint."""
+
+import logging
+import sqlite3
+from collections.abc import Callable
+from threading import Event
+from typing import Optional
+
+from cz_nia.client import NiaClient
+from cz_nia.exceptions import NiaException
+from cz_nia.functions import _iter_results
+from cz_nia.message import NotificationData
+
+_LOGGER = logging.getLogger(__name__)
+
+Handler = Callable[[list[NotificationData]], None]
+
+
+class SqliteCheckpointStore:
+    """Store of the ids of the last processed notifications."""
+
+    def __init__(self, path: str, timeout: float = 60):
+        """Create the database if necessary."""
+        self.path = path
+        self.timeout = timeout
+        connection = self._connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, last_id INTEGER NOT NULL)"
+            )
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return a new connection to the database in autocommit mode."""
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    def get(self, name: str) -> Optional[int]:
+        """Return the stored checkpoint."""
+        connection = self._connect()
+        try:
+            row = connection.execute("SELECT last_id FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row is not None else None
+
+    def set(self, name: str, last_id: int) -> None:
+        """Store the checkpoint durably."""
+        connection = self._connect()
+        try:
+            connection.execute("INSERT OR REPLACE INTO checkpoints (name, last_id) VALUES (?, ?)", (name, last_id))
+        finally:
+            connection.close()
+
+
+class NotificationConsumer:
+    """Pass all new notifications to the handler, page by page, and keep track of the processed ones.
+
+    The checkpoint is advanced only after the handler processes the page successfully,
+    so each notification is processed at least once even if the process crashes.
+    Checkpoints are written to the store after every `commit_pages` pages and whenever the processing stops.
+    """
+
+    def __init__(
+        self,
+        client: NiaClient,
+        handler: Handler,
+        store: SqliteCheckpointStore,
+        name: str = "notifications",
+        commit_pages: int = 10,
+    ):
+        """Prepare the consumer, the checkpoint is kept in the `store` under `name`."""
+        self.client = client
+        self.handler = handler
+        self.store = store
+        self.name = name
+        self.commit_pages = commit_pages
+        self._stopped = Event()
+        self._last_id: Optional[int] = None
+        self._committed_id: Optional[int] = None
+        self._pending_pages = 0
+
+    @property
+    def last_id(self) -> Optional[int]:
+        """Return the id of the last processed notification."""
+        return self._last_id
+
+    def commit(self) -> None:
+        """Write the checkpoint to the store, if it has advanced."""
+        if self._last_id is not None and self._last_id != self._committed_id:
+            self.store.set(self.name, self._last_id)
+            self._committed_id = self._last_id
+        self._pending_pages = 0
+
+    def run_once(self) -> int:
+        """Process all the pages of new notifications and return the number of processed notifications.
+
+        Exceptions from the handler and NiaException are raised after the checkpoint of the processed pages is stored.
+        """
+        self._last_id = self._committed_id = self.store.get(self.name)
+        count = 0
+        try:
+            for result in _iter_results(self.client.get_notification_page, self._last_id):
+                if result.notifications:
+                    self.handler(result.notifications)
+                    count += len(result.notifications)
+                if result.last_id is not None:
+                    self._last_id = result.last_id
+                    self._pending_pages += 1
+                if self._pending_pages >= self.commit_pages:
+                    self.commit()
+                if self._stopped.is_set():
+                    break
+        finally:
+            self.commit()
+        return count
+
+    def run(self, poll_interval: float = 60) -> None:
+        """Process the notifications every `poll_interval` seconds until stopped.
+
+        Failures of NIA are logged and retried, exceptions from the handler stop the consumer.
+        """
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except NiaException as err:
+                _LOGGER.warning("Processing of NIA notifications failed: %s", err)
+            self._stopped.wait(poll_interval)
+
+    def stop(self) -> None:
+        """Stop the consumer after the current page."""
+        self._stopped.set()
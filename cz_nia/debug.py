@@ -0,0 +1,90 @@
+"""Capture of the exchanged envelopes for debugging."""
+
+import logging
+from collections import deque
+from copy import deepcopy
+from threading import Lock
+from typing import NamedTuple, Optional
+
+from lxml.etree import XPath, _Element, tostring
+from zeep import ns
+
+_LOGGER = logging.getLogger(__name__)
+
+# Text replacing the redacted content
+REDACTED = "[redacted]"
+SAML_ASSERTION = "urn:oasis:names:tc:SAML:1.0:assertion"
+WS_TRUST = "http://docs.oasis-open.org/ws-sx/ws-trust/200512"
+# Certificates and proof keys are redacted completely, assertions keep their attributes
+_FIND_SECRETS = XPath(
+    "//wsse:BinarySecurityToken | //ds:X509Certificate | //trust:BinarySecret",
+    namespaces={"wsse": ns.WSSE, "ds": ns.DS, "trust": WS_TRUST},
+)
+_FIND_ASSERTIONS = XPath("//saml:Assertion", namespaces={"saml": SAML_ASSERTION})
+
+
+def format_envelope(envelope: _Element) -> str:
+    """Return the pretty printed envelope with the certificates, proof keys and assertion bodies redacted."""
+    envelope = deepcopy(envelope)
+    for secret in _FIND_SECRETS(envelope):
+        secret.text = REDACTED
+    for assertion in _FIND_ASSERTIONS(envelope):
+        for child in list(assertion):
+            assertion.remove(child)
+        assertion.text = REDACTED
+    return tostring(envelope, pretty_print=True, encoding="unicode")
+
+
+class Envelope:
+    """Envelope which is formatted only when converted to string."""
+
+    __slots__ = ("envelope",)
+
+    def __init__(self, envelope: _Element):
+        self.envelope = envelope
+
+    def __str__(self) -> str:
+        return format_envelope(self.envelope)
+
+
+class Exchange(NamedTuple):
+    """Envelopes exchanged with the endpoint."""
+
+    endpoint: str
+    success: bool
+    sent: Envelope
+    received: Optional[Envelope]
+
+
+_EXCHANGES: dict[str, deque[Exchange]] = {}
+_EXCHANGES_LOCK = Lock()
+
+
+def capture(endpoint: str, sent: _Element, received: Optional[_Element], success: bool, size: int) -> None:
+    """Keep the last `size` exchanges with the endpoint and log them.
+
+    The envelopes are only serialized if the debug log records are emitted.
+    """
+    exchange = Exchange(endpoint, success, Envelope(sent), None if received is None else Envelope(received))
+    with _EXCHANGES_LOCK:
+        exchanges = _EXCHANGES.get(endpoint)
+        if exchanges is None or exchanges.maxlen != size:
+            exchanges = _EXCHANGES[endpoint] = deque(exchanges or (), maxlen=size)
+        exchanges.append(exchange)
+    if not success:
+        _LOGGER.debug("Exception in %s endpoint", endpoint)
+    _LOGGER.debug("Message sent to %s endpoint:\n%s", endpoint, exchange.sent)
+    if exchange.received is not None:
+        _LOGGER.debug("Message received from %s endpoint:\n%s", endpoint, exchange.received)
+
+
+def get_exchanges(endpoint: str) -> list[Exchange]:
+    """Return the captured exchanges with the endpoint, the oldest first."""
+    with _EXCHANGES_LOCK:
+        return list(_EXCHANGES.get(endpoint, ()))
+
+
+def clear_exchanges() -> None:
+    """Drop all the captured exchanges."""
+    with _EXCHANGES_LOCK:
+        _EXCHANGES.clear()
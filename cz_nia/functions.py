@@ -1,34 +1,56 @@
 """Views for communication with NIA."""
 
+import binascii
 from base64 import b64decode
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import deepcopy
 from enum import Enum, unique
-from typing import Any, Optional
+from threading import Lock
+from typing import Any, NamedTuple, Optional, Union
+from uuid import uuid4
 
-from lxml.etree import Element, QName, tostring
+from lxml.etree import Element, ETXPath, QName, SubElement, tostring
+from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 from xmlsec import Error as XmlsecError
 from zeep import Client, Settings
 from zeep.cache import SqliteCache
-from zeep.exceptions import Error
-from zeep.ns import WSA, WSP
+from zeep.exceptions import Error, TransportError
+from zeep.loader import parse_xml
+from zeep.ns import SOAP_ENV_12, WSA, WSP
 from zeep.plugins import HistoryPlugin
 from zeep.transports import Transport
+from zeep.wsdl import Document
 from zeep.xsd import AnyObject
 
+from cz_nia.debug import capture
 from cz_nia.exceptions import NiaException
+from cz_nia.instrumentation import FPSTS, IPSTS, SUBMISSION, phase
 from cz_nia.message import (
     ChangeAuthenticatorMessage,
     IdentificationMessage,
     NiaMessage,
+    NotificationData,
     NotificationMessage,
     NotificationResult,
+    NotificationStream,
+    NotificationStreamMessage,
     WriteAuthenticatorMessage,
+    unpack_batch,
 )
 from cz_nia.settings import CzNiaAppSettings
 from cz_nia.wsse.signature import BinarySignature, SAMLTokenSignature
 
 SETTINGS = Settings(forbid_entities=False, strict=False)
 ASSERTION = "urn:oasis:names:tc:SAML:1.0:assertion"
+# Parsed WSDL documents shared by all clients
+_DOCUMENTS: dict[str, Document] = {}
+_DOCUMENTS_LOCK = Lock()
+# Transports shared by all calls with the same transport settings
+_TRANSPORTS: dict[tuple, Transport] = {}
+_TRANSPORTS_LOCK = Lock()
 
 
 @unique
@@ -40,17 +62,80 @@ class NiaNamespaces(str, Enum):
 
 
 def _log_history(history: Optional[HistoryPlugin], settings: CzNiaAppSettings, endpoint: str, success: bool = True):
-    """Print debug info from history plugin."""
+    """Capture debug info from history plugin, see `cz_nia.debug`."""
     if settings.DEBUG:
         assert history is not None
-        if not success:
-            print("Exception in {} endpoint:".format(endpoint))
-        print("Message sent to {} endpoint:".format(endpoint))
-        print(tostring(history.last_sent["envelope"], pretty_print=True, encoding="unicode"))
-        print("Message received from {} endpoint:".format(endpoint))
         last_received = history.last_received
-        if last_received is not None:
-            print(tostring(last_received["envelope"], pretty_print=True, encoding="unicode"))
+        capture(
+            endpoint,
+            history.last_sent["envelope"],
+            None if last_received is None else last_received["envelope"],
+            success,
+            settings.DEBUG_HISTORY_SIZE,
+        )
+
+
+def _transport_key(settings: CzNiaAppSettings) -> tuple:
+    """Return the settings which the transport depends on."""
+    return (
+        settings.CACHE_PATH,
+        settings.CACHE_TIMEOUT,
+        settings.TRANSPORT_TIMEOUT,
+        settings.POOL_CONNECTIONS,
+        settings.POOL_MAXSIZE,
+        settings.KEEP_ALIVE,
+    )
+
+
+def _create_transport(settings: CzNiaAppSettings) -> Transport:
+    """Create a transport with a connection pool according to settings."""
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=settings.POOL_CONNECTIONS, pool_maxsize=settings.POOL_MAXSIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not settings.KEEP_ALIVE:
+        session.headers["Connection"] = "close"
+    return Transport(
+        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT),
+        timeout=settings.TRANSPORT_TIMEOUT,
+        session=session,
+    )
+
+
+def get_transport(settings: CzNiaAppSettings) -> Transport:
+    """Return the transport shared by all calls with the same transport settings.
+
+    Connections in its pool are kept alive and reused by subsequent calls.
+    """
+    key = _transport_key(settings)
+    with _TRANSPORTS_LOCK:
+        if key not in _TRANSPORTS:
+            _TRANSPORTS[key] = _create_transport(settings)
+        return _TRANSPORTS[key]
+
+
+def _get_document(wsdl: str, transport: Transport) -> Document:
+    """Return the parsed WSDL document.
+
+    Each WSDL is parsed only once per process, all documents share the module-wide zeep `SETTINGS`.
+    """
+    document = _DOCUMENTS.get(wsdl)
+    if document is None:
+        with _DOCUMENTS_LOCK:
+            document = _DOCUMENTS.get(wsdl)
+            if document is None:
+                document = Document(wsdl, transport, settings=SETTINGS)  # type: ignore[arg-type]
+                _DOCUMENTS[wsdl] = document
+    return document
+
+
+def _get_client(wsdl: str, transport: Transport, wsse: Any, plugins: list) -> Client:
+    """Return a client for the WSDL.
+
+    The client itself is cheap to create as it reuses the parsed WSDL document.
+    Creating it for every call keeps the `wsse` plugin private to the call, so it is safe to use from threads.
+    """
+    return Client(_get_document(wsdl, transport), wsse=wsse, settings=SETTINGS, transport=transport, plugins=plugins)
 
 
 def _get_wsa_header(client: Client, address: str) -> AnyObject:
@@ -61,20 +146,16 @@ def _get_wsa_header(client: Client, address: str) -> AnyObject:
     return AnyObject(applies_type, applies_type(_value_1=reference))
 
 
-def _call_identity(settings: CzNiaAppSettings, transport: Transport) -> Element:
-    """Call IPSTS (Identity provider) service and return the assertion."""
-    plugins = []
-    history = None
+def _get_history(settings: CzNiaAppSettings) -> tuple[list, Optional[HistoryPlugin]]:
+    """Return plugins for the client and the history plugin if debug is enabled."""
     if settings.DEBUG:
         history = HistoryPlugin()
-        plugins.append(history)
-    client = Client(
-        settings.IDENTITY_WSDL,
-        wsse=BinarySignature(settings.KEY, settings.CERTIFICATE, settings.PASSWORD),
-        settings=SETTINGS,
-        transport=transport,
-        plugins=plugins,
-    )
+        return [history], history
+    return [], None
+
+
+def _identity_request(client: Client, settings: CzNiaAppSettings) -> list[AnyObject]:
+    """Prepare the content of the IPSTS request."""
     # Prepare token
     token_type = client.get_element(QName(NiaNamespaces.WS_TRUST.value, "TokenType"))
     token = AnyObject(token_type, token_type(ASSERTION))
@@ -86,121 +167,446 @@ def _call_identity(settings: CzNiaAppSettings, transport: Transport) -> Element:
     key = AnyObject(key_type, key_type(NiaNamespaces.WS_TRUST.value + "/SymmetricKey"))
     # Prepare WSA header
     applies = _get_wsa_header(client, settings.FEDERATION_ADDRESS)
+    return [token, request, key, applies]
+
+
+def _federation_request(client: Client, settings: CzNiaAppSettings) -> list[AnyObject]:
+    """Prepare the content of the FPSTS request."""
+    # prepare request
+    request_type = client.get_element(QName(NiaNamespaces.WS_TRUST.value, "RequestType"))
+    request = AnyObject(request_type, request_type(NiaNamespaces.WS_TRUST.value + "/Issue"))
+    # Prepare WSA header
+    applies = _get_wsa_header(client, settings.PUBLIC_ADDRESS)
+    return [applies, request]
+
+
+def _submission_bodies(client: Client, bodies: Sequence[Element]) -> Any:
+    """Prepare the bodies of the Submission request from the packed messages."""
+    bodies_type = client.get_type(QName(NiaNamespaces.SUBMISSION.value, "ArrayOfBodyPart"))
+    body_part_type = client.get_type(QName(NiaNamespaces.SUBMISSION.value, "BodyPart"))
+    return bodies_type([body_part_type(Body={"_value_1": body}) for body in bodies])
+
+
+def _get_token_assertion(response: Any) -> Element:
+    """Return the assertion from the STS response."""
+    return response.RequestSecurityTokenResponse[0]["_value_1"][3]["_value_1"]
+
+
+def _assertion_size(settings: CzNiaAppSettings, assertion: Element) -> Optional[int]:
+    """Return the size of the issued assertion in bytes, which makes up most of the STS response.
+
+    The assertion is serialized only for the observer, None is returned without it.
+    """
+    if settings.OBSERVER is None:
+        return None
+    return len(tostring(assertion))
+
+
+def _call_identity(settings: CzNiaAppSettings, transport: Transport) -> Element:
+    """Call IPSTS (Identity provider) service and return the assertion."""
+    plugins, history = _get_history(settings)
+    client = _get_client(
+        settings.IDENTITY_WSDL,
+        transport,
+        BinarySignature(
+            settings.KEY,
+            settings.CERTIFICATE,
+            settings.PASSWORD,
+            verify_responses=settings.VERIFY_RESPONSES,
+            observer=settings.OBSERVER,
+        ),
+        plugins,
+    )
     # Call the service
     service = client.bind("SecurityTokenService", "WS2007HttpBinding_IWSTrust13Sync2")
-    try:
-        response = service.Trust13Issue(_value_1=[token, request, key, applies])
-    except (Error, XmlsecError, RequestException) as err:
-        _log_history(history, settings, "IPSTS", success=False)
-        raise NiaException(err) from err
+    with phase(settings.OBSERVER, IPSTS) as measured:
+        try:
+            response = service.Trust13Issue(_value_1=_identity_request(client, settings))
+        except (Error, XmlsecError, RequestException) as err:
+            _log_history(history, settings, "IPSTS", success=False)
+            raise NiaException(err) from err
+        assertion = _get_token_assertion(response)
+        measured.size = _assertion_size(settings, assertion)
     _log_history(history, settings, "IPSTS")
-    return response.RequestSecurityTokenResponse[0]["_value_1"][3]["_value_1"]
+    return assertion
 
 
 def _call_federation(settings: CzNiaAppSettings, transport: Transport, assertion: Element) -> Element:
     """Call FPSTS (Federation provider) service and return the assertion."""
-    plugins = []
-    history = None
-    if settings.DEBUG:
-        history = HistoryPlugin()
-        plugins.append(history)
-    client = Client(
+    plugins, history = _get_history(settings)
+    client = _get_client(
         settings.FEDERATION_WSDL,
-        wsse=SAMLTokenSignature(assertion),
-        settings=SETTINGS,
-        transport=transport,
-        plugins=plugins,
+        transport,
+        SAMLTokenSignature(assertion, verify_responses=settings.VERIFY_RESPONSES, observer=settings.OBSERVER),
+        plugins,
     )
-    # prepare request
-    request_type = client.get_element(QName(NiaNamespaces.WS_TRUST.value, "RequestType"))
-    request = AnyObject(request_type, request_type(NiaNamespaces.WS_TRUST.value + "/Issue"))
-    # Prepare WSA header
-    applies = _get_wsa_header(client, settings.PUBLIC_ADDRESS)
     # Call the service
     service = client.bind("SecurityTokenService", "WS2007FederationHttpBinding_IWSTrust13Sync")
+    with phase(settings.OBSERVER, FPSTS) as measured:
+        try:
+            response = service.Trust13Issue(_value_1=_federation_request(client, settings))
+        except (Error, XmlsecError, RequestException) as err:
+            _log_history(history, settings, "FPSTS", success=False)
+            raise NiaException(err) from err
+        assertion = _get_token_assertion(response)
+        measured.size = _assertion_size(settings, assertion)
+    _log_history(history, settings, "FPSTS")
+    return assertion
+
+
+class _SubmissionTemplate(NamedTuple):
+    """Prebuilt parts of the Submission request for the direct path."""
+
+    binding: Any
+    address: str
+    headers: dict[str, str]
+    envelope: Element
+
+
+# Submission templates by the WSDL
+_SUBMISSION_TEMPLATES: dict[str, _SubmissionTemplate] = {}
+_SUBMISSION_TEMPLATES_LOCK = Lock()
+_FIND_FAULT = ETXPath("{{{soap}}}Body/{{{soap}}}Fault".format(soap=SOAP_ENV_12))
+_FIND_BODY_BASE64 = ETXPath(
+    "string({{{soap}}}Body/{{{sub}}}SubmitResponse/{{{sub}}}SubmitResult/{{{sub}}}BodyBase64XML)".format(
+        soap=SOAP_ENV_12, sub=NiaNamespaces.SUBMISSION.value
+    )
+)
+
+
+def _create_submission_template(document: Document) -> _SubmissionTemplate:
+    """Build the Submission envelope the same way zeep does, without the per message values."""
+    port = document.services["Public"].ports["Token"]
+    operation = port.binding.get("Submit")
+    envelope = Element(QName(SOAP_ENV_12, "Envelope"), nsmap={"soap-env": SOAP_ENV_12})
+    header = SubElement(envelope, QName(SOAP_ENV_12, "Header"), nsmap={"wsa": WSA})
+    SubElement(header, QName(WSA, "Action")).text = operation.abstract.wsa_action
+    SubElement(header, QName(WSA, "MessageID"))
+    SubElement(header, QName(WSA, "To")).text = port.binding_options["address"]
+    submit = SubElement(
+        SubElement(envelope, QName(SOAP_ENV_12, "Body")), QName(NiaNamespaces.SUBMISSION.value, "Submit")
+    )
+    SubElement(submit, QName(NiaNamespaces.SUBMISSION.value, "tclass"))
+    bodies = SubElement(submit, QName(NiaNamespaces.SUBMISSION.value, "bodies"))
+    body_part = SubElement(bodies, QName(NiaNamespaces.SUBMISSION.value, "BodyPart"))
+    SubElement(body_part, QName(NiaNamespaces.SUBMISSION.value, "Body"))
+    SubElement(submit, QName(NiaNamespaces.SUBMISSION.value, "optionals"))
+    headers = {
+        "SOAPAction": '"{}"'.format(operation.soapaction),
+        "Content-Type": 'application/soap+xml; charset=utf-8; action="{}"'.format(operation.soapaction),
+    }
+    return _SubmissionTemplate(port.binding, port.binding_options["address"], headers, envelope)
+
+
+def _get_submission_template(wsdl: str, transport: Transport) -> _SubmissionTemplate:
+    """Return the Submission template, built only once per process for each WSDL."""
+    template = _SUBMISSION_TEMPLATES.get(wsdl)
+    if template is None:
+        with _SUBMISSION_TEMPLATES_LOCK:
+            template = _SUBMISSION_TEMPLATES.get(wsdl)
+            if template is None:
+                template = _create_submission_template(_get_document(wsdl, transport))
+                _SUBMISSION_TEMPLATES[wsdl] = template
+    return template
+
+
+def _submission_envelope(
+    template: _SubmissionTemplate,
+    wsse: SAMLTokenSignature,
+    history: Optional[HistoryPlugin],
+    action: str,
+    bodies: Sequence[Element],
+) -> tuple[Element, dict[str, str]]:
+    """Return the signed Submission envelope with the packed messages and the HTTP headers."""
+    envelope = deepcopy(template.envelope)
+    header, body = envelope
+    header[1].text = "urn:uuid:" + str(uuid4())
+    tclass, body_parts, _ = body[0]
+    tclass.text = action
+    body_part = body_parts[0]
+    for _ in bodies[1:]:
+        body_parts.append(deepcopy(body_part))
+    for body_part, message in zip(body_parts, bodies):
+        body_part[0].append(message)
+    headers = dict(template.headers)
+    if history is not None:
+        history.egress(envelope, headers, None, None)
+    return wsse.apply(envelope, headers)
+
+
+def _submission_result(
+    template: _SubmissionTemplate, response: Any, wsse: SAMLTokenSignature, history: Optional[HistoryPlugin]
+) -> str:
+    """Return the Base64 encoded body from the Submission response.
+
+    Checks the response the same way as `zeep.wsdl.bindings.soap.SoapBinding.process_reply`,
+    raises `zeep.exceptions.Error` on failure.
+    """
+    if response.status_code != 200 and not response.content:
+        raise TransportError(
+            "Server returned HTTP status {} (no content available)".format(response.status_code),
+            status_code=response.status_code,
+        )
+    document = parse_xml(response.content, template.binding.transport, settings=SETTINGS)
+    wsse.verify(document)
+    if history is not None:
+        history.ingress(document, response.headers, None)
+    if response.status_code != 200 or _FIND_FAULT(document):
+        template.binding.process_error(document, None)
+    return _FIND_BODY_BASE64(document)
+
+
+def _call_submission_bodies(
+    settings: CzNiaAppSettings, transport: Transport, assertion, action: str, bodies: Sequence[Element]
+) -> bytes:
+    """Call Submission service with the packed messages and return the body.
+
+    If the `SUBMISSION_DIRECT` setting is enabled, the request is built from a prebuilt template
+    and the body is extracted from the response directly, instead of using the zeep serialization.
+    """
+    plugins, history = _get_history(settings)
+    wsse = SAMLTokenSignature(assertion, verify_responses=settings.VERIFY_RESPONSES, observer=settings.OBSERVER)
+    with phase(settings.OBSERVER, SUBMISSION) as measured:
+        if settings.SUBMISSION_DIRECT:
+            template = _get_submission_template(settings.PUBLIC_WSDL, transport)
+            try:
+                envelope, headers = _submission_envelope(template, wsse, history, action, bodies)
+                response = transport.post_xml(template.address, envelope, headers)
+                body = _submission_result(template, response, wsse, history)
+            except (Error, XmlsecError, RequestException) as err:
+                _log_history(history, settings, "Submission", success=False)
+                raise NiaException(err) from err
+        else:
+            client = _get_client(settings.PUBLIC_WSDL, transport, wsse, plugins)
+            # Call the service
+            service = client.bind("Public", "Token")
+            try:
+                response = service.Submit(action, _submission_bodies(client, bodies), "")
+            except (Error, XmlsecError, RequestException) as err:
+                _log_history(history, settings, "Submission", success=False)
+                raise NiaException(err) from err
+            body = response.BodyBase64XML
+        measured.size = len(body)
+    _log_history(history, settings, "Submission")
+    return _decode_body(body)
+
+
+def _decode_body(body: Union[str, bytes]) -> bytes:
+    """Return the decoded body of the Submission response, raise NiaException if it is not valid base64."""
     try:
-        response = service.Trust13Issue(_value_1=[applies, request])
-    except (Error, XmlsecError, RequestException) as err:
-        _log_history(history, settings, "FPSTS", success=False)
+        return b64decode(body)
+    except binascii.Error as err:
         raise NiaException(err) from err
-    _log_history(history, settings, "FPSTS")
-    return response.RequestSecurityTokenResponse[0]["_value_1"][3]["_value_1"]
 
 
 def _call_submission(settings: CzNiaAppSettings, transport: Transport, assertion, message: NiaMessage) -> bytes:
     """Call Submission service and return the body."""
-    plugins = []
-    history = None
-    if settings.DEBUG:
-        history = HistoryPlugin()
-        plugins.append(history)
-    client = Client(
-        settings.PUBLIC_WSDL,
-        wsse=SAMLTokenSignature(assertion),
-        settings=SETTINGS,
-        transport=transport,
-        plugins=plugins,
-    )
-    # Prepare the Body
-    bodies_type = client.get_type(QName(NiaNamespaces.SUBMISSION.value, "ArrayOfBodyPart"))
-    body_part_type = client.get_type(QName(NiaNamespaces.SUBMISSION.value, "BodyPart"))
-    # Call the service
-    service = client.bind("Public", "Token")
+    body = message.pack(settings.VALIDATION_RATE, settings.OBSERVER)
+    return _call_submission_bodies(settings, transport, assertion, message.action, [body])
+
+
+def _submit_batch(
+    settings: CzNiaAppSettings, transport: Transport, assertion: Element, messages: Sequence[NiaMessage]
+) -> list[Any]:
+    """Send the messages in a single Submission request and return their unpacked results.
+
+    Results are in the order of the messages, `NiaException` takes place of the failed ones.
+    Messages which fail to pack, e.g. because of invalid or missing data, are not sent.
+    All messages have to be of the same action, otherwise ValueError is raised.
+    """
+    if len({message.action for message in messages}) > 1:
+        raise ValueError("Messages in a batch have to be of the same action")
+    results: list[Any] = [None] * len(messages)
+    sent: list[int] = []
+    bodies: list[Element] = []
+    for index, message in enumerate(messages):
+        try:
+            bodies.append(message.pack(settings.VALIDATION_RATE, settings.OBSERVER))
+        except Exception as err:
+            # A single bad item must not abort the whole batch
+            results[index] = NiaException(err)
+        else:
+            sent.append(index)
+    if not bodies:
+        return results
     try:
-        response = service.Submit(message.action, bodies_type(body_part_type(Body={"_value_1": message.pack()})), "")
-    except (Error, XmlsecError, RequestException) as err:
-        _log_history(history, settings, "Submission", success=False)
-        raise NiaException(err) from err
-    _log_history(history, settings, "Submission")
-    return b64decode(response.BodyBase64XML)
+        body = _call_submission_bodies(settings, transport, assertion, messages[0].action, bodies)
+    except NiaException as err:
+        for index in sent:
+            results[index] = err
+        return results
+    for index, result in zip(sent, unpack_batch([messages[index] for index in sent], body, settings.OBSERVER)):
+        results[index] = result
+    return results
 
 
-def get_pseudonym(settings: CzNiaAppSettings, user_data: dict[str, Any]) -> str:
+def _submit_batches(
+    settings: CzNiaAppSettings,
+    transport: Transport,
+    assertion: Element,
+    messages: Sequence[NiaMessage],
+    batch_size: int,
+    max_workers: Optional[int],
+) -> list[Any]:
+    """Send the messages in batches of `batch_size` concurrently in `max_workers` threads.
+
+    Results are in the order of the messages, `NiaException` takes place of the failed ones.
+    """
+    if max_workers is None:
+        max_workers = settings.POOL_MAXSIZE
+    batches = [messages[start : start + batch_size] for start in range(0, len(messages), batch_size)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda batch: _submit_batch(settings, transport, assertion, batch), batches)
+        return [result for batch_results in results for result in batch_results]
+
+
+def get_pseudonym(settings: CzNiaAppSettings, user_data: dict[str, Any], transport: Optional[Transport] = None) -> str:
     """Get pseudonym from NIA servers for given user data."""
-    transport = Transport(
-        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT), timeout=settings.TRANSPORT_TIMEOUT
-    )
+    if transport is None:
+        transport = get_transport(settings)
     fp_assertion = _call_identity(settings, transport)
     sub_assertion = _call_federation(settings, transport, fp_assertion)
     message = IdentificationMessage(user_data)
     body = _call_submission(settings, transport, sub_assertion, message)
-    return message.unpack(body)
+    return message.unpack(body, settings.OBSERVER)
 
 
-def write_authenticator(settings: CzNiaAppSettings, data):
+def get_pseudonyms(
+    settings: CzNiaAppSettings,
+    users_data: Iterable[dict[str, Any]],
+    max_workers: Optional[int] = None,
+    transport: Optional[Transport] = None,
+    batch_size: int = 1,
+) -> list[Union[str, NiaException]]:
+    """Get pseudonyms from NIA servers for all given user data.
+
+    The assertions are requested only once and the identifications run concurrently in `max_workers` threads,
+    by default as many as the transport keeps connections per host.
+    Each request identifies up to `batch_size` users, results are mapped back to the user data by NIA body ids.
+    Results are in the order of the user data, a failed identification results in `NiaException` in its place.
+    Failure to get the assertions raises `NiaException`.
+    """
+    if transport is None:
+        transport = get_transport(settings)
+    fp_assertion = _call_identity(settings, transport)
+    sub_assertion = _call_federation(settings, transport, fp_assertion)
+    messages = [IdentificationMessage(user_data) for user_data in users_data]
+    return _submit_batches(settings, transport, sub_assertion, messages, batch_size, max_workers)
+
+
+def write_authenticator(settings: CzNiaAppSettings, data, transport: Optional[Transport] = None):
     """Write the issued VIP."""
-    transport = Transport(
-        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT), timeout=settings.TRANSPORT_TIMEOUT
-    )
+    if transport is None:
+        transport = get_transport(settings)
     fp_assertion = _call_identity(settings, transport)
     sub_assertion = _call_federation(settings, transport, fp_assertion)
     # Create the request
     message = WriteAuthenticatorMessage(data)
     body = _call_submission(settings, transport, sub_assertion, message)
-    return message.unpack(body)
+    return message.unpack(body, settings.OBSERVER)
+
+
+def write_authenticators(
+    settings: CzNiaAppSettings,
+    data: Iterable[dict[str, Any]],
+    max_workers: Optional[int] = None,
+    transport: Optional[Transport] = None,
+    batch_size: int = 1,
+) -> list[Optional[NiaException]]:
+    """Write all the issued VIPs.
 
+    Works the same way as `get_pseudonyms`, results are `None` for successful writes.
+    """
+    if transport is None:
+        transport = get_transport(settings)
+    fp_assertion = _call_identity(settings, transport)
+    sub_assertion = _call_federation(settings, transport, fp_assertion)
+    messages = [WriteAuthenticatorMessage(vip_data) for vip_data in data]
+    return _submit_batches(settings, transport, sub_assertion, messages, batch_size, max_workers)
 
-def change_authenticator(settings: CzNiaAppSettings, data: dict[str, str]):
+
+def change_authenticator(settings: CzNiaAppSettings, data: dict[str, str], transport: Optional[Transport] = None):
     """Write a change to the VIP."""
-    transport = Transport(
-        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT), timeout=settings.TRANSPORT_TIMEOUT
-    )
+    if transport is None:
+        transport = get_transport(settings)
     fp_assertion = _call_identity(settings, transport)
     sub_assertion = _call_federation(settings, transport, fp_assertion)
     # Create the request
     message = ChangeAuthenticatorMessage(data)
     body = _call_submission(settings, transport, sub_assertion, message)
-    return message.unpack(body)
+    return message.unpack(body, settings.OBSERVER)
 
 
-def get_notification(settings: CzNiaAppSettings, data: Optional[dict[str, str]] = None) -> NotificationResult:
+def get_notification(
+    settings: CzNiaAppSettings, data: Optional[dict[str, str]] = None, transport: Optional[Transport] = None
+) -> NotificationResult:
     """Get notifications."""
-    transport = Transport(
-        cache=SqliteCache(path=settings.CACHE_PATH, timeout=settings.CACHE_TIMEOUT), timeout=settings.TRANSPORT_TIMEOUT
-    )
+    if transport is None:
+        transport = get_transport(settings)
     fp_assertion = _call_identity(settings, transport)
     sub_assertion = _call_federation(settings, transport, fp_assertion)
     # Create the request
-    message = NotificationMessage(data)
+    message = NotificationMessage(data, records=settings.NOTIFICATION_RECORDS)
     body = _call_submission(settings, transport, sub_assertion, message)
-    return message.unpack(body)
+    return message.unpack(body, settings.OBSERVER)
+
+
+def stream_notification(
+    settings: CzNiaAppSettings, data: Optional[dict[str, str]] = None, transport: Optional[Transport] = None
+) -> NotificationStream:
+    """Get notifications parsed incrementally, see `NotificationStream`."""
+    if transport is None:
+        transport = get_transport(settings)
+    fp_assertion = _call_identity(settings, transport)
+    sub_assertion = _call_federation(settings, transport, fp_assertion)
+    # Create the request
+    message = NotificationStreamMessage(data, records=settings.NOTIFICATION_RECORDS)
+    body = _call_submission(settings, transport, sub_assertion, message)
+    return message.unpack(body, settings.OBSERVER)
+
+
+def _iter_results(
+    get_page: Callable[[Optional[int]], NotificationResult], start_id: Optional[int]
+) -> Iterator[NotificationResult]:
+    """Yield the pages returned by `get_page` for the id of the last seen notification.
+
+    The next page is requested in background while the current one is processed.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page: Optional[Future[NotificationResult]] = executor.submit(get_page, start_id)
+        while page is not None:
+            result = page.result()
+            if result.more_notifications and result.last_id is not None:
+                page = executor.submit(get_page, result.last_id)
+            else:
+                page = None
+            yield result
+
+
+def _iter_pages(
+    get_page: Callable[[Optional[int]], NotificationResult], start_id: Optional[int]
+) -> Iterator[NotificationData]:
+    """Yield notifications from the pages returned by `get_page`, see `_iter_results`."""
+    for result in _iter_results(get_page, start_id):
+        yield from result.notifications
+
+
+def iter_notifications(
+    settings: CzNiaAppSettings, start_id: Optional[int] = None, transport: Optional[Transport] = None
+) -> Iterator[NotificationData]:
+    """Yield all notifications after `start_id`, requesting the following pages as necessary.
+
+    The assertions are requested only once for all the pages, so the iteration should not outlast them.
+    """
+    if transport is None:
+        transport = get_transport(settings)
+    fp_assertion = _call_identity(settings, transport)
+    sub_assertion = _call_federation(settings, transport, fp_assertion)
+
+    def get_page(last_id: Optional[int]) -> NotificationResult:
+        message = NotificationMessage(
+            None if last_id is None else {"id": str(last_id)}, records=settings.NOTIFICATION_RECORDS
+        )
+        return message.unpack(_call_submission(settings, transport, sub_assertion, message), settings.OBSERVER)
+
+    return _iter_pages(get_page, start_id)
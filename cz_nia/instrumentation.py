@@ -0,0 +1,177 @@
+"""Timing of the phases of the communication with NIA."""
+
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+from typing import NamedTuple, Optional, Union
+
+# Phases of the call chain
+IPSTS = "ipsts"
+FPSTS = "fpsts"
+SUBMISSION = "submission"
+SIGNING = "signing"
+VERIFICATION = "verification"
+VALIDATION = "validation"
+PARSING = "parsing"
+
+
+class PhaseEvent(NamedTuple):
+    """Finished phase with its duration (in seconds), size of the processed data (in bytes) if known and outcome."""
+
+    phase: str
+    duration: float
+    size: Optional[int]
+    success: bool
+
+
+class Observer:
+    """Base class of the observers of the phases.
+
+    Observers are registered by the `observer` setting or passed to the client.
+    They are called from the threads making the calls, so they have to be thread-safe.
+    """
+
+    def start(self, phase: str) -> None:
+        """Phase has started."""
+
+    def stop(self, event: PhaseEvent) -> None:
+        """Phase has finished."""
+
+
+class _Phase:
+    """Context manager reporting the phase to the observer."""
+
+    __slots__ = ("observer", "phase", "size", "_start")
+
+    def __init__(self, observer: Observer, phase: str, size: Optional[int]):
+        self.observer = observer
+        self.phase = phase
+        self.size = size
+
+    def __enter__(self) -> "_Phase":
+        self.observer.start(self.phase)
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        duration = perf_counter() - self._start
+        self.observer.stop(PhaseEvent(self.phase, duration, self.size, exc_type is None))
+
+
+class _NoPhase:
+    """Context manager doing nothing, used if there is no observer."""
+
+    __slots__ = ()
+
+    @property
+    def size(self) -> None:
+        return None
+
+    @size.setter
+    def size(self, value: Optional[int]) -> None:
+        pass
+
+    def __enter__(self) -> "_NoPhase":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NO_PHASE = _NoPhase()
+
+
+def phase(observer: Optional[Observer], name: str, size: Optional[int] = None) -> Union[_Phase, _NoPhase]:
+    """Return the context manager measuring the phase.
+
+    The size may be set on the returned object within the context, once it is known.
+    Without an observer, a shared object which does nothing is returned.
+    """
+    if observer is None:
+        return _NO_PHASE
+    return _Phase(observer, name, size)
+
+
+# Upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class PhaseStats:
+    """Statistics of a single phase."""
+
+    def __init__(self, buckets: tuple[float, ...]):
+        """Set up empty statistics with the bucket bounds."""
+        self.buckets = buckets
+        # The last count is for durations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.size = 0
+
+    def add(self, event: PhaseEvent) -> None:
+        """Add the finished phase."""
+        self.counts[bisect_left(self.buckets, event.duration)] += 1
+        self.count += 1
+        self.total += event.duration
+        if not event.success:
+            self.failures += 1
+        if event.size is not None:
+            self.size += event.size
+
+    def copy(self) -> "PhaseStats":
+        """Return a copy of the statistics."""
+        stats = PhaseStats(self.buckets)
+        stats.counts = list(self.counts)
+        stats.count, stats.failures, stats.total, stats.size = self.count, self.failures, self.total, self.size
+        return stats
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Return the upper bound of the bucket containing the quantile `q` or `None` if there are no events.
+
+        Infinity is returned for the durations above the last bound.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+class HistogramCollector(Observer):
+    """Observer collecting histograms of the phase durations in memory."""
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        """Set up the collector with the upper bounds of the buckets in seconds."""
+        self.buckets = tuple(sorted(buckets))
+        self._stats: dict[str, PhaseStats] = {}
+        self._lock = Lock()
+
+    def stop(self, event: PhaseEvent) -> None:
+        """Add the finished phase to its histogram."""
+        with self._lock:
+            stats = self._stats.get(event.phase)
+            if stats is None:
+                stats = self._stats[event.phase] = PhaseStats(self.buckets)
+            stats.add(event)
+
+    def get(self, name: str) -> Optional[PhaseStats]:
+        """Return a copy of the statistics of the phase or `None` if it has not been observed."""
+        with self._lock:
+            stats = self._stats.get(name)
+            return None if stats is None else stats.copy()
+
+    @property
+    def phases(self) -> list[str]:
+        """Return the observed phases."""
+        with self._lock:
+            return list(self._stats)
+
+    def reset(self) -> None:
+        """Drop all the statistics."""
+        with self._lock:
+            self._stats.clear()
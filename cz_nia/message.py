@@ -2,19 +2,102 @@
 
 import os
 from abc import ABC, abstractmethod
+from collections.abc import Iterator, Sequence
 from datetime import datetime
-from typing import Any, NamedTuple, Optional, Union
-
-from lxml.etree import Element, QName, SubElement, XMLSchema, fromstring, parse
+from io import BytesIO
+from random import random
+from threading import Lock
+from typing import Any, ClassVar, NamedTuple, Optional, Union
+
+from lxml.etree import (
+    DocumentInvalid,
+    Element,
+    QName,
+    SubElement,
+    XMLSchema,
+    XMLSyntaxError,
+    XPath,
+    fromstring,
+    iterparse,
+    parse,
+)
 
 from cz_nia import schema
 from cz_nia.exceptions import NiaException
+from cz_nia.instrumentation import PARSING, VALIDATION, Observer, phase
+
+# Compiled XML schemas shared by all messages
+_SCHEMAS: dict[str, XMLSchema] = {}
+_SCHEMAS_LOCK = Lock()
+
+
+def get_schema(definition: str) -> XMLSchema:
+    """Return the compiled XML schema from the file in `cz_nia.schema`.
+
+    Each schema is compiled only once per process, on its first use.
+    """
+    xmlschema = _SCHEMAS.get(definition)
+    if xmlschema is None:
+        with _SCHEMAS_LOCK:
+            xmlschema = _SCHEMAS.get(definition)
+            if xmlschema is None:
+                path = os.path.join(os.path.dirname(schema.__file__), definition)
+                with open(path) as xsd:
+                    xmlschema = XMLSchema(parse(xsd))
+                _SCHEMAS[definition] = xmlschema
+    return xmlschema
+
+
+class ValidationStats:
+    """Thread-safe counters of the validated outgoing messages."""
+
+    def __init__(self):
+        """Set the counters to zero."""
+        self._lock = Lock()
+        self.validated = 0
+        self.failed = 0
+
+    def add(self, success: bool) -> None:
+        """Count the validation."""
+        with self._lock:
+            self.validated += 1
+            if not success:
+                self.failed += 1
+
+    def reset(self) -> None:
+        """Set the counters to zero."""
+        with self._lock:
+            self.validated = 0
+            self.failed = 0
+
+
+# Validations of all the outgoing messages in the process
+VALIDATION_STATS = ValidationStats()
 
 
 class NiaMessage(ABC):
-    """Base class for messages."""
+    """Base class for messages.
+
+    Paths to the fields of the response are declared in `response_fields`
+    and compiled into `response_paths` once for each message class.
+    """
 
     govtalk_namespace = "http://www.govtalk.gov.uk/CM/envelope"
+    # XPath expressions relative to the response element, prefixes `gov` and `nia` are available
+    response_fields: ClassVar[dict[str, str]] = {}
+    response_paths: ClassVar[dict[str, XPath]]
+    _response_path: ClassVar[XPath]
+    _body_response_path: ClassVar[XPath]
+
+    def __init_subclass__(cls, **kwargs):
+        """Compile the paths to the response and its fields."""
+        super().__init_subclass__(**kwargs)
+        if isinstance(cls.response_namespace, str) and isinstance(cls.response_class, str):
+            namespaces = {"gov": cls.govtalk_namespace, "nia": cls.response_namespace}
+            cls._response_path = XPath("gov:Body/nia:{}".format(cls.response_class), namespaces=namespaces)
+            cls._body_response_path = XPath("nia:{}".format(cls.response_class), namespaces=namespaces)
+            fields = {"status": "string(nia:Status)", "detail": "string(nia:Detail)", **cls.response_fields}
+            cls.response_paths = {name: XPath(path, namespaces=namespaces) for name, path in fields.items()}
 
     @property
     @abstractmethod
@@ -60,38 +143,90 @@ class NiaMessage(ABC):
 
     def validate(self, message: Element) -> None:
         """Validate the constructed request against a XSD."""
-        path = os.path.join(os.path.dirname(schema.__file__), self.xmlschema_definition)
-        with open(path) as xsd:
-            xmlschema = XMLSchema(parse(xsd))
+        get_schema(self.xmlschema_definition).assertValid(message)
 
-        xmlschema.assertValid(message)
+    def pack(self, validation_rate: float = 1, observer: Optional[Observer] = None) -> Element:
+        """Pack the message containing data.
 
-    def pack(self) -> Element:
-        """Pack the message containing data."""
+        The message is validated with probability `validation_rate`, see the `validation_mode` setting.
+        Validations are counted in `VALIDATION_STATS`, failed ones raise DocumentInvalid.
+        Validation is reported to the `observer` if provided.
+        """
         message = self.create_message()
-        self.validate(message)
+        if validation_rate >= 1 or (validation_rate > 0 and random() < validation_rate):
+            try:
+                with phase(observer, VALIDATION):
+                    self.validate(message)
+            except DocumentInvalid:
+                VALIDATION_STATS.add(success=False)
+                raise
+            VALIDATION_STATS.add(success=True)
         return message
 
-    def unpack(self, response: bytes) -> Any:
-        """Unpack the data from the response."""
-        parsed_message = self.verify_message(response)
-        return self.extract_message(parsed_message)
+    def unpack(self, response: bytes, observer: Optional[Observer] = None) -> Any:
+        """Unpack the data from the response, the parsing is reported to the `observer` if provided."""
+        with phase(observer, PARSING, len(response)):
+            parsed_message = self.verify_message(response)
+            return self.extract_message(parsed_message)
 
     def verify_message(self, message: bytes) -> Element:
         """Verify the status of the message.
 
         Raises NiaException if the status is not OK.
         """
-        body = fromstring(message)
-        nsmap = self.get_namespace_map
-        response = body.find("gov:Body/nia:{}".format(self.response_class), namespaces=nsmap)
-        if response is None:
+        return self._verify_status(self._response_path(fromstring(message)))
+
+    def verify_body(self, body: Element) -> Element:
+        """Verify the status of the response in a single body of the message.
+
+        Raises NiaException if the status is not OK.
+        """
+        return self._verify_status(self._body_response_path(body))
+
+    def _verify_status(self, responses: list) -> Element:
+        """Return the first response if its status is OK, raise NiaException otherwise."""
+        if not responses:
             raise NiaException("Empty response")
-        if response.find("nia:Status", namespaces=nsmap).text != "OK":
-            raise NiaException(response.find("nia:Detail", namespaces=nsmap).text)
+        response = responses[0]
+        if self.response_paths["status"](response) != "OK":
+            raise NiaException(str(self.response_paths["detail"](response)))
         return response
 
 
+def unpack_batch(messages: Sequence[NiaMessage], response: bytes, observer: Optional[Observer] = None) -> list[Any]:
+    """Unpack the data for each of the messages sent in a single request.
+
+    Bodies of the response are matched to the messages by their `Id`, which is the index of the message in the request.
+    Bodies without the `Id` are matched by their order.
+    Results are in the order of the messages, `NiaException` takes place of the failed ones,
+    including all of them if the response is not a well-formed XML.
+    The parsing is reported to the `observer` if provided.
+    """
+    with phase(observer, PARSING, len(response)):
+        try:
+            root = fromstring(response)
+        except XMLSyntaxError as err:
+            # The response is shared, so all of its messages fail
+            return [NiaException(err)] * len(messages)
+        bodies = {}
+        for position, body in enumerate(root.iterchildren(QName(NiaMessage.govtalk_namespace, "Body"))):
+            body_id = body.get("Id")
+            bodies[int(body_id) if body_id is not None and body_id.isdigit() else position] = body
+        results: list[Any] = []
+        for index, message in enumerate(messages):
+            try:
+                body = bodies.get(index)
+                if body is None:
+                    raise NiaException("Empty response")
+                results.append(message.extract_message(message.verify_body(body)))
+            except NiaException as err:
+                results.append(err)
+            except Exception as err:
+                # A single bad body must not abort the whole batch
+                results.append(NiaException(err))
+        return results
+
+
 class IdentificationMessage(NiaMessage):
     """Message for TR_ZTOTOZNENI."""
 
@@ -100,6 +235,7 @@ class IdentificationMessage(NiaMessage):
     response_class = "ZtotozneniResponse"
     action = "TR_ZTOTOZNENI"
     xmlschema_definition = "ZtotozneniRequest.xsd"
+    response_fields = {"pseudonym": "string(nia:Pseudonym)"}
 
     def create_message(self) -> Element:
         """Prepare the ZTOTOZNENI message with user data."""
@@ -118,8 +254,11 @@ class IdentificationMessage(NiaMessage):
         return id_request
 
     def extract_message(self, response: Element) -> str:
-        """Get pseudonym from the message."""
-        return response.find("nia:Pseudonym", namespaces=self.get_namespace_map).text
+        """Get pseudonym from the message, raise NiaException if it is missing."""
+        pseudonym = str(self.response_paths["pseudonym"](response))
+        if not pseudonym:
+            raise NiaException("Missing pseudonym")
+        return pseudonym
 
 
 class WriteAuthenticatorMessage(NiaMessage):
@@ -190,8 +329,34 @@ class ChangeAuthenticatorMessage(NiaMessage):
         return None
 
 
+def parse_datetime(value: str) -> datetime:
+    """Parse the xsd:dateTime without time zone as returned by NIA."""
+    # Fractions of seconds may have other number of digits than `fromisoformat` accepts
+    if "." in value:
+        value, fraction = value.split(".", 1)
+        value = "{}.{:0<6.6}".format(value, fraction)
+    return datetime.fromisoformat(value)
+
+
+class Notification(NamedTuple):
+    """Notification from TR_NOTIFIKACE_IDP, compact alternative to the dictionary.
+
+    Reference data use the same keys as the dictionary, `None` if the notification has none.
+    """
+
+    id: int
+    pseudonym: str
+    source: str
+    message: str
+    datetime: datetime
+    reference_data: Optional[dict[str, str]] = None
+
+
+NotificationData = Union[dict[str, Union[datetime, str]], Notification]
+
+
 class NotificationResult(NamedTuple):
-    notifications: list[dict[str, Union[datetime, str]]]
+    notifications: list[NotificationData]
     last_id: Optional[int]
     more_notifications: bool
 
@@ -202,16 +367,42 @@ NOTIFICATION_MAP = {
     "Prijmeni": "last_name",
     "DatumNarozeni": "date_of_birth",
 }
+NOTIFICATION_NAMESPACE = "urn:nia.notifikaceIdp/response:v1"
+# Fields of the notification
+NOTIFICATION_FIELDS = {
+    "NotifikaceIdpId": "id",
+    "Bsi": "pseudonym",
+    "Zdroj": "source",
+    "Text": "message",
+    "DatumACasNotifikace": "datetime",
+}
 
 
 class NotificationMessage(NiaMessage):
-    """Message for TR_NOTIFIKACE_IDP."""
+    """Message for TR_NOTIFIKACE_IDP.
+
+    Notifications are extracted as dictionaries or as `Notification` records if `records` is set.
+    """
 
     request_namespace = "urn:nia.notifikaceIdp/request:v1"
-    response_namespace = "urn:nia.notifikaceIdp/response:v1"
+    response_namespace = NOTIFICATION_NAMESPACE
     response_class = "NotifikaceIdpResponse"
     action = "TR_NOTIFIKACE_IDP"
     xmlschema_definition = "NotifikaceIdpRequest.xsd"
+    response_fields = {
+        "notifications": "nia:SeznamNotifikaceIdp/nia:NotifikaceIdp",
+        "last_id": "nia:NotifikaceIdpPosledniId/text()",
+        "more_notifications": "nia:ExistujiDalsiNotifikace/text()",
+    }
+    # Keys of the notification fields and reference data by the element tags
+    _notification_tags = {QName(NOTIFICATION_NAMESPACE, tag).text: key for tag, key in NOTIFICATION_FIELDS.items()}
+    _reference_data_tag = QName(NOTIFICATION_NAMESPACE, "ReferencniData").text
+    _reference_tags = {QName(NOTIFICATION_NAMESPACE, tag).text: key for tag, key in NOTIFICATION_MAP.items()}
+
+    def __init__(self, data, records: bool = False):
+        """Store the data we want to pack and the form of the notifications."""
+        super().__init__(data)
+        self.records = records
 
     def create_message(self) -> Element:
         """Prepare the NOTIFIKACE message."""
@@ -221,39 +412,117 @@ class NotificationMessage(NiaMessage):
             idp_id.text = str(self.data.get("id"))
         return id_request
 
+    def extract_notification(self, notification: Element) -> NotificationData:
+        """Get the notification content in a single pass over its elements."""
+        content: dict[str, Any] = {}
+        reference_data = None
+        for child in notification.iterchildren():
+            key = self._notification_tags.get(child.tag)
+            if key is not None:
+                content[key] = child.text
+            elif child.tag == self._reference_data_tag:
+                reference_data = {
+                    self._reference_tags.get(reference.tag) or "_" + QName(reference.tag).localname: reference.text
+                    for reference in child.iterchildren()
+                }
+        content["datetime"] = parse_datetime(content["datetime"])
+        if self.records:
+            content["id"] = int(content["id"])
+            return Notification(reference_data=reference_data, **content)
+        if reference_data is not None:
+            content.update(reference_data)
+        return content
+
+    @staticmethod
+    def get_id(notification: NotificationData) -> int:
+        """Return the id of the notification in either form."""
+        if isinstance(notification, Notification):
+            return notification.id
+        return int(str(notification["id"]))
+
     def extract_message(self, response) -> NotificationResult:
         """Get notifications from the message."""
-        notification_list = []
-        notifications = response.findall("nia:SeznamNotifikaceIdp/nia:NotifikaceIdp", namespaces=self.get_namespace_map)
-        for notification in notifications:
-            datetime_text = notification.find("nia:DatumACasNotifikace", namespaces=self.get_namespace_map).text
-            try:
-                notif_datetime = datetime.strptime(datetime_text, "%Y-%m-%dT%H:%M:%S.%f")
-            except ValueError:
-                notif_datetime = datetime.strptime(datetime_text, "%Y-%m-%dT%H:%M:%S")
-            content = {
-                "id": notification.find("nia:NotifikaceIdpId", namespaces=self.get_namespace_map).text,
-                "pseudonym": notification.find("nia:Bsi", namespaces=self.get_namespace_map).text,
-                "source": notification.find("nia:Zdroj", namespaces=self.get_namespace_map).text,
-                "message": notification.find("nia:Text", namespaces=self.get_namespace_map).text,
-                "datetime": notif_datetime,
-            }
-            reference_data = notification.find("nia:ReferencniData", namespaces=self.get_namespace_map)
-            if reference_data is not None:
-                for child in reference_data.iterchildren():
-                    tag = QName(child.tag).localname
-                    content[NOTIFICATION_MAP.get(tag, "_" + tag)] = child.text
-            notification_list.append(content)
-        last_id_node = response.find("nia:NotifikaceIdpPosledniId", namespaces=self.get_namespace_map)
-        if last_id_node is not None:
-            last_id = int(last_id_node.text)  # type: Optional[int]
-        else:
-            last_id = max((int(notif["id"]) for notif in notification_list), default=None)
-        more_notifications_node = response.find("nia:ExistujiDalsiNotifikace", namespaces=self.get_namespace_map)
-        if more_notifications_node is not None:
-            more_notifications = more_notifications_node.text.lower() == "true"
+        notification_list = [
+            self.extract_notification(notification) for notification in self.response_paths["notifications"](response)
+        ]
+        last_id_text = self.response_paths["last_id"](response)
+        if last_id_text:
+            last_id = int(last_id_text[0])  # type: Optional[int]
         else:
-            more_notifications = False
+            last_id = max((self.get_id(notif) for notif in notification_list), default=None)
+        more_notifications_text = self.response_paths["more_notifications"](response)
+        more_notifications = bool(more_notifications_text) and more_notifications_text[0].lower() == "true"
         return NotificationResult(
             notifications=notification_list, last_id=last_id, more_notifications=more_notifications
         )
+
+
+class NotificationStream:
+    """Notifications parsed incrementally from the response of `NotificationStreamMessage`.
+
+    Iterating yields the notifications one at a time, the elements are discarded once they are processed.
+    Attributes `last_id` and `more_notifications` are available once the iteration ends.
+    Raises NiaException during iteration if the status is not OK.
+    """
+
+    def __init__(self, message: "NotificationMessage", response: bytes):
+        """Prepare the parser of the response."""
+        self.message = message
+        self.last_id: Optional[int] = None
+        self.more_notifications = False
+        self._notifications = self._parse(response)
+
+    def __iter__(self) -> Iterator[NotificationData]:
+        return self._notifications
+
+    def _parse(self, response: bytes) -> Iterator[NotificationData]:
+        """Yield the notifications and set the attributes at the end."""
+        response_tag = QName(NOTIFICATION_NAMESPACE, self.message.response_class).text
+        notification_tag = QName(NOTIFICATION_NAMESPACE, "NotifikaceIdp").text
+        fields = {
+            QName(NOTIFICATION_NAMESPACE, tag).text: tag
+            for tag in ("Status", "Detail", "NotifikaceIdpPosledniId", "ExistujiDalsiNotifikace")
+        }
+        values: dict[str, Optional[str]] = {}
+        found = False
+        max_id = None
+        tags = (response_tag, notification_tag, *fields)
+        for _, element in iterparse(BytesIO(response), events=("end",), tag=tags):
+            if element.tag == notification_tag:
+                if values.get("Status") != "OK":
+                    raise NiaException(values.get("Detail") or "")
+                content = self.message.extract_notification(element)
+                notification_id = self.message.get_id(content)
+                max_id = notification_id if max_id is None else max(max_id, notification_id)
+                # Drop the processed notifications
+                element.clear(keep_tail=True)
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+                yield content
+            elif element.tag == response_tag:
+                found = True
+            else:
+                values[fields[element.tag]] = element.text
+        if not found:
+            raise NiaException("Empty response")
+        if values.get("Status") != "OK":
+            raise NiaException(values.get("Detail") or "")
+        last_id = values.get("NotifikaceIdpPosledniId")
+        self.last_id = int(last_id) if last_id is not None else max_id
+        more_notifications = values.get("ExistujiDalsiNotifikace")
+        self.more_notifications = more_notifications is not None and more_notifications.lower() == "true"
+
+
+class NotificationStreamMessage(NotificationMessage):
+    """Message for TR_NOTIFIKACE_IDP with the response parsed incrementally.
+
+    Suitable for large pages of notifications, the parsed tree is never kept in memory as a whole.
+    """
+
+    def unpack(self, response: bytes, observer: Optional[Observer] = None) -> NotificationStream:
+        """Return the stream of the notifications from the response.
+
+        The response is parsed while the stream is consumed, so the parsing is not reported to the `observer`.
+        """
+        return NotificationStream(self, response)
@@ -1,5 +1,30 @@
 """CZ_NIA application settings wrapper."""
 
+# Policies of the response signature verification
+VERIFY_POLICIES = ("strict", "if-present", "off")
+
+
+def parse_validation_mode(mode: str) -> float:
+    """Return the share of outgoing messages to validate according to the validation mode.
+
+    Mode is one of `always`, `never` or `sampled:<rate>` with rate between 0 and 1.
+    Raises ValueError if the mode is invalid.
+    """
+    if mode == "always":
+        return 1.0
+    if mode == "never":
+        return 0.0
+    name, _, rate = mode.partition(":")
+    if name == "sampled":
+        try:
+            value = float(rate)
+        except ValueError:
+            pass
+        else:
+            if 0 <= value <= 1:
+                return value
+    raise ValueError("Invalid validation mode: {!r}".format(mode))
+
 
 class CzNiaAppSettings:
     """CZ_NIA specific settings."""
@@ -7,7 +32,7 @@ class CzNiaAppSettings:
     def __init__(self, settings):
         """Instantiate settings object from a settings dictionary.
 
-        Raises KeyError if required setting is not provided.
+        Raises KeyError if required setting is not provided and ValueError if a setting is invalid.
         """
         # FIXME: The explicit cast to `str` on file based settings must remain for as long as we support Python 3.5
         #        since it cannot correctly handle PosixPath getting here
@@ -15,6 +40,34 @@ class CzNiaAppSettings:
         self.TRANSPORT_TIMEOUT = settings.get("transport_timeout", 10)
         self.CACHE_TIMEOUT = settings.get("cache_timeout", 3600)
         self.CACHE_PATH = str(settings["cache_path"]) if settings.get("cache_path") else None
+        # Connection pool of the shared transport - number of pooled hosts, connections per host and keep-alive
+        self.POOL_CONNECTIONS = settings.get("pool_connections", 10)
+        self.POOL_MAXSIZE = settings.get("pool_maxsize", 10)
+        self.KEEP_ALIVE = settings.get("keep_alive", True)
+        # Token settings - assertions are not reused if they expire within the margin (in seconds)
+        self.TOKEN_EXPIRY_MARGIN = settings.get("token_expiry_margin", 60)
+        # Background refresh renews the assertions when they expire within the margin (in seconds)
+        self.TOKEN_REFRESH_MARGIN = settings.get("token_refresh_margin", 300)
+        # Database file for sharing the assertions between processes
+        self.TOKEN_STORE_PATH = str(settings["token_store_path"]) if settings.get("token_store_path") else None
+        # Pseudonym cache - entries expire after TTL (in seconds), the cache is disabled unless it's set
+        self.PSEUDONYM_CACHE_TTL = settings.get("pseudonym_cache_ttl")
+        self.PSEUDONYM_CACHE_SIZE = settings.get("pseudonym_cache_size", 1000)
+        # Secret for the keys of the cached entries, random if not set
+        self.PSEUDONYM_CACHE_SECRET = settings.get("pseudonym_cache_secret")
+        # Validation of the outgoing messages against their XSD - always, sampled:<rate> or never
+        self.VALIDATION_MODE = settings.get("validation_mode", "always")
+        self.VALIDATION_RATE = parse_validation_mode(self.VALIDATION_MODE)
+        # Notifications as `cz_nia.message.Notification` records instead of dictionaries
+        self.NOTIFICATION_RECORDS = settings.get("notification_records", False)
+        # Verification of the response signatures - strict (required), if-present or off
+        self.VERIFY_RESPONSES = settings.get("verify_responses", "if-present")
+        if self.VERIFY_RESPONSES not in VERIFY_POLICIES:
+            raise ValueError("Invalid verify_responses policy: {!r}".format(self.VERIFY_RESPONSES))
+        # Submission requests built directly from a prebuilt template instead of the zeep serialization
+        self.SUBMISSION_DIRECT = settings.get("submission_direct", False)
+        # Observer of the phases of the calls, see `cz_nia.instrumentation.Observer`
+        self.OBSERVER = settings.get("observer")
         # Authentication settings
         self.CERTIFICATE = str(settings["certificate"])
         self.KEY = str(settings["key"])
@@ -28,3 +81,5 @@ class CzNiaAppSettings:
         self.PUBLIC_ADDRESS = settings["public_address"]
         # Debug
         self.DEBUG = settings.get("debug", False)
+        # Number of the last exchanges with each endpoint kept for debugging
+        self.DEBUG_HISTORY_SIZE = settings.get("debug_history_size", 10)
@@ -0,0 +1,305 @@
+"""Local stand-in of the NIA services for offline load and latency testing.
+
+The server serves the IPSTS, FPSTS and Public (Submission) endpoints with the responses from `cz_nia/tests/data`
+and the WSDL files pointing to itself. Run it by `python -m cz_nia.standin` or use `StandinServer` directly.
+"""
+
+import logging
+import os
+import random
+import ssl
+from argparse import ArgumentParser
+from base64 import b64decode, b64encode
+from copy import deepcopy
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import sleep
+from typing import Any, Optional
+
+from lxml.etree import QName, XMLSyntaxError, XPath, _Element, fromstring, tostring
+from zeep.transports import Transport
+
+from cz_nia.functions import ASSERTION, NiaNamespaces, _create_transport
+from cz_nia.settings import CzNiaAppSettings
+
+_LOGGER = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "tests", "data")
+# Self-signed certificate for 127.0.0.1 and localhost, with the key included
+STANDIN_CERTIFICATE = os.path.join(DATA_DIR, "standin.pem")
+# Address of the NIA test environment in the WSDL files
+NIA_ADDRESS = "https://tnia.eidentita.cz"
+IDENTITY_PATH = "/IPSTS/issue.svc/certificate"
+FEDERATION_PATH = "/FPSTS/Issue.svc"
+PUBLIC_PATH = "/WS/submission/Public.svc/token"
+# Responses of the Submission service by the transaction class
+SUBMISSION_RESPONSES = {
+    "TR_ZTOTOZNENI": "Sub_response.xml",
+    "TR_EVIDENCE_VIP_ZAPIS": "write_vip.xml",
+    "TR_EVIDENCE_VIP_ZMENA": "change_vip.xml",
+    "TR_NOTIFIKACE_IDP": "notifications.xml",
+}
+SOAP_CONTENT_TYPE = "application/soap+xml; charset=utf-8"
+
+_NAMESPACES = {
+    "saml": ASSERTION,
+    "trust": NiaNamespaces.WS_TRUST.value,
+    "sub": NiaNamespaces.SUBMISSION.value,
+    "wsu": "http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-utility-1.0.xsd",
+}
+_FIND_CONDITIONS = XPath("//saml:Conditions", namespaces=_NAMESPACES)
+_FIND_LIFETIMES = XPath("//trust:Lifetime | //wsu:Timestamp", namespaces=_NAMESPACES)
+_FIND_CLASS = XPath("string(//sub:tclass)", namespaces=_NAMESPACES)
+_FIND_BODY_PARTS = XPath("//sub:BodyPart", namespaces=_NAMESPACES)
+_FIND_BASE64 = XPath("//sub:BodyBase64XML", namespaces=_NAMESPACES)
+_CREATED = QName(_NAMESPACES["wsu"], "Created")
+_EXPIRES = QName(_NAMESPACES["wsu"], "Expires")
+
+
+def _format_time(value: datetime) -> str:
+    """Return the time in the format used by NIA."""
+    return value.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(value.microsecond // 1000)
+
+
+def _read(filename: str) -> bytes:
+    """Return the content of the file from the data directory."""
+    with open(os.path.join(DATA_DIR, filename), "rb") as data:
+        return data.read()
+
+
+class StandinServer(ThreadingHTTPServer):
+    """HTTP server standing in for the NIA services.
+
+    Each request is delayed by `latency` seconds and fails with a SOAP fault with the probability `error_rate`.
+    Assertions issued by the token services are valid for `token_lifetime` seconds.
+    Submission responds to each body of the request with the response to its transaction class.
+    HTTPS is served if the `certificate` (and its `key` unless included) is provided,
+    e.g. the self-signed `STANDIN_CERTIFICATE` for 127.0.0.1 and localhost.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int] = ("127.0.0.1", 0),
+        latency: float = 0,
+        error_rate: float = 0,
+        token_lifetime: float = 3600,
+        seed: Optional[int] = None,
+        certificate: Optional[str] = None,
+        key: Optional[str] = None,
+    ):
+        """Bind the server to the `address`, the port is chosen by the system by default."""
+        super().__init__(address, _StandinHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.token_lifetime = token_lifetime
+        self.certificate = certificate
+        scheme = "http"
+        if certificate is not None:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate, key)
+            # Handshakes are done in the request threads, see `_StandinHandler.setup`
+            self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+            scheme = "https"
+        self.url = "{}://{}:{}".format(scheme, *self.server_address[:2])
+        self.calls: dict[str, int] = {}
+        self.connections = 0
+        self._calls_lock = Lock()
+        self._random = random.Random(seed)
+        self._thread: Optional[Thread] = None
+        self._tokens = {
+            IDENTITY_PATH: fromstring(_read("IPSTS_response.xml")),
+            FEDERATION_PATH: fromstring(_read("FPSTS_response.xml")),
+        }
+        self.fault = _read("Err_response.xml")
+        self._submissions = {tclass: fromstring(_read(name)) for tclass, name in SUBMISSION_RESPONSES.items()}
+
+    def __enter__(self) -> "StandinServer":
+        self.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Serve the requests in a background thread."""
+        self._thread = Thread(target=self.serve_forever, args=(0.05,), name="cz-nia-standin", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def get_settings(self, **settings: Any) -> CzNiaAppSettings:
+        """Return the settings for the stand-in with the test certificate, `settings` override the defaults."""
+        defaults = {
+            "identity_wsdl": self.url + "/IPSTS_nice.wsdl",
+            "federation_wsdl": self.url + "/FPSTS_nice.wsdl",
+            "public_wsdl": self.url + "/Public_nice.wsdl",
+            "federation_address": self.url + FEDERATION_PATH,
+            "public_address": self.url + PUBLIC_PATH,
+            "certificate": os.path.join(DATA_DIR, "NIA.pem"),
+            "key": os.path.join(DATA_DIR, "NIA_key.pem"),
+            "password": None,
+        }
+        defaults.update(settings)
+        return CzNiaAppSettings(defaults)
+
+    def get_transport(self, settings: CzNiaAppSettings) -> Transport:
+        """Return the transport for the `settings` which trusts the certificate of the stand-in."""
+        transport = _create_transport(settings)
+        if self.certificate is not None:
+            # Environment, e.g. REQUESTS_CA_BUNDLE, would take precedence over the session
+            transport.session.trust_env = False
+            transport.session.verify = self.certificate
+        return transport
+
+    def count(self, path: str) -> None:
+        """Count the request to the path."""
+        with self._calls_lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+
+    def count_connection(self) -> None:
+        """Count the accepted connection."""
+        with self._calls_lock:
+            self.connections += 1
+
+    def is_error(self) -> bool:
+        """Return whether the request should fail."""
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def get_document(self, filename: str) -> Optional[bytes]:
+        """Return the WSDL or schema file with the addresses of the stand-in or `None` if it doesn't exist."""
+        if os.path.basename(filename) != filename or not filename.endswith((".wsdl", ".xsd")):
+            return None
+        try:
+            content = _read(filename)
+        except OSError:
+            return None
+        return content.replace(NIA_ADDRESS.encode(), self.url.encode())
+
+    def get_token(self, path: str) -> bytes:
+        """Return the response of the token service with an assertion valid from now."""
+        response = deepcopy(self._tokens[path])
+        now = datetime.now(timezone.utc)
+        created = _format_time(now)
+        expires = _format_time(now + timedelta(seconds=self.token_lifetime))
+        for conditions in _FIND_CONDITIONS(response):
+            conditions.set("NotBefore", created)
+            conditions.set("NotOnOrAfter", expires)
+        for lifetime in _FIND_LIFETIMES(response):
+            lifetime.find(_CREATED).text = created
+            lifetime.find(_EXPIRES).text = expires
+        return tostring(response, xml_declaration=True, encoding="utf-8")
+
+    def get_submission(self, request: _Element) -> Optional[bytes]:
+        """Return the response of the Submission service or `None` if the transaction class is unknown."""
+        template = self._submissions.get(_FIND_CLASS(request))
+        if template is None:
+            return None
+        response = deepcopy(template)
+        base64 = _FIND_BASE64(response)[0]
+        bodies = fromstring(b64decode(base64.text))
+        body = bodies[0]
+        bodies.remove(body)
+        for index in range(max(len(_FIND_BODY_PARTS(request)), 1)):
+            part = deepcopy(body)
+            part.set("Id", str(index))
+            bodies.append(part)
+        base64.text = b64encode(tostring(bodies)).decode()
+        return tostring(response, xml_declaration=True, encoding="utf-8")
+
+
+class _StandinHandler(BaseHTTPRequestHandler):
+    """Handler of the requests to the stand-in."""
+
+    server: StandinServer
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, do not delay the body on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        self.server.count_connection()
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        super().setup()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        _LOGGER.debug(format, *args)
+
+    def _respond(self, status: int, content: bytes, content_type: str = SOAP_CONTENT_TYPE) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if self.close_connection:
+            # Confirm the close requested by the client, otherwise it may reuse the closed connection
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        content = self.server.get_document(self.path.lstrip("/"))
+        if content is None:
+            self._respond(404, b"", "text/plain")
+        else:
+            self._respond(200, content, "text/xml; charset=utf-8")
+
+    def do_POST(self) -> None:
+        request = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.count(self.path)
+        if self.server.latency:
+            sleep(self.server.latency)
+        if self.path not in (IDENTITY_PATH, FEDERATION_PATH, PUBLIC_PATH):
+            self._respond(404, b"", "text/plain")
+            return
+        if self.server.is_error():
+            self._respond(500, self.server.fault)
+            return
+        if self.path == PUBLIC_PATH:
+            try:
+                response = self.server.get_submission(fromstring(request))
+            except XMLSyntaxError:
+                response = None
+            if response is None:
+                self._respond(500, self.server.fault)
+                return
+        else:
+            response = self.server.get_token(self.path)
+        self._respond(200, response)
+
+
+def main(args: Optional[list[str]] = None) -> None:
+    """Run the stand-in server until interrupted."""
+    parser = ArgumentParser(description="Local stand-in of the NIA services.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0, help="delay of each response in seconds")
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of a SOAP fault")
+    parser.add_argument("--token-lifetime", type=float, default=3600, help="validity of assertions in seconds")
+    parser.add_argument("--certificate", help="certificate for HTTPS, e.g. {}".format(STANDIN_CERTIFICATE))
+    parser.add_argument("--key", help="key of the certificate unless included in it")
+    options = parser.parse_args(args)
+    server = StandinServer(
+        (options.host, options.port),
+        latency=options.latency,
+        error_rate=options.error_rate,
+        token_lifetime=options.token_lifetime,
+        certificate=options.certificate,
+        key=options.key,
+    )
+    print("Serving NIA stand-in at {}, WSDL files at {}/<IPSTS|FPSTS|Public>_nice.wsdl".format(server.url, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
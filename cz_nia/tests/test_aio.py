@@ -0,0 +1,331 @@
+"""Unittests for aio module."""
+
+import asyncio
+from copy import copy
+from threading import get_ident
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+import httpx
+from zeep.transports import AsyncTransport
+
+from cz_nia.aio import (
+    _FINALIZERS,
+    _TRANSPORTS,
+    AsyncNiaClient,
+    _call_identity,
+    aclose_transports,
+    change_authenticator,
+    get_notification,
+    get_pseudonym,
+    get_transport,
+    stream_notification,
+    write_authenticator,
+)
+from cz_nia.cache import PseudonymCache
+from cz_nia.exceptions import NiaException
+from cz_nia.functions import _DOCUMENTS, _get_document as _get_sync_document
+from cz_nia.instrumentation import FPSTS, IPSTS, PARSING, SUBMISSION, HistogramCollector
+from cz_nia.standin import StandinServer
+from cz_nia.tests.test_client import (
+    EXPIRED_TIME,
+    FEDERATION_URL,
+    IDENTITY_URL,
+    SUBMISSION_URL,
+    USER_DATA,
+    VALID_TIME,
+)
+from cz_nia.tests.test_functions import SETTINGS, file_content
+from cz_nia.tests.test_instrumentation import get_count, get_size
+
+
+class MockServer:
+    """Serve the test data for the NIA endpoints and record the calls."""
+
+    def __init__(self, submission="Sub_response.xml", identity="IPSTS_response.xml"):
+        self.responses = {
+            IDENTITY_URL: identity,
+            FEDERATION_URL: "FPSTS_response.xml",
+            SUBMISSION_URL: submission,
+        }
+        self.calls: list[str] = []
+
+    async def __call__(self, request):
+        url = str(request.url)
+        self.calls.append(url)
+        # Let other tasks run meanwhile, as they would while waiting for the server
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, content=file_content(self.responses[url]).encode())
+
+    def count_calls(self, url):
+        return self.calls.count(url)
+
+    def transport(self):
+        return AsyncTransport(client=httpx.AsyncClient(transport=httpx.MockTransport(self)))
+
+
+class TestGetTransport(TestCase):
+    """Unittests for get_transport function."""
+
+    def setUp(self):
+        _TRANSPORTS.clear()
+        _FINALIZERS.clear()
+
+    def test_shared(self):
+        async def get_transports():
+            return get_transport(SETTINGS), get_transport(SETTINGS)
+
+        transport, other = asyncio.run(get_transports())
+        self.assertIsInstance(transport, AsyncTransport)
+        self.assertIs(other, transport)
+
+    def test_event_loops(self):
+        async def get_transports():
+            return get_transport(SETTINGS)
+
+        self.assertIsNot(asyncio.run(get_transports()), asyncio.run(get_transports()))
+
+    def test_no_event_loop(self):
+        with self.assertRaises(RuntimeError):
+            get_transport(SETTINGS)
+
+    def test_separate_runs(self):
+        # Connections kept alive by the first loop must not be reused by the second one
+        with StandinServer() as server:
+            settings = server.get_settings()
+            for _ in range(2):
+                self.assertEqual(
+                    asyncio.run(get_pseudonym(settings, USER_DATA)), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739"
+                )
+
+    def test_closed_at_shutdown(self):
+        async def get_pseudonym_transport(settings):
+            await get_pseudonym(settings, USER_DATA)
+            return get_transport(settings)
+
+        with StandinServer() as server:
+            settings = server.get_settings()
+            transports = [asyncio.run(get_pseudonym_transport(settings)) for _ in range(5)]
+        self.assertEqual(_TRANSPORTS, {})
+        self.assertEqual(_FINALIZERS, {})
+        self.assertTrue(all(transport.client.is_closed for transport in transports))
+
+    def test_aclose_transports(self):
+        async def close():
+            transport = get_transport(SETTINGS)
+            await aclose_transports()
+            self.assertTrue(transport.client.is_closed)
+            self.assertEqual(_TRANSPORTS, {})
+            self.assertIsNot(get_transport(SETTINGS), transport)
+            # Nothing left to close
+            await aclose_transports()
+            await aclose_transports()
+
+        asyncio.run(close())
+        self.assertEqual(_TRANSPORTS, {})
+
+    def test_closed_loop(self):
+        async def get_transports():
+            return get_transport(SETTINGS)
+
+        # Loop closed without shutting down its asynchronous generators
+        loop = asyncio.new_event_loop()
+        transport = loop.run_until_complete(get_transports())
+        loop.close()
+        self.assertIn(loop, _TRANSPORTS)
+        asyncio.run(get_transports())
+        self.assertEqual(_TRANSPORTS, {})
+        self.assertFalse(transport.client.is_closed)
+
+
+class TestCallIdentity(IsolatedAsyncioTestCase):
+    """Unittests for _call_identity function."""
+
+    async def test_token(self):
+        token = await _call_identity(SETTINGS, MockServer().transport())
+        self.assertEqual(token.attrib["AssertionID"], "_bd0832fa-ac6c-49ed-b50b-d1b309a1745d")
+
+    async def test_error(self):
+        with self.assertRaises(NiaException) as err:
+            await _call_identity(SETTINGS, MockServer(identity="Err_response.xml").transport())
+        self.assertIn("The server was unable to process", str(err.exception))
+
+    async def test_connection_error(self):
+        def handler(request):
+            raise httpx.ConnectError("Bad")
+
+        transport = AsyncTransport(client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        with self.assertRaises(NiaException):
+            await _call_identity(SETTINGS, transport)
+
+    async def test_document_in_executor(self):
+        threads = []
+
+        def get_document(wsdl, transport):
+            threads.append(get_ident())
+            return _get_sync_document(wsdl, transport)
+
+        with patch.dict(_DOCUMENTS, clear=True), patch("cz_nia.aio._get_sync_document", side_effect=get_document):
+            await _call_identity(SETTINGS, MockServer().transport())
+            await _call_identity(SETTINGS, MockServer().transport())
+        # Loaded only once, not within the event loop
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], get_ident())
+
+
+class TestFunctions(IsolatedAsyncioTestCase):
+    """Unittests for asynchronous public functions."""
+
+    async def test_get_pseudonym(self):
+        server = MockServer()
+        self.assertEqual(
+            await get_pseudonym(SETTINGS, USER_DATA, server.transport()), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739"
+        )
+        self.assertEqual(server.calls, [IDENTITY_URL, FEDERATION_URL, SUBMISSION_URL])
+
+    async def test_get_pseudonym_error(self):
+        with self.assertRaises(NiaException) as err:
+            await get_pseudonym(SETTINGS, USER_DATA, MockServer(submission="Sub_empty_response.xml").transport())
+        self.assertEqual(str(err.exception), "ISZR returned zero AIFOs")
+
+    async def test_get_pseudonym_direct(self):
+        settings = copy(SETTINGS)
+        settings.SUBMISSION_DIRECT = True
+        server = MockServer()
+        self.assertEqual(
+            await get_pseudonym(settings, USER_DATA, server.transport()), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739"
+        )
+        self.assertEqual(server.calls, [IDENTITY_URL, FEDERATION_URL, SUBMISSION_URL])
+
+    async def test_get_pseudonym_direct_error(self):
+        settings = copy(SETTINGS)
+        settings.SUBMISSION_DIRECT = True
+        with self.assertRaisesRegex(NiaException, "The server was unable to process"):
+            await get_pseudonym(settings, USER_DATA, MockServer(submission="Err_response.xml").transport())
+
+    async def test_write_authenticator(self):
+        data = {
+            "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+            "identification": "vip_identification",
+            "level_of_authentication": "High",
+        }
+        self.assertIsNone(await write_authenticator(SETTINGS, data, MockServer(submission="write_vip.xml").transport()))
+
+    async def test_change_authenticator(self):
+        data = {
+            "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+            "identification": "vip_identification",
+            "state": "Aktivni",
+            "level_of_authentication": "High",
+        }
+        self.assertIsNone(
+            await change_authenticator(SETTINGS, data, MockServer(submission="change_vip.xml").transport())
+        )
+
+    async def test_get_notification(self):
+        notifications = await get_notification(
+            SETTINGS, transport=MockServer(submission="notifications.xml").transport()
+        )
+        self.assertEqual(notifications.last_id, 11701)
+        self.assertEqual(len(notifications.notifications), 12)
+
+    async def test_stream_notification(self):
+        stream = await stream_notification(SETTINGS, transport=MockServer(submission="notifications.xml").transport())
+        self.assertEqual(len(list(stream)), 12)
+        self.assertEqual(stream.last_id, 11701)
+
+
+class TestAsyncNiaClient(IsolatedAsyncioTestCase):
+    """Unittests for AsyncNiaClient."""
+
+    async def test_reuse_assertion(self):
+        server = MockServer()
+        client = AsyncNiaClient(SETTINGS, server.transport())
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            await client.get_pseudonym(USER_DATA)
+            await client.get_pseudonym(USER_DATA)
+        self.assertEqual(server.count_calls(IDENTITY_URL), 1)
+        self.assertEqual(server.count_calls(FEDERATION_URL), 1)
+        self.assertEqual(server.count_calls(SUBMISSION_URL), 2)
+
+    async def test_observer(self):
+        collector = HistogramCollector()
+        client = AsyncNiaClient(SETTINGS, MockServer().transport(), observer=collector)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            await client.get_pseudonym(USER_DATA)
+            await client.get_pseudonym(USER_DATA)
+        self.assertEqual(get_count(collector, IPSTS), 1)
+        self.assertEqual(get_count(collector, FPSTS), 1)
+        self.assertEqual(get_count(collector, SUBMISSION), 2)
+        self.assertEqual(get_count(collector, PARSING), 2)
+        self.assertGreater(get_size(collector, IPSTS), 0)
+        self.assertGreater(get_size(collector, FPSTS), 0)
+
+    async def test_expired_assertion(self):
+        server = MockServer()
+        client = AsyncNiaClient(SETTINGS, server.transport())
+        with patch("cz_nia.tokens._now", return_value=EXPIRED_TIME):
+            await client.get_pseudonym(USER_DATA)
+            await client.get_pseudonym(USER_DATA)
+        self.assertEqual(server.count_calls(IDENTITY_URL), 2)
+        self.assertEqual(server.count_calls(FEDERATION_URL), 2)
+
+    async def test_concurrent_assertion(self):
+        server = MockServer()
+        client = AsyncNiaClient(SETTINGS, server.transport())
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            assertions = await asyncio.gather(*(client.get_assertion() for _ in range(4)))
+        self.assertEqual(server.count_calls(IDENTITY_URL), 1)
+        self.assertEqual(server.count_calls(FEDERATION_URL), 1)
+        self.assertTrue(all(assertion is assertions[0] for assertion in assertions))
+
+    async def test_concurrent_assertion_error(self):
+        server = MockServer(identity="Err_response.xml")
+        client = AsyncNiaClient(SETTINGS, server.transport())
+        results = await asyncio.gather(*(client.get_assertion() for _ in range(4)), return_exceptions=True)
+        self.assertEqual(server.count_calls(IDENTITY_URL), 1)
+        self.assertTrue(all(isinstance(result, NiaException) for result in results))
+
+    async def test_pseudonym_cache(self):
+        server = MockServer()
+        cache = PseudonymCache(60)
+        client = AsyncNiaClient(SETTINGS, server.transport(), pseudonym_cache=cache)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            await client.get_pseudonym(USER_DATA)
+            self.assertEqual(await client.get_pseudonym(USER_DATA), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+        self.assertEqual(server.count_calls(SUBMISSION_URL), 1)
+        self.assertEqual(cache.hits, 1)
+
+    async def test_invalidate(self):
+        server = MockServer()
+        client = AsyncNiaClient(SETTINGS, server.transport())
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            await client.get_pseudonym(USER_DATA)
+            client.invalidate()
+            await client.get_pseudonym(USER_DATA)
+        self.assertEqual(server.count_calls(IDENTITY_URL), 2)
+
+    async def test_get_notification(self):
+        client = AsyncNiaClient(SETTINGS, MockServer(submission="notifications.xml").transport())
+        notifications = await client.get_notification({"id": "11600"})
+        self.assertEqual(notifications.last_id, 11701)
+
+    async def test_stream_notification(self):
+        client = AsyncNiaClient(SETTINGS, MockServer(submission="notifications.xml").transport())
+        stream = await client.stream_notification()
+        self.assertEqual(len(list(stream)), 12)
+
+    async def test_authenticators(self):
+        data = {
+            "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+            "identification": "vip_identification",
+            "state": "Aktivni",
+            "level_of_authentication": "High",
+        }
+        client = AsyncNiaClient(SETTINGS, MockServer(submission="change_vip.xml").transport())
+        self.assertIsNone(await client.change_authenticator(data))
+        client = AsyncNiaClient(SETTINGS, MockServer(submission="write_vip.xml").transport())
+        self.assertIsNone(await client.write_authenticator(data))
+
+    async def test_default_transport(self):
+        self.assertIs(AsyncNiaClient(SETTINGS).transport, get_transport(SETTINGS))
@@ -0,0 +1,106 @@
+"""Unittests for cache module."""
+
+import datetime
+from copy import copy
+from unittest import TestCase
+from unittest.mock import patch
+
+from cz_nia.cache import PseudonymCache
+from cz_nia.tests.test_client import USER_DATA
+from cz_nia.tests.test_functions import SETTINGS
+
+
+class TestPseudonymCache(TestCase):
+    """Unittests for PseudonymCache."""
+
+    def test_get_set(self):
+        cache = PseudonymCache(60)
+        self.assertIsNone(cache.get(USER_DATA))
+        cache.set(USER_DATA, "pseudonym")
+        self.assertEqual(cache.get(USER_DATA), "pseudonym")
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_no_personal_data(self):
+        cache = PseudonymCache(60)
+        cache.set(USER_DATA, "pseudonym")
+        self.assertNotIn(b"Tester", repr(cache._entries).encode())
+        self.assertEqual(len(cache.get_key(USER_DATA)), 32)
+
+    def test_key_normalized(self):
+        cache = PseudonymCache(60)
+        data = {
+            "first_name": " Eda",
+            "last_name": "Tester ",
+            "birth_date": datetime.date(2000, 5, 1),
+            "address": None,
+        }
+        self.assertEqual(cache.get_key(data), cache.get_key(USER_DATA))
+        # Composed and decomposed forms of the same character
+        self.assertEqual(
+            cache.get_key(dict(USER_DATA, first_name="\u00c9da")),
+            cache.get_key(dict(USER_DATA, first_name="E\u0301da")),
+        )
+
+    def test_key_differs(self):
+        cache = PseudonymCache(60)
+        key = cache.get_key(USER_DATA)
+        self.assertNotEqual(cache.get_key(dict(USER_DATA, first_name="eda")), key)
+        self.assertNotEqual(cache.get_key(dict(USER_DATA, first_name="Éda")), key)
+        self.assertNotEqual(cache.get_key(dict(USER_DATA, address="Praha")), key)
+        self.assertNotEqual(cache.get_key(dict(USER_DATA, birth_date=datetime.date(2000, 5, 2))), key)
+        # Values are not simply concatenated
+        self.assertNotEqual(
+            cache.get_key(dict(USER_DATA, first_name="Ed", last_name="aTester")),
+            cache.get_key(dict(USER_DATA, first_name="Eda", last_name="Tester")),
+        )
+
+    def test_secret(self):
+        self.assertNotEqual(PseudonymCache(60).get_key(USER_DATA), PseudonymCache(60).get_key(USER_DATA))
+        self.assertEqual(
+            PseudonymCache(60, secret=b"secret").get_key(USER_DATA),
+            PseudonymCache(60, secret=b"secret").get_key(USER_DATA),
+        )
+
+    def test_expired(self):
+        cache = PseudonymCache(60)
+        with patch("cz_nia.cache.monotonic", return_value=1000):
+            cache.set(USER_DATA, "pseudonym")
+        with patch("cz_nia.cache.monotonic", return_value=1059):
+            self.assertEqual(cache.get(USER_DATA), "pseudonym")
+        with patch("cz_nia.cache.monotonic", return_value=1060):
+            self.assertIsNone(cache.get(USER_DATA))
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.misses, 1)
+
+    def test_lru(self):
+        cache = PseudonymCache(60, max_entries=2)
+        first, second, third = (dict(USER_DATA, first_name=name) for name in ("A", "B", "C"))
+        cache.set(first, "1")
+        cache.set(second, "2")
+        # Use the first, so the second is the least recently used
+        cache.get(first)
+        cache.set(third, "3")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(first), "1")
+        self.assertIsNone(cache.get(second))
+        self.assertEqual(cache.get(third), "3")
+
+    def test_clear(self):
+        cache = PseudonymCache(60)
+        cache.set(USER_DATA, "pseudonym")
+        cache.get(USER_DATA)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.hits, 0)
+
+    def test_from_settings(self):
+        self.assertIsNone(PseudonymCache.from_settings(SETTINGS))
+        settings = copy(SETTINGS)
+        settings.PSEUDONYM_CACHE_TTL = 300
+        settings.PSEUDONYM_CACHE_SECRET = "secret"
+        cache = PseudonymCache.from_settings(settings)
+        assert cache is not None
+        self.assertEqual(cache.ttl, 300)
+        self.assertEqual(cache.max_entries, 1000)
+        self.assertEqual(cache.get_key(USER_DATA), PseudonymCache(60, secret=b"secret").get_key(USER_DATA))
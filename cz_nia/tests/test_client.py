@@ -0,0 +1,345 @@
+"""Unittests for client module."""
+
+import datetime
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+import responses
+
+from cz_nia.cache import PseudonymCache
+from cz_nia.client import NiaClient, TokenRefresher
+from cz_nia.exceptions import NiaException
+from cz_nia.instrumentation import IPSTS, SUBMISSION, HistogramCollector
+from cz_nia.message import IdentificationMessage
+from cz_nia.tests.test_functions import (
+    SETTINGS,
+    TRANSPORT,
+    file_content,
+    identification_batch,
+    notifications_page,
+)
+from cz_nia.tests.test_instrumentation import get_count
+from cz_nia.tokens import SqliteTokenStore, Token
+
+IDENTITY_URL = "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate"
+FEDERATION_URL = "https://tnia.eidentita.cz/FPSTS/Issue.svc"
+SUBMISSION_URL = "https://tnia.eidentita.cz/WS/submission/Public.svc/token"
+# Both assertions in test data are valid at this time
+VALID_TIME = datetime.datetime(2018, 10, 5, 13, 15, tzinfo=datetime.timezone.utc)
+EXPIRED_TIME = datetime.datetime(2018, 10, 5, 15, 0, tzinfo=datetime.timezone.utc)
+USER_DATA = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+
+
+def add_responses(rsps, submission="Sub_response.xml"):
+    """Register responses for the whole call chain."""
+    rsps.add(responses.POST, IDENTITY_URL, body=file_content("IPSTS_response.xml"))
+    rsps.add(responses.POST, FEDERATION_URL, body=file_content("FPSTS_response.xml"))
+    if submission is not None:
+        rsps.add(responses.POST, SUBMISSION_URL, body=file_content(submission))
+
+
+def count_calls(rsps, url):
+    """Return the number of calls to the url."""
+    return len([call for call in rsps.calls if call.request.url == url])
+
+
+class TestNiaClient(TestCase):
+    """Unittests for NiaClient."""
+
+    def test_reuse_assertion(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps)
+            self.assertEqual(client.get_pseudonym(USER_DATA), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+            self.assertEqual(client.get_pseudonym(USER_DATA), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 1)
+            self.assertEqual(count_calls(rsps, SUBMISSION_URL), 2)
+
+    def test_expired_assertion(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=EXPIRED_TIME):
+            add_responses(rsps)
+            client.get_pseudonym(USER_DATA)
+            client.get_pseudonym(USER_DATA)
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 2)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 2)
+            self.assertEqual(count_calls(rsps, SUBMISSION_URL), 2)
+
+    def test_flight_after_renewal(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        do = client._flight.do
+        renewed = Event()
+
+        def late_do(function):
+            # Another thread renews the assertion after this caller found it missing, before it enters the flight
+            if not renewed.is_set():
+                renewed.set()
+                thread = Thread(target=client.get_assertion)
+                thread.start()
+                thread.join()
+            return do(function)
+
+        with (
+            responses.RequestsMock() as rsps,
+            patch("cz_nia.tokens._now", return_value=VALID_TIME),
+            patch.object(client._flight, "do", side_effect=late_do),
+        ):
+            add_responses(rsps, submission=None)
+            client.get_assertion()
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 1)
+
+    def test_invalidate(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps)
+            client.get_pseudonym(USER_DATA)
+            client.invalidate()
+            client.get_pseudonym(USER_DATA)
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 2)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 2)
+
+    def test_token_store(self):
+        with TemporaryDirectory() as tmp_dir:
+            store = SqliteTokenStore(os.path.join(tmp_dir, "tokens.sqlite"))
+            with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+                add_responses(rsps)
+                NiaClient(SETTINGS, TRANSPORT, token_store=store).get_pseudonym(USER_DATA)
+                # Other client, e.g. in another process, reuses the stored assertion
+                NiaClient(SETTINGS, TRANSPORT, token_store=store).get_pseudonym(USER_DATA)
+                self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+                self.assertEqual(count_calls(rsps, FEDERATION_URL), 1)
+                self.assertEqual(count_calls(rsps, SUBMISSION_URL), 2)
+
+    def test_token_store_setting(self):
+        with TemporaryDirectory() as tmp_dir:
+            settings = copy(SETTINGS)
+            settings.TOKEN_STORE_PATH = os.path.join(tmp_dir, "tokens.sqlite")
+            client = NiaClient(settings, TRANSPORT)
+            assert client.token_store is not None
+            self.assertEqual(client.token_store.path, settings.TOKEN_STORE_PATH)
+        self.assertIsNone(NiaClient(SETTINGS, TRANSPORT).token_store)
+
+    def test_pseudonym_cache(self):
+        cache = PseudonymCache(60)
+        client = NiaClient(SETTINGS, TRANSPORT, pseudonym_cache=cache)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps)
+            self.assertEqual(client.get_pseudonym(USER_DATA), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+            self.assertEqual(client.get_pseudonym(USER_DATA), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+            self.assertEqual(count_calls(rsps, SUBMISSION_URL), 1)
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertIsNone(NiaClient(SETTINGS, TRANSPORT).pseudonym_cache)
+
+    def test_pseudonym_cache_error(self):
+        cache = PseudonymCache(60)
+        client = NiaClient(SETTINGS, TRANSPORT, pseudonym_cache=cache)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission="Sub_empty_response.xml")
+            with self.assertRaises(NiaException):
+                client.get_pseudonym(USER_DATA)
+        self.assertEqual(len(cache), 0)
+
+    def test_observer(self):
+        collector = HistogramCollector()
+        client = NiaClient(SETTINGS, TRANSPORT, observer=collector)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps)
+            client.get_pseudonym(USER_DATA)
+            client.get_pseudonym(USER_DATA)
+        self.assertEqual(get_count(collector, IPSTS), 1)
+        self.assertEqual(get_count(collector, SUBMISSION), 2)
+        self.assertIsNone(SETTINGS.OBSERVER)
+
+    def test_default_transport(self):
+        client = NiaClient(SETTINGS)
+        self.assertEqual(client.transport.load_timeout, SETTINGS.TRANSPORT_TIMEOUT)
+
+    def test_error(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission="Sub_empty_response.xml")
+            with self.assertRaises(NiaException) as err:
+                client.get_pseudonym(USER_DATA)
+        self.assertEqual(str(err.exception), "ISZR returned zero AIFOs")
+
+    def test_submit_batch(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        messages = [
+            IdentificationMessage({"first_name": name, "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)})
+            for name in ("Eda", "Ida")
+        ]
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME), responses.RequestsMock() as rsps:
+            add_responses(rsps, submission=None)
+            rsps.add_callback(responses.POST, SUBMISSION_URL, callback=identification_batch)
+            self.assertEqual(client.submit_batch(messages), ["Eda", "Ida"])
+            self.assertEqual(count_calls(rsps, SUBMISSION_URL), 1)
+
+    def test_write_authenticator(self):
+        data = {
+            "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+            "identification": "vip_identification",
+            "level_of_authentication": "High",
+        }
+        with responses.RequestsMock() as rsps:
+            add_responses(rsps, submission="write_vip.xml")
+            self.assertIsNone(NiaClient(SETTINGS, TRANSPORT).write_authenticator(data))
+
+    def test_change_authenticator(self):
+        data = {
+            "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+            "identification": "vip_identification",
+            "state": "Aktivni",
+            "level_of_authentication": "High",
+        }
+        with responses.RequestsMock() as rsps:
+            add_responses(rsps, submission="change_vip.xml")
+            self.assertIsNone(NiaClient(SETTINGS, TRANSPORT).change_authenticator(data))
+
+    def test_get_notification(self):
+        with responses.RequestsMock() as rsps:
+            add_responses(rsps, submission="notifications.xml")
+            notifications = NiaClient(SETTINGS, TRANSPORT).get_notification()
+        self.assertEqual(notifications.last_id, 11701)
+        self.assertEqual(len(notifications.notifications), 12)
+
+    def test_stream_notification(self):
+        with responses.RequestsMock() as rsps:
+            add_responses(rsps, submission="notifications.xml")
+            stream = NiaClient(SETTINGS, TRANSPORT).stream_notification()
+        self.assertEqual(len(list(stream)), 12)
+        self.assertEqual(stream.last_id, 11701)
+
+    def test_iter_notifications(self):
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission=None)
+            rsps.add(responses.POST, SUBMISSION_URL, body=notifications_page(11701))
+            rsps.add(responses.POST, SUBMISSION_URL, body=file_content("notifications.xml"))
+            notifications = list(NiaClient(SETTINGS, TRANSPORT).iter_notifications())
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+            self.assertEqual(count_calls(rsps, SUBMISSION_URL), 2)
+        self.assertEqual(len(notifications), 24)
+
+    def test_refresh(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps)
+            client.get_pseudonym(USER_DATA)
+            assertion = client.get_assertion()
+            # Identity assertion expires at 13:30
+            client.refresh(margin=60)
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 2)
+            client.refresh(margin=3600)
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 2)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 3)
+            self.assertIsNot(client.get_assertion(), assertion)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 3)
+
+    def test_refresh_error(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission=None)
+            assertion = client.get_assertion()
+            rsps.replace(responses.POST, FEDERATION_URL, body=file_content("Err_response.xml"))
+            with self.assertRaises(NiaException):
+                client.refresh()
+            self.assertIs(client.get_assertion(), assertion)
+
+    def test_concurrent_assertion(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission=None)
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                assertions = list(executor.map(lambda _: client.get_assertion(), range(8)))
+            self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+            self.assertEqual(count_calls(rsps, FEDERATION_URL), 1)
+        self.assertTrue(all(assertion is assertions[0] for assertion in assertions))
+
+    def test_concurrent_assertion_error(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+
+        def get_assertion(_):
+            try:
+                return client.get_assertion()
+            except NiaException as err:
+                return err
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, IDENTITY_URL, body=file_content("Err_response.xml"))
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(get_assertion, range(4)))
+        self.assertTrue(all(isinstance(result, NiaException) for result in results))
+
+    def test_token(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        self.assertIsNone(client.token)
+        with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            add_responses(rsps, submission=None)
+            assertion = client.get_assertion()
+        assert client.token is not None
+        self.assertIs(client.token.assertion, assertion)
+        self.assertEqual(
+            client.token.expires, datetime.datetime(2018, 10, 5, 14, 12, 21, 169000, tzinfo=datetime.timezone.utc)
+        )
+
+    def test_start_refresh(self):
+        with NiaClient(SETTINGS, TRANSPORT) as client:
+            with responses.RequestsMock() as rsps, patch("cz_nia.tokens._now", return_value=VALID_TIME):
+                add_responses(rsps, submission=None)
+                client.start_refresh()
+                refresher = client._refresher
+                assert refresher is not None
+                # Starting again does nothing
+                client.start_refresh()
+                self.assertIs(client._refresher, refresher)
+                for _ in range(100):
+                    if client.token is not None:
+                        break
+                    time.sleep(0.01)
+                client.close()
+                self.assertFalse(refresher._thread.is_alive())
+                self.assertIsNone(client._refresher)
+                self.assertEqual(count_calls(rsps, IDENTITY_URL), 1)
+                self.assertEqual(count_calls(rsps, FEDERATION_URL), 1)
+
+
+class TestTokenRefresher(TestCase):
+    """Unittests for TokenRefresher."""
+
+    def test_get_delay_no_token(self):
+        refresher = TokenRefresher(NiaClient(SETTINGS, TRANSPORT), 300)
+        self.assertEqual(refresher.get_delay(), 0)
+
+    def test_get_delay(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        client._federation_token = Token(None, VALID_TIME + datetime.timedelta(minutes=30))
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertEqual(TokenRefresher(client, 300).get_delay(), 1500)
+            self.assertEqual(TokenRefresher(client, 3600).get_delay(), 0)
+
+    def test_get_delay_unknown_expiry(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        client._federation_token = Token(None, None)
+        self.assertEqual(TokenRefresher(client, 300).get_delay(), TokenRefresher.retry_interval)
+
+    def test_refresh_error(self):
+        client = NiaClient(SETTINGS, TRANSPORT)
+        refresher = TokenRefresher(client, 300)
+        with patch.object(client, "refresh", side_effect=NiaException("Error")) as refresh_mock:
+            with self.assertLogs("cz_nia.client", "WARNING"):
+                refresher.start()
+                for _ in range(100):
+                    if refresh_mock.called:
+                        break
+                    time.sleep(0.01)
+                refresher.stop()
+        refresh_mock.assert_called_once_with(300)
@@ -0,0 +1,111 @@
+"""Unittests for consumer module."""
+
+import os
+from tempfile import TemporaryDirectory
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+import responses
+
+from cz_nia.client import NiaClient
+from cz_nia.consumer import NotificationConsumer, SqliteCheckpointStore
+from cz_nia.tests.test_client import SUBMISSION_URL, VALID_TIME, add_responses
+from cz_nia.tests.test_functions import SETTINGS, TRANSPORT, file_content, notifications_page
+
+
+class TestSqliteCheckpointStore(TestCase):
+    """Unittests for SqliteCheckpointStore."""
+
+    def test_get_set(self):
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "checkpoints.sqlite")
+            store = SqliteCheckpointStore(path)
+            self.assertIsNone(store.get("name"))
+            store.set("name", 42)
+            store.set("name", 43)
+            self.assertEqual(SqliteCheckpointStore(path).get("name"), 43)
+            self.assertIsNone(store.get("other"))
+
+
+class TestNotificationConsumer(TestCase):
+    """Unittests for NotificationConsumer."""
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.store = SqliteCheckpointStore(os.path.join(tmp_dir.name, "checkpoints.sqlite"))
+        self.client = NiaClient(SETTINGS, TRANSPORT)
+        self.pages: list[list[dict]] = []
+        patcher = patch("cz_nia.tokens._now", return_value=VALID_TIME)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, notifications):
+        self.pages.append(notifications)
+
+    def add_pages(self, rsps, *bodies):
+        add_responses(rsps, submission=None)
+        for body in bodies:
+            rsps.add(responses.POST, SUBMISSION_URL, body=body)
+
+    def test_run_once(self):
+        consumer = NotificationConsumer(self.client, self.handler, self.store)
+        with responses.RequestsMock() as rsps:
+            self.add_pages(
+                rsps, notifications_page(11701), notifications_page(11800), file_content("notifications.xml")
+            )
+            with patch.object(self.store, "set", wraps=self.store.set) as set_mock:
+                self.assertEqual(consumer.run_once(), 36)
+        self.assertEqual([len(page) for page in self.pages], [12, 12, 12])
+        # Checkpoints are written in a batch
+        set_mock.assert_called_once_with("notifications", 11701)
+        self.assertEqual(self.store.get("notifications"), 11701)
+        self.assertEqual(consumer.last_id, 11701)
+
+    def test_commit_pages(self):
+        consumer = NotificationConsumer(self.client, self.handler, self.store, commit_pages=1)
+        with responses.RequestsMock() as rsps:
+            self.add_pages(rsps, notifications_page(11650), file_content("notifications.xml"))
+            with patch.object(self.store, "set", wraps=self.store.set) as set_mock:
+                consumer.run_once()
+        self.assertEqual(set_mock.call_count, 2)
+        self.assertEqual(self.store.get("notifications"), 11701)
+
+    def test_resume(self):
+        self.store.set("notifications", 11600)
+        consumer = NotificationConsumer(self.client, self.handler, self.store)
+        with responses.RequestsMock() as rsps:
+            self.add_pages(rsps, file_content("notifications.xml"))
+            consumer.run_once()
+            body = rsps.calls[-1].request.body
+        assert isinstance(body, bytes)
+        self.assertIn(b">11600<", body)
+
+    def test_handler_error(self):
+        def handler(notifications):
+            if self.pages:
+                raise ValueError("Failed")
+            self.pages.append(notifications)
+
+        consumer = NotificationConsumer(self.client, handler, self.store)
+        with responses.RequestsMock() as rsps:
+            self.add_pages(rsps, notifications_page(11650), file_content("notifications.xml"))
+            with self.assertRaises(ValueError):
+                consumer.run_once()
+        # Only the processed page is committed
+        self.assertEqual(self.store.get("notifications"), 11650)
+
+    def test_run(self):
+        consumer = NotificationConsumer(self.client, self.handler, self.store)
+        with responses.RequestsMock() as rsps:
+            add_responses(rsps, submission="notification_error.xml")
+            with patch.object(consumer, "run_once", wraps=consumer.run_once) as run_mock:
+                with self.assertLogs("cz_nia.consumer", "WARNING"):
+                    thread = Thread(target=consumer.run, kwargs={"poll_interval": 0.01})
+                    thread.start()
+                    while run_mock.call_count < 2:
+                        thread.join(0.01)
+                    consumer.stop()
+                    thread.join()
+        self.assertIsNone(self.store.get("notifications"))
@@ -0,0 +1,120 @@
+"""Unittests for debug module."""
+
+import datetime
+import logging
+from copy import copy
+from unittest import TestCase
+from unittest.mock import patch
+
+import responses
+from lxml.etree import fromstring, tostring
+
+from cz_nia.debug import REDACTED, capture, clear_exchanges, format_envelope, get_exchanges
+from cz_nia.functions import get_pseudonym
+from cz_nia.tests.test_functions import SETTINGS, add_sts_responses, file_content
+
+USER_DATA = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+
+
+class TestFormatEnvelope(TestCase):
+    """Unittests for format_envelope function."""
+
+    def test_redact_assertion(self):
+        envelope = fromstring(file_content("IPSTS_response.xml"))
+        formatted = format_envelope(envelope)
+        self.assertIn(REDACTED, formatted)
+        self.assertIn("AssertionID=", formatted)
+        self.assertNotIn("AttributeStatement", formatted)
+        # The original envelope is kept
+        self.assertIn("AttributeStatement", tostring(envelope, encoding="unicode"))
+
+    def test_redact_proof_key(self):
+        for response in ("IPSTS_response.xml", "FPSTS_response.xml"):
+            formatted = format_envelope(fromstring(file_content(response)))
+            secrets = fromstring(formatted).xpath("//*[local-name()='BinarySecret']/text()")
+            self.assertTrue(secrets)
+            self.assertEqual(set(secrets), {REDACTED})
+
+    def test_redact_certificate(self):
+        envelope = fromstring(
+            '<e xmlns:wsse="http://docs.oasis-open.org/wss/2004/01/oasis-200401-wss-wssecurity-secext-1.0.xsd"'
+            ' xmlns:ds="http://www.w3.org/2000/09/xmldsig#">'
+            "<wsse:BinarySecurityToken>MIIcert</wsse:BinarySecurityToken>"
+            "<ds:X509Certificate>MIIcert</ds:X509Certificate></e>"
+        )
+        formatted = format_envelope(envelope)
+        self.assertNotIn("MIIcert", formatted)
+        self.assertEqual(formatted.count(REDACTED), 2)
+        self.assertEqual(envelope[0].text, "MIIcert")
+
+
+class TestCapture(TestCase):
+    """Unittests for capture function."""
+
+    def setUp(self):
+        clear_exchanges()
+
+    def test_ring_buffer(self):
+        for number in range(5):
+            capture("IPSTS", fromstring("<sent n='{}'/>".format(number)), None, True, 3)
+        exchanges = get_exchanges("IPSTS")
+        self.assertEqual([exchange.sent.envelope.get("n") for exchange in exchanges], ["2", "3", "4"])
+        self.assertEqual(get_exchanges("FPSTS"), [])
+
+    def test_resize(self):
+        for number in range(3):
+            capture("IPSTS", fromstring("<sent n='{}'/>".format(number)), None, True, 3)
+        capture("IPSTS", fromstring("<sent n='3'/>"), None, True, 2)
+        self.assertEqual([exchange.sent.envelope.get("n") for exchange in get_exchanges("IPSTS")], ["2", "3"])
+
+    def test_lazy(self):
+        with patch("cz_nia.debug.format_envelope") as format_mock:
+            with patch.object(logging.getLogger("cz_nia.debug"), "isEnabledFor", return_value=False):
+                capture("IPSTS", fromstring("<sent/>"), fromstring("<received/>"), False, 3)
+        format_mock.assert_not_called()
+
+    def test_log(self):
+        with self.assertLogs("cz_nia.debug", "DEBUG") as logs:
+            capture("IPSTS", fromstring("<sent/>"), fromstring("<received/>"), False, 3)
+        self.assertEqual(len(logs.output), 3)
+        self.assertIn("Exception in IPSTS endpoint", logs.output[0])
+        self.assertIn("<sent/>", logs.output[1])
+        self.assertIn("<received/>", logs.output[2])
+
+
+class TestDebugCalls(TestCase):
+    """Unittests for capture of the calls."""
+
+    def setUp(self):
+        clear_exchanges()
+
+    def test_debug_off(self):
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("Sub_response.xml"),
+            )
+            get_pseudonym(SETTINGS, USER_DATA)
+        self.assertEqual(get_exchanges("IPSTS"), [])
+
+    def test_debug(self):
+        settings = copy(SETTINGS)
+        settings.DEBUG = True
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("Sub_response.xml"),
+            )
+            get_pseudonym(settings, USER_DATA)
+        for endpoint in ("IPSTS", "FPSTS", "Submission"):
+            (exchange,) = get_exchanges(endpoint)
+            self.assertTrue(exchange.success)
+            self.assertIsNotNone(exchange.received)
+        # Assertion sent to FPSTS is redacted
+        sent = str(get_exchanges("FPSTS")[0].sent)
+        self.assertIn("Assertion", sent)
+        self.assertNotIn("AttributeStatement", sent)
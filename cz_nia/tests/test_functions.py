@@ -2,25 +2,58 @@
 
 import datetime
 import os
+import time
+from base64 import b64decode, b64encode
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from typing import Any
 from unittest import TestCase
+from unittest.mock import patch
+from uuid import UUID
 
 import responses
-from lxml.etree import fromstring
+from lxml.etree import DocumentInvalid, fromstring
+from requests.adapters import HTTPAdapter
 from requests.exceptions import ConnectionError
 from xmlsec import Error as XmlsecError
 from zeep.transports import Transport
+from zeep.wsdl import Document
 
 from cz_nia.exceptions import NiaException
 from cz_nia.functions import (
+    _DOCUMENTS,
+    _TRANSPORTS,
     _call_federation,
     _call_identity,
     _call_submission,
+    _get_document,
+    _submit_batch,
     change_authenticator,
     get_notification,
     get_pseudonym,
+    get_pseudonyms,
+    get_transport,
+    iter_notifications,
+    stream_notification,
     write_authenticator,
+    write_authenticators,
+)
+from cz_nia.instrumentation import (
+    FPSTS,
+    IPSTS,
+    PARSING,
+    SIGNING,
+    SUBMISSION,
+    VALIDATION,
+    VERIFICATION,
+    HistogramCollector,
+)
+from cz_nia.message import (
+    ChangeAuthenticatorMessage,
+    IdentificationMessage,
+    NotificationMessage,
+    WriteAuthenticatorMessage,
 )
-from cz_nia.message import IdentificationMessage
 from cz_nia.settings import CzNiaAppSettings
 
 BASENAME = os.path.join(os.path.dirname(__file__), "data")
@@ -45,6 +78,134 @@ def file_content(filename):
         return f.read()
 
 
+def notifications_page(last_id):
+    """Return the Submission response with notifications followed by another page after the last id."""
+    response = file_content("notifications.xml")
+    start = response.index("<BodyBase64XML>") + len("<BodyBase64XML>")
+    end = response.index("</BodyBase64XML>")
+    body = b64decode(response[start:end]).replace(
+        b"</NotifikaceIdpResponse>",
+        "<NotifikaceIdpPosledniId>{}</NotifikaceIdpPosledniId>"
+        "<ExistujiDalsiNotifikace>true</ExistujiDalsiNotifikace></NotifikaceIdpResponse>".format(last_id).encode(),
+    )
+    return response[:start] + b64encode(body).decode() + response[end:]
+
+
+def add_sts_responses(rsps):
+    """Register the responses of the token services."""
+    rsps.add(
+        responses.POST, "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate", body=file_content("IPSTS_response.xml")
+    )
+    rsps.add(responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml"))
+
+
+def identification_batch(request):
+    """Respond to the batched identification with the first names as pseudonyms, users named Unknown are not found.
+
+    Bodies are in the reversed order, so they have to be matched by their ids.
+    """
+    names = fromstring(request.body).xpath("//*[local-name()='Jmeno']/text()")
+    bodies = []
+    for index, name in reversed(list(enumerate(names))):
+        status = (
+            "<Status>Error</Status><Detail>ISZR returned zero AIFOs</Detail>"
+            if name == "Unknown"
+            else "<Status>OK</Status>"
+        )
+        bodies.append(
+            '<Body Id="{}" xmlns="http://www.govtalk.gov.uk/CM/envelope">'
+            '<ZtotozneniResponse xmlns="urn:nia.ztotozneni/response:v4"><Pseudonym>{}</Pseudonym>{}</ZtotozneniResponse>'
+            "</Body>".format(index, name, status)
+        )
+    body = '<bodies xmlns="http://www.government-gateway.cz/wcf/submission">{}</bodies>'.format("".join(bodies))
+    return submission_response(b64encode(body.encode()).decode())
+
+
+def broken_batch(request):
+    """Respond as `identification_batch`, but break the responses to the batches with users named Malformed or Encoded.
+
+    Body of the response to Malformed is not a well-formed XML, the one to Encoded is not a valid base64.
+    """
+    names = fromstring(request.body).xpath("//*[local-name()='Jmeno']/text()")
+    if "Malformed" in names:
+        return submission_response(
+            b64encode(b'<bodies xmlns="http://www.government-gateway.cz/wcf/submission"><Body').decode()
+        )
+    if "Encoded" in names:
+        return submission_response("QQ")
+    return identification_batch(request)
+
+
+def submission_response(body):
+    """Return the Submission response with the base64 encoded body."""
+    response = file_content("Sub_response.xml")
+    start = response.index("<BodyBase64XML>") + len("<BodyBase64XML>")
+    end = response.index("</BodyBase64XML>")
+    return (200, {}, response[:start] + body + response[end:])
+
+
+class TestGetTransport(TestCase):
+    """Unittests for get_transport function."""
+
+    def setUp(self):
+        _TRANSPORTS.clear()
+
+    def test_shared(self):
+        transport = get_transport(SETTINGS)
+        self.assertIs(get_transport(SETTINGS), transport)
+        self.assertEqual(transport.load_timeout, SETTINGS.TRANSPORT_TIMEOUT)
+
+    def test_different_settings(self):
+        settings = CzNiaAppSettings(
+            {
+                "identity_wsdl": SETTINGS.IDENTITY_WSDL,
+                "federation_wsdl": SETTINGS.FEDERATION_WSDL,
+                "public_wsdl": SETTINGS.PUBLIC_WSDL,
+                "federation_address": SETTINGS.FEDERATION_ADDRESS,
+                "public_address": SETTINGS.PUBLIC_ADDRESS,
+                "certificate": SETTINGS.CERTIFICATE,
+                "key": SETTINGS.KEY,
+                "password": None,
+                "pool_connections": 2,
+                "pool_maxsize": 20,
+                "keep_alive": False,
+            }
+        )
+        with patch("cz_nia.functions.HTTPAdapter", wraps=HTTPAdapter) as adapter_mock:
+            transport = get_transport(settings)
+        self.assertIsNot(transport, get_transport(SETTINGS))
+        adapter_mock.assert_called_once_with(pool_connections=2, pool_maxsize=20)
+        self.assertEqual(transport.session.headers["Connection"], "close")
+
+    def test_keep_alive(self):
+        self.assertNotEqual(get_transport(SETTINGS).session.headers.get("Connection"), "close")
+
+
+class TestGetDocument(TestCase):
+    """Unittests for _get_document function."""
+
+    def setUp(self):
+        _DOCUMENTS.clear()
+
+    def test_parse_once(self):
+        with patch("cz_nia.functions.Document", wraps=Document) as document_mock:
+            document = _get_document(SETTINGS.IDENTITY_WSDL, TRANSPORT)
+            self.assertIs(_get_document(SETTINGS.IDENTITY_WSDL, TRANSPORT), document)
+        document_mock.assert_called_once()
+
+    def test_different_wsdl(self):
+        self.assertIsNot(
+            _get_document(SETTINGS.IDENTITY_WSDL, TRANSPORT), _get_document(SETTINGS.FEDERATION_WSDL, TRANSPORT)
+        )
+
+    def test_threads(self):
+        with patch("cz_nia.functions.Document", wraps=Document) as document_mock:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                documents = list(executor.map(lambda _: _get_document(SETTINGS.PUBLIC_WSDL, TRANSPORT), range(8)))
+        document_mock.assert_called_once()
+        self.assertTrue(all(document is documents[0] for document in documents))
+
+
 class TestCallIdentity(TestCase):
     """Unittests for _call_identity function."""
 
@@ -190,6 +351,108 @@ class TestCallSubmission(TestCase):
             )
 
 
+class TestCallSubmissionDirect(TestCase):
+    """Unittests for _call_submission function with the direct path."""
+
+    def setUp(self):
+        self.settings = copy(SETTINGS)
+        self.settings.SUBMISSION_DIRECT = True
+
+    def _submit(self, settings, message, response):
+        """Return the request body, headers and the returned body with fixed ids and timestamps."""
+        fixed_uuid = UUID(int=1)
+        with (
+            patch("zeep.wsa.uuid.uuid4", return_value=fixed_uuid),
+            patch("zeep.wsse.utils.uuid4", return_value=fixed_uuid),
+            patch("cz_nia.functions.uuid4", return_value=fixed_uuid),
+            patch("cz_nia.wsse.signature.get_timestamp", return_value="2018-10-05T13:15:00+00:00"),
+            responses.RequestsMock() as rsps,
+        ):
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content(response),
+            )
+            body = _call_submission(settings, TRANSPORT, fromstring(file_content("sub_token.xml")), message)
+            request = rsps.calls[0].request
+            return request.body, dict(request.headers), body
+
+    def test_same_as_zeep(self):
+        messages = [
+            (
+                IdentificationMessage(
+                    {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+                ),
+                "Sub_response.xml",
+            ),
+            (
+                WriteAuthenticatorMessage(
+                    {
+                        "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+                        "identification": "vip_identification",
+                        "level_of_authentication": "High",
+                    }
+                ),
+                "write_vip.xml",
+            ),
+            (
+                ChangeAuthenticatorMessage(
+                    {
+                        "pseudonym": "1d71ff1a-d732-4485-a8dc-ad4c42a8a739",
+                        "identification": "vip_identification",
+                        "state": "Aktivni",
+                        "level_of_authentication": "High",
+                    }
+                ),
+                "change_vip.xml",
+            ),
+            (NotificationMessage({"id": 12}), "notifications.xml"),
+        ]
+        for message, response in messages:
+            with self.subTest(message=message):
+                self.assertEqual(
+                    self._submit(self.settings, message, response), self._submit(SETTINGS, message, response)
+                )
+
+    def test_error(self):
+        message = IdentificationMessage(
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        )
+        with self.assertRaises(NiaException) as err:
+            self._submit(self.settings, message, "Err_response.xml")
+        self.assertIn("The server was unable to process", str(err.exception))
+
+    def test_invalid_response(self):
+        message = IdentificationMessage(
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        )
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, "https://tnia.eidentita.cz/WS/submission/Public.svc/token", body="")
+            with self.assertRaisesRegex(NiaException, "Invalid XML"):
+                _call_submission(self.settings, TRANSPORT, fromstring(file_content("sub_token.xml")), message)
+
+    def test_requests_error(self):
+        message = IdentificationMessage(
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        )
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/WS/submission/Public.svc/token", body=ConnectionError("Bad")
+            )
+            with self.assertRaises(NiaException):
+                _call_submission(self.settings, TRANSPORT, fromstring(file_content("sub_token.xml")), message)
+
+    def test_debug(self):
+        self.settings.DEBUG = True
+        message = IdentificationMessage(
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        )
+        with self.assertLogs("cz_nia.debug", "DEBUG") as logs:
+            self._submit(self.settings, message, "Sub_response.xml")
+        self.assertIn("Submit", logs.output[0])
+        self.assertIn("SubmitResponse", logs.output[1])
+
+
 class TestGetPseudonym(TestCase):
     """Unittests for get_pseudonym function."""
 
@@ -231,6 +494,219 @@ class TestGetPseudonym(TestCase):
                 get_pseudonym(SETTINGS, user_data)
             self.assertEqual(str(err.exception), "ISZR returned zero AIFOs")
 
+    def test_validation_never(self):
+        settings = copy(SETTINGS)
+        settings.VALIDATION_RATE = 0
+        user_data = {"first_name": "Eda", "last_name": "Tester" * 100, "birth_date": datetime.date(2000, 5, 1)}
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("Sub_response.xml"),
+            )
+            # Message is not validated, so it is sent
+            self.assertEqual(get_pseudonym(settings, user_data), "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+
+    def test_observer(self):
+        settings = copy(SETTINGS)
+        settings.OBSERVER = HistogramCollector()
+        user_data = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("Sub_response.xml"),
+            )
+            get_pseudonym(settings, user_data)
+        for name in (IPSTS, FPSTS, SUBMISSION, VALIDATION, PARSING):
+            self.assertEqual(settings.OBSERVER.get(name).count, 1)
+        self.assertEqual(settings.OBSERVER.get(SIGNING).count, 3)
+        self.assertEqual(settings.OBSERVER.get(VERIFICATION).count, 3)
+        for name in (IPSTS, FPSTS, SUBMISSION, PARSING):
+            self.assertGreater(settings.OBSERVER.get(name).size, 0)
+
+    def test_observer_error(self):
+        settings = copy(SETTINGS)
+        settings.OBSERVER = HistogramCollector()
+        user_data = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate", status=500)
+            with self.assertRaises(NiaException):
+                get_pseudonym(settings, user_data)
+        stats = settings.OBSERVER.get(IPSTS)
+        self.assertEqual((stats.count, stats.failures), (1, 1))
+        self.assertIsNone(settings.OBSERVER.get(SUBMISSION))
+
+
+class TestGetPseudonyms(TestCase):
+    """Unittests for get_pseudonyms function."""
+
+    @staticmethod
+    def submission_callback(request):
+        # Users named Unknown are not found
+        if b"Unknown" in request.body:
+            return (200, {}, file_content("Sub_empty_response.xml"))
+        return (200, {}, file_content("Sub_response.xml"))
+
+    def test_pseudonyms(self):
+        users_data = [
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)},
+            {"first_name": "Unknown", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)},
+            {"first_name": "Ida", "last_name": "Tester", "birth_date": datetime.date(2001, 5, 1)},
+        ]
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add_callback(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                callback=self.submission_callback,
+            )
+            result = get_pseudonyms(SETTINGS, iter(users_data), max_workers=2)
+            self.assertEqual(len(rsps.calls), 5)
+        self.assertEqual(result[0], "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+        self.assertIsInstance(result[1], NiaException)
+        self.assertEqual(str(result[1]), "ISZR returned zero AIFOs")
+        self.assertEqual(result[2], "1d71ff1a-d732-4485-a8dc-ad4c42a8a739")
+
+    def test_batch(self):
+        users_data = [
+            {"first_name": name, "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+            for name in ("Eda", "Unknown", "Ida", "Ada", "Oda")
+        ]
+        # Invalid data are not sent
+        users_data[3]["last_name"] = "Tester" * 100
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add_callback(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                callback=identification_batch,
+            )
+            result = get_pseudonyms(SETTINGS, users_data, batch_size=2)
+            self.assertEqual(len(rsps.calls), 5)
+        self.assertEqual(result[0], "Eda")
+        self.assertIsInstance(result[1], NiaException)
+        self.assertEqual(str(result[1]), "ISZR returned zero AIFOs")
+        self.assertEqual(result[2], "Ida")
+        error = result[3]
+        assert isinstance(error, NiaException)
+        self.assertIsInstance(error.args[0], DocumentInvalid)
+        self.assertEqual(result[4], "Oda")
+
+    def test_batch_direct(self):
+        settings = copy(SETTINGS)
+        settings.SUBMISSION_DIRECT = True
+        users_data = [
+            {"first_name": name, "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+            for name in ("Eda", "Ida", "Ada")
+        ]
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add_callback(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                callback=identification_batch,
+            )
+            self.assertEqual(get_pseudonyms(settings, users_data, batch_size=3), ["Eda", "Ida", "Ada"])
+            self.assertEqual(len(rsps.calls), 3)
+
+    def test_batch_error(self):
+        users_data = [
+            {"first_name": name, "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+            for name in ("Eda", "Ida")
+        ]
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("Err_response.xml"),
+            )
+            result = get_pseudonyms(SETTINGS, users_data, batch_size=2)
+        self.assertIsInstance(result[0], NiaException)
+        self.assertIs(result[1], result[0])
+
+    def test_missing_data(self):
+        users_data: list[dict[str, Any]] = [
+            {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)},
+            {"first_name": "Eva", "last_name": "Novak"},
+        ]
+        for batch_size in (1, 2):
+            with self.subTest(batch_size=batch_size), responses.RequestsMock() as rsps:
+                add_sts_responses(rsps)
+                rsps.add_callback(
+                    responses.POST,
+                    "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                    callback=identification_batch,
+                )
+                result = get_pseudonyms(SETTINGS, users_data, batch_size=batch_size)
+                self.assertEqual(result[0], "Eda")
+                self.assertIsInstance(result[1], NiaException)
+                self.assertEqual(len(rsps.calls), 3)
+
+    def test_broken_response(self):
+        users_data = [
+            {"first_name": name, "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+            for name in ("Eda", "Malformed", "Eva", "Encoded", "Ema", "Petr")
+        ]
+        for batch_size, pseudonyms in (
+            (1, ["Eda", None, "Eva", None, "Ema", "Petr"]),
+            (2, [None] * 4 + ["Ema", "Petr"]),
+        ):
+            with self.subTest(batch_size=batch_size), responses.RequestsMock() as rsps:
+                add_sts_responses(rsps)
+                rsps.add_callback(
+                    responses.POST,
+                    "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                    callback=broken_batch,
+                )
+                result = get_pseudonyms(SETTINGS, users_data, batch_size=batch_size)
+                for pseudonym, item in zip(pseudonyms, result):
+                    if pseudonym is None:
+                        self.assertIsInstance(item, NiaException)
+                    else:
+                        self.assertEqual(item, pseudonym)
+
+    def test_invalid_data(self):
+        users_data = [{"first_name": "Eda", "last_name": "Tester" * 100, "birth_date": datetime.date(2000, 5, 1)}]
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            result = get_pseudonyms(SETTINGS, users_data)
+        self.assertIsInstance(result[0], NiaException)
+
+    def test_token_error(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("Err_response.xml"),
+            )
+            with self.assertRaises(NiaException):
+                get_pseudonyms(SETTINGS, [{"first_name": "Eda"}])
+
 
 class TestWriteAuthenticator(TestCase):
     """Unittests for write_authenticator function."""
@@ -282,6 +758,42 @@ class TestWriteAuthenticator(TestCase):
             self.assertEqual(str(err.exception), "Identification record already exists")
 
 
+class TestWriteAuthenticators(TestCase):
+    """Unittests for write_authenticators function."""
+
+    def test_write_authenticators(self):
+        data = [
+            {"pseudonym": pseudonym, "identification": "vip_identification", "level_of_authentication": "High"}
+            for pseudonym in ("1d71ff1a-d732-4485-a8dc-ad4c42a8a739", "9b4f5a0a-7a1e-4c5b-a2a4-3a1f6f0c1d2e")
+        ]
+        with responses.RequestsMock() as rsps:
+            add_sts_responses(rsps)
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("write_vip.xml"),
+            )
+            # Response has a single body, the other write has no result
+            result = write_authenticators(SETTINGS, data, batch_size=2)
+            request = fromstring(rsps.calls[2].request.body)
+        self.assertEqual(len(request.xpath("//*[local-name()='BodyPart']")), 2)
+        self.assertIsNone(result[0])
+        self.assertIsInstance(result[1], NiaException)
+        self.assertEqual(str(result[1]), "Empty response")
+
+    def test_mixed_batch(self):
+        messages = [
+            IdentificationMessage(
+                {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+            ),
+            WriteAuthenticatorMessage(
+                {"pseudonym": "1d71ff1a", "identification": "vip_identification", "level_of_authentication": "High"}
+            ),
+        ]
+        with self.assertRaisesRegex(ValueError, "same action"):
+            _submit_batch(SETTINGS, TRANSPORT, fromstring(file_content("sub_token.xml")), messages)
+
+
 class TestChangeAuthenticator(TestCase):
     """Unittests for change_authenticator function."""
 
@@ -412,3 +924,120 @@ class TestGetNotification(TestCase):
             with self.assertRaises(NiaException) as err:
                 get_notification(SETTINGS)
             self.assertEqual(str(err.exception), "General Error. See log for more details")
+
+
+class TestStreamNotification(TestCase):
+    """Unittests for stream_notification."""
+
+    def test_stream_notification(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("notifications.xml"),
+            )
+            stream = stream_notification(SETTINGS)
+        notifications = list(stream)
+        self.assertEqual(len(notifications), 12)
+        self.assertEqual(NotificationMessage.get_id(notifications[1]), 11627)
+        self.assertEqual(stream.last_id, 11701)
+        self.assertFalse(stream.more_notifications)
+
+
+class TestIterNotifications(TestCase):
+    """Unittests for iter_notifications."""
+
+    def test_pages(self):
+        pages = [notifications_page(11701), notifications_page(11800), file_content("notifications.xml")]
+        requests = []
+
+        def submission_callback(request):
+            requests.append(request.body)
+            return (200, {}, pages[len(requests) - 1])
+
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add_callback(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                callback=submission_callback,
+            )
+            notifications = list(iter_notifications(SETTINGS, 11600))
+            self.assertEqual(len(rsps.calls), 5)
+        self.assertEqual(len(notifications), 36)
+        self.assertEqual(NotificationMessage.get_id(notifications[12]), 11612)
+        self.assertIn(b">11600<", requests[0])
+        self.assertIn(b">11701<", requests[1])
+        self.assertIn(b">11800<", requests[2])
+
+    def test_prefetch(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=notifications_page(11701),
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("notifications.xml"),
+            )
+            notifications = iter_notifications(SETTINGS)
+            next(notifications)
+            # The next page is requested while the first one is consumed
+            for _ in range(100):
+                if len(rsps.calls) == 4:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(rsps.calls), 4)
+            self.assertEqual(len(list(notifications)), 23)
+
+    def test_error(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/IPSTS/issue.svc/certificate",
+                body=file_content("IPSTS_response.xml"),
+            )
+            rsps.add(
+                responses.POST, "https://tnia.eidentita.cz/FPSTS/Issue.svc", body=file_content("FPSTS_response.xml")
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=notifications_page(11701),
+            )
+            rsps.add(
+                responses.POST,
+                "https://tnia.eidentita.cz/WS/submission/Public.svc/token",
+                body=file_content("notification_error.xml"),
+            )
+            notifications = iter_notifications(SETTINGS)
+            # Notifications from the first page are available before the error
+            for _ in range(12):
+                next(notifications)
+            with self.assertRaises(NiaException):
+                next(notifications)
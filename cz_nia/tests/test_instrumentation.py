@@ -0,0 +1,117 @@
+"""Unittests for instrumentation module."""
+
+from unittest import TestCase
+
+from cz_nia.instrumentation import HistogramCollector, Observer, PhaseEvent, PhaseStats, phase
+
+
+def get_count(collector: HistogramCollector, name: str) -> int:
+    """Return the number of the observed phases."""
+    stats = collector.get(name)
+    return 0 if stats is None else stats.count
+
+
+def get_size(collector: HistogramCollector, name: str) -> int:
+    """Return the total size of the observed phases."""
+    stats = collector.get(name)
+    return 0 if stats is None else stats.size
+
+
+class RecordingObserver(Observer):
+    """Observer recording the calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    def start(self, phase):
+        self.calls.append(("start", phase))
+
+    def stop(self, event):
+        self.calls.append(("stop", event))
+
+
+class TestPhase(TestCase):
+    """Unittests for phase function."""
+
+    def test_no_observer(self):
+        with phase(None, "parsing") as measured:
+            measured.size = 42
+        self.assertIsNone(measured.size)
+        self.assertIs(phase(None, "parsing"), measured)
+
+    def test_observer(self):
+        observer = RecordingObserver()
+        with phase(observer, "parsing", 12):
+            pass
+        self.assertEqual(observer.calls[0], ("start", "parsing"))
+        event = observer.calls[1][1]
+        self.assertEqual((event.phase, event.size, event.success), ("parsing", 12, True))
+        self.assertGreaterEqual(event.duration, 0)
+
+    def test_size(self):
+        observer = RecordingObserver()
+        with phase(observer, "submission") as measured:
+            measured.size = 42
+        self.assertEqual(observer.calls[1][1].size, 42)
+
+    def test_failure(self):
+        observer = RecordingObserver()
+        with self.assertRaises(ValueError):
+            with phase(observer, "parsing"):
+                raise ValueError("Boom")
+        self.assertFalse(observer.calls[1][1].success)
+
+
+class TestPhaseStats(TestCase):
+    """Unittests for PhaseStats."""
+
+    def test_empty(self):
+        self.assertIsNone(PhaseStats((1, 2)).quantile(0.5))
+
+    def test_quantile(self):
+        stats = PhaseStats((0.1, 0.2, 0.5))
+        for duration in (0.05, 0.05, 0.15, 0.3, 1):
+            stats.add(PhaseEvent("parsing", duration, None, True))
+        self.assertEqual(stats.counts, [2, 1, 1, 1])
+        self.assertEqual(stats.quantile(0.4), 0.1)
+        self.assertEqual(stats.quantile(0.5), 0.2)
+        self.assertEqual(stats.quantile(0.8), 0.5)
+        self.assertEqual(stats.quantile(1), float("inf"))
+
+    def test_add(self):
+        stats = PhaseStats((1,))
+        stats.add(PhaseEvent("parsing", 0.5, 10, True))
+        stats.add(PhaseEvent("parsing", 1.5, None, False))
+        self.assertEqual((stats.count, stats.failures, stats.total, stats.size), (2, 1, 2.0, 10))
+
+
+class TestHistogramCollector(TestCase):
+    """Unittests for HistogramCollector."""
+
+    def test_collect(self):
+        collector = HistogramCollector(buckets=(0.5, 0.1))
+        collector.stop(PhaseEvent("parsing", 0.05, 10, True))
+        collector.stop(PhaseEvent("parsing", 0.3, 20, False))
+        collector.stop(PhaseEvent("signing", 1, None, True))
+        self.assertEqual(sorted(collector.phases), ["parsing", "signing"])
+        stats = collector.get("parsing")
+        assert stats is not None
+        self.assertEqual(stats.buckets, (0.1, 0.5))
+        self.assertEqual(stats.counts, [1, 1, 0])
+        self.assertEqual((stats.count, stats.failures, stats.size), (2, 1, 30))
+        self.assertIsNone(collector.get("validation"))
+
+    def test_get_copy(self):
+        collector = HistogramCollector()
+        collector.stop(PhaseEvent("parsing", 0.05, None, True))
+        stats = collector.get("parsing")
+        collector.stop(PhaseEvent("parsing", 0.05, None, True))
+        assert stats is not None
+        self.assertEqual(stats.count, 1)
+        self.assertEqual(get_count(collector, "parsing"), 2)
+
+    def test_reset(self):
+        collector = HistogramCollector()
+        collector.stop(PhaseEvent("parsing", 0.05, None, True))
+        collector.reset()
+        self.assertEqual(collector.phases, [])
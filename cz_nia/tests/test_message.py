@@ -1,18 +1,28 @@
 """Unittests for messages."""
 
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
+from unittest.mock import patch
 
-from lxml.etree import DocumentInvalid, Element, QName, SubElement, fromstring
+from lxml.etree import DocumentInvalid, Element, QName, SubElement, XMLSchema, fromstring
 
 from cz_nia.exceptions import NiaException
 from cz_nia.message import (
+    _SCHEMAS,
+    VALIDATION_STATS,
     ChangeAuthenticatorMessage,
     IdentificationMessage,
     NiaMessage,
+    Notification,
     NotificationMessage,
+    NotificationStreamMessage,
     WriteAuthenticatorMessage,
+    get_schema,
+    parse_datetime,
+    unpack_batch,
 )
+from cz_nia.tests.test_functions import file_content
 
 BASE_BODY = '<bodies xmlns="http://www.government-gateway.cz/wcf/submission">\
              <Body Id="0" xmlns="http://www.govtalk.gov.uk/CM/envelope"> \
@@ -40,6 +50,29 @@ class NiaMessageTestClass(NiaMessage):
         return "parsed"
 
 
+class TestGetSchema(TestCase):
+    """Unittests for get_schema function."""
+
+    def setUp(self):
+        _SCHEMAS.clear()
+
+    def test_cached(self):
+        xmlschema = get_schema("ZtotozneniRequest.xsd")
+        self.assertIs(get_schema("ZtotozneniRequest.xsd"), xmlschema)
+        self.assertIsNot(get_schema("NotifikaceIdpRequest.xsd"), xmlschema)
+
+    def test_compiled_once(self):
+        with patch("cz_nia.message.XMLSchema", wraps=XMLSchema) as schema_mock:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                schemas = list(executor.map(lambda _: get_schema("ZtotozneniRequest.xsd"), range(8)))
+            for _ in range(2):
+                IdentificationMessage(
+                    {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+                ).pack()
+        self.assertEqual(schema_mock.call_count, 1)
+        self.assertTrue(all(xmlschema is schemas[0] for xmlschema in schemas))
+
+
 class TestNiaMessage(TestCase):
     """Unittests for NiaMessage using NiaMessageTestClass."""
 
@@ -47,6 +80,11 @@ class TestNiaMessage(TestCase):
         message = NiaMessageTestClass("")
         self.assertEqual(message.get_namespace_map, {"gov": message.govtalk_namespace, "nia": "response_namespace"})
 
+    def test_response_paths(self):
+        self.assertEqual(set(NiaMessageTestClass.response_paths), {"status", "detail"})
+        self.assertEqual(set(IdentificationMessage.response_paths), {"status", "detail", "pseudonym"})
+        self.assertIsNot(IdentificationMessage.response_paths["status"], NotificationMessage.response_paths["status"])
+
     def test_validate(self):
         payload = Element(QName("request_namespace", "request"))
         content = SubElement(payload, QName("request_namespace", "content"))
@@ -69,6 +107,36 @@ class TestNiaMessage(TestCase):
         self.assertEqual(children[0].tag, QName("request_namespace", "content"))
         self.assertEqual(children[0].text, "something")
 
+    def test_pack_validation_stats(self):
+        VALIDATION_STATS.reset()
+        NiaMessageTestClass({"content": "something"}).pack()
+        with self.assertRaises(DocumentInvalid):
+            IdentificationMessage({"first_name": "Tester" * 100, "birth_date": datetime.date(2000, 5, 1)}).pack()
+        self.assertEqual(VALIDATION_STATS.validated, 2)
+        self.assertEqual(VALIDATION_STATS.failed, 1)
+
+    def test_pack_never(self):
+        VALIDATION_STATS.reset()
+        message = IdentificationMessage({"first_name": "Tester" * 100, "birth_date": datetime.date(2000, 5, 1)})
+        message.pack(validation_rate=0)
+        self.assertEqual(VALIDATION_STATS.validated, 0)
+
+    def test_pack_sampled(self):
+        VALIDATION_STATS.reset()
+        message = NiaMessageTestClass({"content": "something"})
+        with patch("cz_nia.message.random", side_effect=[0.2, 0.7]):
+            message.pack(validation_rate=0.5)
+            message.pack(validation_rate=0.5)
+        self.assertEqual(VALIDATION_STATS.validated, 1)
+
+    def test_pack_sampled_error(self):
+        VALIDATION_STATS.reset()
+        message = IdentificationMessage({"first_name": "Tester" * 100, "birth_date": datetime.date(2000, 5, 1)})
+        with patch("cz_nia.message.random", return_value=0.2):
+            with self.assertRaises(DocumentInvalid):
+                message.pack(validation_rate=0.5)
+        self.assertEqual(VALIDATION_STATS.failed, 1)
+
     def test_unpack(self):
         content = '<response_class xmlns:xsd="http://www.w3.org/2001/XMLSchema" \
                    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
@@ -115,6 +183,57 @@ class TestNiaMessage(TestCase):
             NiaMessageTestClass("").verify_message(response)
 
 
+class TestUnpackBatch(TestCase):
+    """Unittests for unpack_batch function."""
+
+    @staticmethod
+    def _body(body_id, pseudonym, status="OK"):
+        return (
+            '<Body {} xmlns="http://www.govtalk.gov.uk/CM/envelope">'
+            '<ZtotozneniResponse xmlns="urn:nia.ztotozneni/response:v4">'
+            "<Pseudonym>{}</Pseudonym><Status>{}</Status><Detail>Failed</Detail></ZtotozneniResponse>"
+            "</Body>".format(body_id, pseudonym, status)
+        )
+
+    def _unpack(self, *bodies):
+        messages = [IdentificationMessage({}) for _ in range(3)]
+        response = '<bodies xmlns="http://www.government-gateway.cz/wcf/submission">{}</bodies>'.format("".join(bodies))
+        return unpack_batch(messages, response.encode())
+
+    def test_ids(self):
+        result = self._unpack(
+            self._body('Id="2"', "third"), self._body('Id="0"', "first"), self._body('Id="1"', "second")
+        )
+        self.assertEqual(result, ["first", "second", "third"])
+
+    def test_order(self):
+        result = self._unpack(self._body("", "first"), self._body("", "second"), self._body("", "third"))
+        self.assertEqual(result, ["first", "second", "third"])
+
+    def test_errors(self):
+        result = self._unpack(self._body('Id="0"', "first"), self._body('Id="1"', "second", status="Error"))
+        self.assertEqual(result[0], "first")
+        self.assertIsInstance(result[1], NiaException)
+        self.assertEqual(str(result[1]), "Failed")
+        self.assertIsInstance(result[2], NiaException)
+        self.assertEqual(str(result[2]), "Empty response")
+
+    def test_malformed(self):
+        messages = [IdentificationMessage({}) for _ in range(2)]
+        result = unpack_batch(messages, b'<bodies xmlns="http://www.government-gateway.cz/wcf/submission"><Body')
+        self.assertEqual(len(result), 2)
+        self.assertTrue(all(isinstance(error, NiaException) for error in result))
+
+    def test_extract_error(self):
+        bodies = (self._body('Id="0"', "first"), self._body('Id="1"', "second"), self._body('Id="2"', "third"))
+        with patch.object(IdentificationMessage, "extract_message", side_effect=["first", ValueError("Bad"), "third"]):
+            result = self._unpack(*bodies)
+        self.assertEqual(result[0], "first")
+        self.assertIsInstance(result[1], NiaException)
+        self.assertEqual(str(result[1]), "Bad")
+        self.assertEqual(result[2], "third")
+
+
 class TestIdentificationMessage(TestCase):
     """Unittests for IdentificationMessage."""
 
@@ -129,6 +248,11 @@ class TestIdentificationMessage(TestCase):
         body = response.find("gov:Body/nia:ZtotozneniResponse", namespaces=IdentificationMessage("").get_namespace_map)
         self.assertEqual(IdentificationMessage("").extract_message(body), "this is pseudonym")
 
+    def test_extract_message_missing(self):
+        content = '<ZtotozneniResponse xmlns="urn:nia.ztotozneni/response:v4"><Status>OK</Status></ZtotozneniResponse>'
+        with self.assertRaisesRegex(NiaException, "Missing pseudonym"):
+            IdentificationMessage("").unpack(BASE_BODY.format(CONTENT=content).encode())
+
     def test_create_message(self):
         message = IdentificationMessage(
             {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
@@ -479,3 +603,115 @@ class TestNotificationMessage(TestCase):
         self.assertEqual(message.nsmap.get(message.prefix), namespace)
         self.assertEqual(len(message.getchildren()), 1)
         self.assertEqual(message.find("nia:NotifikaceIdpId", namespaces={"nia": namespace}).text, "42")
+
+    def test_records(self):
+        response = fromstring(file_content("notification_body.xml").encode())
+        body = response.find("gov:Body/nia:NotifikaceIdpResponse", namespaces=NotificationMessage("").get_namespace_map)
+        result = NotificationMessage(None, records=True).extract_message(body)
+        self.assertEqual(result.last_id, 11701)
+        self.assertEqual(
+            result.notifications[0],
+            Notification(
+                id=11612,
+                pseudonym="ca8ff536-3d6c-42ce-a33f-c19e5377b6ab",
+                source="ROBREF",
+                message="Změna referenčních údajů ROB.",
+                datetime=datetime.datetime(2020, 4, 1, 7, 1, 4, 890000),
+                reference_data={"address": "76210", "given_name": "JULIE", "last_name": "VALIHRACHOVÁ"},
+            ),
+        )
+        second = result.notifications[1]
+        assert isinstance(second, Notification)
+        self.assertIsNone(second.reference_data)
+        # Same content as the dictionaries
+        dicts = NotificationMessage(None).extract_message(body).notifications
+        for record, content in zip(result.notifications, dicts):
+            assert isinstance(record, Notification)
+            expected = dict(record._asdict(), id=str(record.id), **(record.reference_data or {}))
+            del expected["reference_data"]
+            self.assertEqual(expected, content)
+
+    def test_records_stream(self):
+        response = file_content("notification_body.xml").encode()
+        notifications = list(NotificationStreamMessage(None, records=True).unpack(response))
+        self.assertEqual(notifications, NotificationMessage(None, records=True).unpack(response).notifications)
+
+
+class TestParseDatetime(TestCase):
+    """Unittests for parse_datetime function."""
+
+    def test_parse(self):
+        self.assertEqual(parse_datetime("2020-04-01T07:01:04"), datetime.datetime(2020, 4, 1, 7, 1, 4))
+        self.assertEqual(parse_datetime("2020-04-01T07:01:04.89"), datetime.datetime(2020, 4, 1, 7, 1, 4, 890000))
+        self.assertEqual(parse_datetime("2020-04-01T07:01:04.1234567"), datetime.datetime(2020, 4, 1, 7, 1, 4, 123456))
+
+
+class TestNotificationStreamMessage(TestCase):
+    """Unittests for NotificationStreamMessage."""
+
+    def _response(self, notifications, footer=""):
+        content = (
+            '<NotifikaceIdpResponse xmlns="urn:nia.notifikaceIdp/response:v1"><Status>OK</Status>'
+            "<SeznamNotifikaceIdp>{}</SeznamNotifikaceIdp>{}</NotifikaceIdpResponse>"
+        )
+        notification = (
+            "<NotifikaceIdp><NotifikaceIdpId>{}</NotifikaceIdpId><Bsi>some_pseudonym</Bsi>"
+            "<DatumACasNotifikace>2017-12-07T14:41:01.787</DatumACasNotifikace><Zdroj>ROBREF</Zdroj>"
+            "<Text>Zmena</Text><ReferencniData><Jmeno>EDA</Jmeno></ReferencniData></NotifikaceIdp>"
+        )
+        body = content.format("".join(notification.format(i) for i in notifications), footer)
+        return BASE_BODY.format(CONTENT=body).encode()
+
+    def test_unpack(self):
+        response = self._response(
+            [132, 135],
+            "<NotifikaceIdpPosledniId>140</NotifikaceIdpPosledniId><ExistujiDalsiNotifikace>true</ExistujiDalsiNotifikace>",
+        )
+        stream = NotificationStreamMessage(None).unpack(response)
+        self.assertIsNone(stream.last_id)
+        notifications = list(stream)
+        self.assertEqual(notifications, NotificationMessage(None).unpack(response).notifications)
+        assert isinstance(notifications[1], dict)
+        self.assertEqual(notifications[1]["id"], "135")
+        self.assertEqual(notifications[1]["given_name"], "EDA")
+        self.assertEqual(stream.last_id, 140)
+        self.assertTrue(stream.more_notifications)
+
+    def test_unpack_no_last_id(self):
+        stream = NotificationStreamMessage(None).unpack(self._response([135, 132]))
+        self.assertEqual(len(list(stream)), 2)
+        self.assertEqual(stream.last_id, 135)
+        self.assertFalse(stream.more_notifications)
+
+    def test_unpack_empty(self):
+        stream = NotificationStreamMessage(None).unpack(self._response([]))
+        self.assertEqual(list(stream), [])
+        self.assertIsNone(stream.last_id)
+
+    def test_unpack_discards_elements(self):
+        message = NotificationStreamMessage(None)
+        sizes: list[int] = []
+        extract_notification = message.extract_notification
+
+        def extract(element):
+            sizes.append(len(list(element.itersiblings(preceding=True))))
+            return extract_notification(element)
+
+        with patch.object(message, "extract_notification", side_effect=extract):
+            self.assertEqual(len(list(message.unpack(self._response(range(10))))), 10)
+        # The processed notifications do not accumulate in the tree
+        self.assertLessEqual(max(sizes), 1)
+
+    def test_unpack_error(self):
+        content = '<NotifikaceIdpResponse xmlns="urn:nia.notifikaceIdp/response:v1"> \
+                   <Status>Error</Status> \
+                   <Detail>General Error. See log for more details</Detail> \
+                   </NotifikaceIdpResponse>'
+        stream = NotificationStreamMessage(None).unpack(BASE_BODY.format(CONTENT=content).encode())
+        with self.assertRaisesRegex(NiaException, "General Error"):
+            list(stream)
+
+    def test_unpack_empty_response(self):
+        stream = NotificationStreamMessage(None).unpack(BASE_BODY.format(CONTENT="").encode())
+        with self.assertRaisesRegex(NiaException, "Empty response"):
+            list(stream)
@@ -3,7 +3,7 @@
 import os
 from unittest import TestCase
 
-from cz_nia.settings import CzNiaAppSettings
+from cz_nia.settings import CzNiaAppSettings, parse_validation_mode
 
 BASENAME = os.path.join(os.path.dirname(__file__), "data")
 
@@ -41,3 +41,58 @@ class TestCzNiaAppSettings(TestCase):
             }
         )
         self.assertEqual(settings.CACHE_PATH, str(os.path.join(BASENAME, "cache")))
+
+    def test_pool_defaults(self):
+        settings = CzNiaAppSettings(
+            {
+                "identity_wsdl": "file://" + os.path.join(BASENAME, "IPSTS_nice.wsdl"),
+                "federation_wsdl": "file://" + os.path.join(BASENAME, "FPSTS_nice.wsdl"),
+                "public_wsdl": "file://" + os.path.join(BASENAME, "Public_nice.wsdl"),
+                "federation_address": "https://tnia.eidentita.cz/FPSTS/issue.svc",
+                "public_address": "https://tnia.eidentita.cz/ws/submission/public.svc/token",
+                "certificate": os.path.join(BASENAME, "NIA.pem"),
+                "key": os.path.join(BASENAME, "NIA.pem"),
+                "password": None,
+            }
+        )
+        self.assertEqual(settings.POOL_CONNECTIONS, 10)
+        self.assertEqual(settings.POOL_MAXSIZE, 10)
+        self.assertTrue(settings.KEEP_ALIVE)
+        self.assertIsNone(settings.TOKEN_STORE_PATH)
+        self.assertIsNone(settings.PSEUDONYM_CACHE_TTL)
+        self.assertEqual(settings.PSEUDONYM_CACHE_SIZE, 1000)
+        self.assertEqual(settings.VALIDATION_MODE, "always")
+        self.assertEqual(settings.VALIDATION_RATE, 1)
+        self.assertFalse(settings.NOTIFICATION_RECORDS)
+        self.assertEqual(settings.VERIFY_RESPONSES, "if-present")
+
+    def test_verify_responses_invalid(self):
+        with self.assertRaisesRegex(ValueError, "Invalid verify_responses policy: 'never'"):
+            CzNiaAppSettings(
+                {
+                    "identity_wsdl": "file://" + os.path.join(BASENAME, "IPSTS_nice.wsdl"),
+                    "federation_wsdl": "file://" + os.path.join(BASENAME, "FPSTS_nice.wsdl"),
+                    "public_wsdl": "file://" + os.path.join(BASENAME, "Public_nice.wsdl"),
+                    "federation_address": "https://tnia.eidentita.cz/FPSTS/issue.svc",
+                    "public_address": "https://tnia.eidentita.cz/ws/submission/public.svc/token",
+                    "certificate": os.path.join(BASENAME, "NIA.pem"),
+                    "key": os.path.join(BASENAME, "NIA.pem"),
+                    "password": None,
+                    "verify_responses": "never",
+                }
+            )
+
+
+class TestParseValidationMode(TestCase):
+    """Unittests for parse_validation_mode function."""
+
+    def test_modes(self):
+        self.assertEqual(parse_validation_mode("always"), 1)
+        self.assertEqual(parse_validation_mode("never"), 0)
+        self.assertEqual(parse_validation_mode("sampled:0.05"), 0.05)
+
+    def test_invalid(self):
+        for mode in ("sometimes", "sampled", "sampled:many", "sampled:1.5", "sampled:-1"):
+            with self.subTest(mode=mode):
+                with self.assertRaisesRegex(ValueError, "Invalid validation mode"):
+                    parse_validation_mode(mode)
@@ -0,0 +1,144 @@
+"""Unittests for standin module."""
+
+import datetime
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from unittest import TestCase
+from urllib.request import urlopen
+
+from cz_nia.client import NiaClient
+from cz_nia.exceptions import NiaException
+from cz_nia.functions import get_pseudonym, get_pseudonyms, write_authenticator
+from cz_nia.settings import CzNiaAppSettings
+from cz_nia.standin import (
+    FEDERATION_PATH,
+    IDENTITY_PATH,
+    PUBLIC_PATH,
+    STANDIN_CERTIFICATE,
+    StandinServer,
+    main,
+)
+
+USER_DATA = {"first_name": "Eda", "last_name": "Tester", "birth_date": datetime.date(2000, 5, 1)}
+PSEUDONYM = "1d71ff1a-d732-4485-a8dc-ad4c42a8a739"
+
+
+class TestStandinServer(TestCase):
+    """Unittests for StandinServer."""
+
+    server: StandinServer
+    settings: CzNiaAppSettings
+
+    @classmethod
+    def setUpClass(cls):
+        # Share the server, so its WSDL files are parsed only once
+        cls.server = StandinServer()
+        cls.server.start()
+        cls.settings = cls.server.get_settings()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.calls.clear()
+        self.server.latency = 0
+        self.server.error_rate = 0
+        self.server.token_lifetime = 3600
+
+    def test_pseudonym(self):
+        self.assertEqual(get_pseudonym(self.settings, USER_DATA), PSEUDONYM)
+        self.assertEqual(self.server.calls, {IDENTITY_PATH: 1, FEDERATION_PATH: 1, PUBLIC_PATH: 1})
+
+    def test_direct(self):
+        settings = self.server.get_settings(submission_direct=True)
+        self.assertEqual(get_pseudonym(settings, USER_DATA), PSEUDONYM)
+
+    def test_batch(self):
+        self.assertEqual(get_pseudonyms(self.settings, [USER_DATA] * 3, batch_size=3), [PSEUDONYM] * 3)
+        self.assertEqual(self.server.calls[PUBLIC_PATH], 1)
+
+    def test_authenticator(self):
+        data = {"pseudonym": PSEUDONYM, "identification": "email@example.cz", "level_of_authentication": "Low"}
+        self.assertIsNone(write_authenticator(self.settings, data))
+
+    def test_token_lifetime(self):
+        client = NiaClient(self.settings)
+        client.get_pseudonym(USER_DATA)
+        client.get_pseudonym(USER_DATA)
+        self.assertEqual(self.server.calls[IDENTITY_PATH], 1)
+
+    def test_token_lifetime_short(self):
+        # Assertions valid for less than the expiry margin are not reused
+        self.server.token_lifetime = 30
+        client = NiaClient(self.settings)
+        client.get_pseudonym(USER_DATA)
+        client.get_pseudonym(USER_DATA)
+        self.assertEqual(self.server.calls[IDENTITY_PATH], 2)
+
+    def test_latency(self):
+        self.server.latency = 0.05
+        start = time.perf_counter()
+        get_pseudonym(self.settings, USER_DATA)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.15)
+
+    def test_error_rate(self):
+        self.server.error_rate = 1
+        with self.assertRaises(NiaException):
+            get_pseudonym(self.settings, USER_DATA)
+        self.assertEqual(self.server.calls, {IDENTITY_PATH: 1})
+
+    def test_documents(self):
+        with urlopen(self.server.url + "/Public_nice.wsdl") as response:
+            content = response.read()
+            # urlopen asks to close the connection
+            self.assertEqual(response.headers["Connection"], "close")
+        self.assertIn(self.server.url.encode(), content)
+        self.assertNotIn(b"tnia.eidentita.cz", content)
+        self.assertIsNone(self.server.get_document("NIA_key.pem"))
+        self.assertIsNone(self.server.get_document("../settings.py"))
+        self.assertIsNone(self.server.get_document("missing.wsdl"))
+
+
+class TestStandinServerTLS(TestCase):
+    """Unittests for StandinServer serving HTTPS."""
+
+    def test_pseudonym(self):
+        with StandinServer(certificate=STANDIN_CERTIFICATE) as server:
+            self.assertTrue(server.url.startswith("https://"))
+            settings = server.get_settings()
+            self.assertEqual(get_pseudonym(settings, USER_DATA, server.get_transport(settings)), PSEUDONYM)
+
+    def test_keep_alive(self):
+        for keep_alive, connections in ((True, 0), (False, 3)):
+            with self.subTest(keep_alive=keep_alive), StandinServer(certificate=STANDIN_CERTIFICATE) as server:
+                settings = server.get_settings(keep_alive=keep_alive)
+                transport = server.get_transport(settings)
+                get_pseudonym(settings, USER_DATA, transport)
+                before = server.connections
+                get_pseudonym(settings, USER_DATA, transport)
+                self.assertEqual(server.connections - before, connections)
+
+
+class TestErrorRate(TestCase):
+    """Unittests for the random errors of StandinServer."""
+
+    def test_seed(self):
+        outcomes = []
+        for _ in range(2):
+            server = StandinServer(error_rate=0.5, seed=42)
+            outcomes.append([server.is_error() for _ in range(20)])
+            server.server_close()
+        self.assertEqual(outcomes[0], outcomes[1])
+        self.assertIn(True, outcomes[0])
+        self.assertIn(False, outcomes[0])
+
+
+class TestMain(TestCase):
+    """Unittests for main function."""
+
+    def test_help(self):
+        with redirect_stdout(StringIO()) as output, self.assertRaises(SystemExit):
+            main(["--help"])
+        self.assertIn("--token-lifetime", output.getvalue())
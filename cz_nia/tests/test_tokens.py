@@ -0,0 +1,319 @@
+"""Unittests for tokens module."""
+
+import asyncio
+import datetime
+import os
+import stat
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from threading import Event
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from lxml.etree import fromstring
+
+from cz_nia.tests.test_client import VALID_TIME
+from cz_nia.tests.test_functions import file_content
+from cz_nia.tokens import (
+    AsyncSingleFlight,
+    SingleFlight,
+    SqliteTokenStore,
+    Token,
+    _parse_timestamp,
+    get_assertion_expiry,
+)
+
+
+class TestParseTimestamp(TestCase):
+    """Unittests for _parse_timestamp function."""
+
+    def test_milliseconds(self):
+        self.assertEqual(
+            _parse_timestamp("2018-10-05T13:30:56.517Z"),
+            datetime.datetime(2018, 10, 5, 13, 30, 56, 517000, tzinfo=datetime.timezone.utc),
+        )
+
+    def test_long_fraction(self):
+        self.assertEqual(
+            _parse_timestamp("2018-10-05T13:30:56.5170001Z"),
+            datetime.datetime(2018, 10, 5, 13, 30, 56, 517000, tzinfo=datetime.timezone.utc),
+        )
+
+    def test_no_fraction(self):
+        self.assertEqual(
+            _parse_timestamp("2018-10-05T13:30:56Z"),
+            datetime.datetime(2018, 10, 5, 13, 30, 56, tzinfo=datetime.timezone.utc),
+        )
+
+
+class TestGetAssertionExpiry(TestCase):
+    """Unittests for get_assertion_expiry function."""
+
+    def test_expiry(self):
+        self.assertEqual(
+            get_assertion_expiry(fromstring(file_content("sub_token.xml"))),
+            datetime.datetime(2018, 10, 5, 14, 12, 21, 169000, tzinfo=datetime.timezone.utc),
+        )
+
+    def test_no_conditions(self):
+        self.assertIsNone(get_assertion_expiry(fromstring("<Assertion/>")))
+
+
+class TestToken(TestCase):
+    """Unittests for Token."""
+
+    def test_is_valid(self):
+        token = Token(None, VALID_TIME + datetime.timedelta(minutes=5))
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertTrue(token.is_valid())
+            self.assertTrue(token.is_valid(60))
+            self.assertFalse(token.is_valid(600))
+
+    def test_expired(self):
+        token = Token(None, VALID_TIME)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertFalse(token.is_valid())
+
+    def test_no_expiry(self):
+        self.assertFalse(Token(None, None).is_valid())
+
+
+class TestSqliteTokenStore(TestCase):
+    """Unittests for SqliteTokenStore."""
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "tokens.sqlite")
+        self.token = Token(fromstring(file_content("sub_token.xml")), VALID_TIME + datetime.timedelta(minutes=30))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_permissions(self):
+        SqliteTokenStore(self.path)
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_get_empty(self):
+        self.assertIsNone(SqliteTokenStore(self.path).get("key"))
+
+    def test_set_get(self):
+        SqliteTokenStore(self.path).set("key", self.token)
+        token = SqliteTokenStore(self.path).get("key")
+        assert token is not None
+        self.assertEqual(token.expires, self.token.expires)
+        self.assertEqual(token.assertion.get("AssertionID"), "_685a595d-fd20-426e-94dd-a9f101a37854")
+        self.assertEqual(get_assertion_expiry(token.assertion), get_assertion_expiry(self.token.assertion))
+
+    def test_no_expiry(self):
+        store = SqliteTokenStore(self.path)
+        store.set("key", Token(self.token.assertion, None))
+        token = store.get("key")
+        assert token is not None
+        self.assertIsNone(token.expires)
+
+    def test_get_or_request(self):
+        store = SqliteTokenStore(self.path)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertIs(store.get_or_request("key", 60, lambda: self.token), self.token)
+            token = store.get_or_request("key", 60, lambda: self.fail("Token should be stored"))
+        self.assertEqual(token.expires, self.token.expires)
+
+    def test_get_or_request_expired(self):
+        store = SqliteTokenStore(self.path)
+        store.set("key", self.token)
+        new_token = Token(self.token.assertion, VALID_TIME + datetime.timedelta(hours=1))
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertIs(store.get_or_request("key", 3600, lambda: new_token), new_token)
+        token = store.get("key")
+        assert token is not None
+        self.assertEqual(token.expires, new_token.expires)
+
+    def test_get_or_request_error(self):
+        store = SqliteTokenStore(self.path)
+
+        def request():
+            raise ValueError("Failed")
+
+        with self.assertRaises(ValueError):
+            store.get_or_request("key", 60, request)
+        self.assertIsNone(store.get("key"))
+        # The lease is released, the next call requests the token without waiting
+        store.timeout = 5
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertIs(store.get_or_request("key", 60, lambda: self.token), self.token)
+
+    def test_single_request(self):
+        calls: list[None] = []
+
+        def request():
+            calls.append(None)
+            time.sleep(0.1)
+            return self.token
+
+        SqliteTokenStore(self.path)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME), ThreadPoolExecutor(max_workers=4) as executor:
+            # Each store has its own connections, as it would in separate processes
+            tokens = list(
+                executor.map(lambda _: SqliteTokenStore(self.path).get_or_request("key", 60, request), range(4))
+            )
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(token.expires == self.token.expires for token in tokens))
+
+    def test_unlocked_request(self):
+        def request():
+            # Other processes can write to the store while the token is being requested
+            SqliteTokenStore(self.path, timeout=0).set("other", self.token)
+            return self.token
+
+        store = SqliteTokenStore(self.path)
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertIs(store.get_or_request("key", 60, request), self.token)
+        self.assertIsNotNone(store.get("other"))
+
+    def test_expired_lease(self):
+        store = SqliteTokenStore(self.path, timeout=0.2)
+        # Lease of a process which did not finish its request
+        self.assertEqual(store._claim("key", 60), (None, True))
+        with patch("cz_nia.tokens._now", return_value=VALID_TIME):
+            self.assertIs(store.get_or_request("key", 60, lambda: self.token), self.token)
+
+
+class TestSingleFlight(TestCase):
+    """Unittests for SingleFlight."""
+
+    def _run_concurrently(self, function, count=4):
+        """Call the function from several threads while the first call is in progress."""
+        flight: SingleFlight[int] = SingleFlight()
+        started = Event()
+        release = Event()
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return function()
+
+        def call(index):
+            try:
+                return flight.do(leader if index == 0 else function)
+            except ValueError as err:
+                return err
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            first = executor.submit(call, 0)
+            started.wait(5)
+            others = [executor.submit(call, index) for index in range(1, count)]
+            # Give the other threads time to join the call in progress
+            time.sleep(0.1)
+            release.set()
+            return [first.result()] + [future.result() for future in others]
+
+    def test_single_call(self):
+        calls: list[None] = []
+
+        def function():
+            calls.append(None)
+            return 42
+
+        self.assertEqual(self._run_concurrently(function), [42] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_error(self):
+        calls: list[None] = []
+
+        def function():
+            calls.append(None)
+            raise ValueError("Failed")
+
+        results = self._run_concurrently(function)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_sequential(self):
+        flight: SingleFlight[int] = SingleFlight()
+        self.assertEqual(flight.do(lambda: 1), 1)
+        self.assertEqual(flight.do(lambda: 2), 2)
+
+
+class TestAsyncSingleFlight(IsolatedAsyncioTestCase):
+    """Unittests for AsyncSingleFlight."""
+
+    async def test_single_call(self):
+        flight: AsyncSingleFlight[int] = AsyncSingleFlight()
+        calls: list[None] = []
+
+        async def function():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return 42
+
+        self.assertEqual(await asyncio.gather(*(flight.do(function) for _ in range(4))), [42] * 4)
+        self.assertEqual(len(calls), 1)
+        # Next call runs the function again
+        self.assertEqual(await flight.do(function), 42)
+        self.assertEqual(len(calls), 2)
+
+    async def test_error(self):
+        flight: AsyncSingleFlight[int] = AsyncSingleFlight()
+        calls: list[None] = []
+
+        async def function():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            raise ValueError("Failed")
+
+        results = await asyncio.gather(*(flight.do(function) for _ in range(4)), return_exceptions=True)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_cancelled_waiter(self):
+        flight: AsyncSingleFlight[int] = AsyncSingleFlight()
+
+        async def function():
+            await asyncio.sleep(0.01)
+            return 42
+
+        leader = asyncio.ensure_future(flight.do(function))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do(function))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        self.assertEqual(await leader, 42)
+        with self.assertRaises(asyncio.CancelledError):
+            await waiter
+
+    async def test_cancelled_leader(self):
+        flight: AsyncSingleFlight[int] = AsyncSingleFlight()
+        calls: list[None] = []
+
+        async def function():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return 42
+
+        leader = asyncio.ensure_future(flight.do(function))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(flight.do(function)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        self.assertEqual(await asyncio.gather(*waiters), [42] * 3)
+        self.assertEqual(len(calls), 1)
+        with self.assertRaises(asyncio.CancelledError):
+            await leader
+
+    async def test_cancelled_all(self):
+        flight: AsyncSingleFlight[int] = AsyncSingleFlight()
+        finished = asyncio.Event()
+
+        async def function():
+            await asyncio.sleep(0.01)
+            finished.set()
+            raise ValueError("Failed")
+
+        leader = asyncio.ensure_future(flight.do(function))
+        await asyncio.sleep(0)
+        leader.cancel()
+        # The call is finished even without any callers and its failure is not reported as unretrieved
+        await asyncio.wait_for(finished.wait(), 1)
+        await asyncio.sleep(0)
+        self.assertIsNone(flight._task)
@@ -1,17 +1,28 @@
 """Unittests for wsse.signature module."""
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase
+from unittest.mock import Mock, patch
 
-from lxml.etree import QName
+import xmlsec
+from lxml.etree import QName, tostring
 from zeep import ns
 from zeep.exceptions import SignatureVerificationFailed
 from zeep.wsdl.utils import get_or_create_header
-from zeep.wsse.signature import OMITTED_HEADERS, _make_sign_key
+from zeep.wsse.signature import OMITTED_HEADERS, _make_sign_key, _make_verify_key, _sign_node
+from zeep.wsse.utils import get_security_header
 
 from cz_nia.tests.utils import load_xml
 from cz_nia.wsse import BinarySignature, MemorySignature, SAMLTokenSignature, Signature
-from cz_nia.wsse.signature import _signature_prepare
+from cz_nia.wsse.signature import (
+    _KEYS,
+    _TEMPLATES,
+    _build_signature_template,
+    _KeyCache,
+    _make_hmac_key,
+    _signature_prepare,
+)
 
 CERT_FILE = os.path.join(os.path.dirname(__file__), "certificate.pem")
 KEY_FILE = os.path.join(os.path.dirname(__file__), "key.pem")
@@ -124,6 +135,126 @@ class TestSignaturePrepare(TestCase):
         self.assertIn("#" + header.find(QName("http://tests.python-zeep.org/", "Item")).attrib[ID], refs)
 
 
+class TestKeyCache(TestCase):
+    """Unittests for _KeyCache."""
+
+    def test_get(self):
+        cache = _KeyCache()
+        key = cache.get(Mock, b"data", None)
+        self.assertIs(cache.get(Mock, b"data", None), key)
+        self.assertIs(cache.get(Mock, "data", b""), key)
+        self.assertIsNot(cache.get(Mock, b"other", None), key)
+        # Parts are not simply concatenated
+        self.assertIsNot(cache.get(Mock, b"da", b"ta"), cache.get(Mock, b"dat", b"a"))
+
+    def test_maxsize(self):
+        cache = _KeyCache(maxsize=2)
+        first = cache.get(Mock, b"first")
+        cache.get(Mock, b"second")
+        # Use the first, so the second is the least recently used
+        cache.get(Mock, b"first")
+        cache.get(Mock, b"third")
+        self.assertIs(cache.get(Mock, b"first"), first)
+        self.assertEqual(len(cache._keys), 2)
+
+
+class TestKeysReuse(TestCase):
+    """Unittests for reuse of the loaded keys by the signatures."""
+
+    def setUp(self):
+        _KEYS.clear()
+
+    def test_sign_key(self):
+        with patch("cz_nia.wsse.signature._make_sign_key", wraps=_make_sign_key) as make_mock:
+            for _ in range(2):
+                plugin = BinarySignature(KEY_FILE, CERT_FILE)
+                plugin.verify(plugin.apply(load_xml(ENVELOPE), {})[0])
+        self.assertEqual(make_mock.call_count, 1)
+
+    def test_verify_key(self):
+        with patch("cz_nia.wsse.signature._make_verify_key", wraps=_make_verify_key) as make_mock:
+            for _ in range(2):
+                plugin = Signature(KEY_FILE, CERT_FILE)
+                plugin.verify(plugin.apply(load_xml(ENVELOPE), {})[0])
+        self.assertEqual(make_mock.call_count, 1)
+
+    def test_hmac_key(self):
+        with open(os.path.join(os.path.dirname(__file__), "assertion.xml")) as f:
+            assertion = load_xml(f.read())
+        with patch("cz_nia.wsse.signature._make_hmac_key", wraps=_make_hmac_key) as make_mock:
+            for _ in range(2):
+                plugin = SAMLTokenSignature(assertion)
+                plugin.verify(plugin.apply(load_xml(ENVELOPE), {})[0])
+        self.assertEqual(make_mock.call_count, 1)
+
+    def test_threads(self):
+        def sign(_):
+            plugin = BinarySignature(KEY_FILE, CERT_FILE)
+            return plugin.verify(plugin.apply(load_xml(ENVELOPE), {})[0])
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertEqual(len(list(executor.map(sign, range(20)))), 20)
+
+
+class TestSignatureTemplate(TestCase):
+    """Unittests for the prebuilt Signature templates."""
+
+    def setUp(self):
+        _TEMPLATES.clear()
+        with open(KEY_FILE, "rb") as key, open(CERT_FILE, "rb") as cert:
+            self.key = _make_sign_key(key.read(), cert.read(), None)
+
+    def _get_signature(self, envelope, signatures=None):
+        security, _, _ = _signature_prepare(envelope, self.key, None, None, signatures=signatures)
+        return security.find(QName(ns.DS, "Signature"))
+
+    def test_template_reused(self):
+        signatures = {"body": True, "everything": False, "header": []}
+        with patch("cz_nia.wsse.signature._build_signature_template", wraps=_build_signature_template) as build_mock:
+            first = self._get_signature(load_xml(ENVELOPE), signatures)
+            second = self._get_signature(load_xml(ENVELOPE), signatures)
+            self._get_signature(load_xml(ENVELOPE))
+        # One template with timestamp and body, one with timestamp only
+        self.assertEqual(build_mock.call_count, 2)
+        refs = "ds:SignedInfo/ds:Reference/@URI"
+        self.assertNotEqual(first.xpath(refs, namespaces={"ds": ns.DS}), second.xpath(refs, namespaces={"ds": ns.DS}))
+
+    def test_template_unchanged(self):
+        self._get_signature(load_xml(ENVELOPE))
+        template = _TEMPLATES[(None, None, 1)]
+        self.assertEqual(template.xpath("ds:SignedInfo/ds:Reference/@URI", namespaces={"ds": ns.DS}), ["#"])
+        self.assertIsNone(template.find(".//" + QName(ns.DS, "DigestValue").text).text)
+        self.assertIsNone(template.find(QName(ns.DS, "SignatureValue")).text)
+
+    def test_same_as_built(self):
+        envelope = load_xml(ENVELOPE)
+        signature = self._get_signature(envelope, {"body": True, "everything": False, "header": []})
+        # Build the template the way zeep does it
+        expected = xmlsec.template.create(envelope, xmlsec.Transform.EXCL_C14N, xmlsec.Transform.RSA_SHA1)  # type: ignore[attr-defined]
+        key_info = xmlsec.template.ensure_key_info(expected)
+        x509_data = xmlsec.template.add_x509_data(key_info)
+        xmlsec.template.x509_data_add_issuer_serial(x509_data)
+        xmlsec.template.x509_data_add_certificate(x509_data)
+        ctx = xmlsec.SignatureContext()
+        _sign_node(
+            ctx, expected, envelope.find(QName(ns.SOAP_ENV_11, "Header")).find(".//" + QName(ns.WSU, "Timestamp").text)
+        )
+        _sign_node(ctx, expected, envelope.find(QName(ns.SOAP_ENV_11, "Body")))
+        signed_info = signature.find(QName(ns.DS, "SignedInfo"))
+        for reference in signed_info.iterchildren(QName(ns.DS, "Reference")):
+            reference.find(QName(ns.DS, "DigestValue")).text = None
+        self.assertEqual(
+            tostring(signed_info, method="c14n", exclusive=True),
+            tostring(expected.find(QName(ns.DS, "SignedInfo")), method="c14n", exclusive=True).replace(b"\n", b""),
+        )
+
+    def test_verify(self):
+        plugin = Signature(KEY_FILE, CERT_FILE)
+        for _ in range(2):
+            envelope, _ = plugin.apply(load_xml(HEADER_ENVELOPE), {}, {"body": True, "everything": True, "header": []})
+            plugin.verify(envelope)
+
+
 class TestBinarySignature(TestCase):
     """Unittests for BinarySignature."""
 
@@ -201,6 +332,52 @@ class TestMemorySignature(TestCase):
         )
 
 
+class TestVerifyResponses(TestCase):
+    """Unittests for the `verify_responses` policy."""
+
+    def test_strict(self):
+        plugin = Signature(KEY_FILE, CERT_FILE, verify_responses="strict")
+        plugin.verify(plugin.apply(load_xml(ENVELOPE), {})[0])
+        # Security header without signature
+        envelope = load_xml(ENVELOPE)
+        get_security_header(envelope)
+        with self.assertRaises(SignatureVerificationFailed):
+            plugin.verify(envelope)
+
+    def test_if_present(self):
+        plugin = Signature(KEY_FILE, CERT_FILE)
+        envelope = load_xml(ENVELOPE)
+        get_security_header(envelope)
+        self.assertIs(plugin.verify(envelope), envelope)
+
+    def test_off(self):
+        plugin = BinarySignature(KEY_FILE, CERT_FILE, verify_responses="off")
+        with patch("cz_nia.wsse.signature._verify_envelope_with_key") as verify_mock:
+            envelope = load_xml(ENVELOPE)
+            self.assertIs(plugin.verify(envelope), envelope)
+        verify_mock.assert_not_called()
+
+    def test_off_saml(self):
+        with open(os.path.join(os.path.dirname(__file__), "assertion.xml")) as f:
+            plugin = SAMLTokenSignature(load_xml(f.read()), verify_responses="off")
+        envelope = load_xml(ENVELOPE)
+        self.assertIs(plugin.verify(envelope), envelope)
+
+    def test_tampered(self):
+        plugin = Signature(KEY_FILE, CERT_FILE, verify_responses="strict")
+        envelope, _ = plugin.apply(load_xml(ENVELOPE), {}, {"body": True, "everything": False, "header": []})
+        envelope.find(".//{http://tests.python-zeep.org/}Argument").text = "KO"
+        with self.assertRaises(SignatureVerificationFailed):
+            plugin.verify(envelope)
+
+    def test_missing_reference(self):
+        plugin = Signature(KEY_FILE, CERT_FILE)
+        envelope, _ = plugin.apply(load_xml(ENVELOPE), {}, {"body": True, "everything": False, "header": []})
+        del envelope.find(QName(ns.SOAP_ENV_11, "Body")).attrib[QName(ns.WSU, "Id")]
+        with self.assertRaises(SignatureVerificationFailed):
+            plugin.verify(envelope)
+
+
 class TestSignature(TestCase):
     """Unittests for Signature."""
 
@@ -221,3 +398,11 @@ class TestSAMLTokenSignature(TestCase):
         plugin = SAMLTokenSignature(self.assertion)
         envelope, headers = plugin.apply(load_xml(ENVELOPE), {})
         plugin.verify(envelope)
+
+    def test_signature_saml_reuse(self):
+        plugin = SAMLTokenSignature(self.assertion)
+        first, _ = plugin.apply(load_xml(ENVELOPE), {})
+        second, _ = plugin.apply(load_xml(ENVELOPE), {})
+        self.assertIsNone(self.assertion.getparent())
+        plugin.verify(first)
+        plugin.verify(second)
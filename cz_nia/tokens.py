@@ -0,0 +1,251 @@
+"""Assertions issued by the NIA security token services."""
+
+import asyncio
+import os
+import sqlite3
+from collections.abc import Awaitable, Callable
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from time import monotonic, sleep, time
+from typing import Generic, NamedTuple, Optional, TypeVar
+
+from lxml.etree import Element, QName, fromstring, tostring
+
+from cz_nia.functions import ASSERTION
+from cz_nia.message import parse_datetime
+
+T = TypeVar("T")
+
+
+def _now() -> datetime:
+    """Return current time in UTC."""
+    return datetime.now(timezone.utc)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """Parse the xsd:dateTime in UTC as returned by NIA."""
+    return parse_datetime(value.rstrip("Z")).replace(tzinfo=timezone.utc)
+
+
+def get_assertion_expiry(assertion: Element) -> Optional[datetime]:
+    """Return the expiry time of the assertion from its `Conditions/NotOnOrAfter` attribute."""
+    conditions = assertion.find(QName(ASSERTION, "Conditions"))
+    if conditions is None or conditions.get("NotOnOrAfter") is None:
+        return None
+    return _parse_timestamp(conditions.get("NotOnOrAfter"))
+
+
+class Token(NamedTuple):
+    """Assertion together with its expiry time."""
+
+    assertion: Element
+    expires: Optional[datetime]
+
+    def remaining(self) -> Optional[float]:
+        """Return the number of seconds until the token expires or `None` if the expiry is unknown."""
+        if self.expires is None:
+            return None
+        return (self.expires - _now()).total_seconds()
+
+    def is_valid(self, margin: float = 0) -> bool:
+        """Return whether the token can still be used for at least `margin` seconds."""
+        if self.expires is None:
+            return False
+        return _now() + timedelta(seconds=margin) < self.expires
+
+
+class SqliteTokenStore:
+    """Store of tokens shared by processes on a single node.
+
+    Only one process requests a new token at a time, the others wait for it and use the stored token.
+    The request is claimed by a lease in the database, so no lock is held while the token is being requested.
+    Tokens contain the proof keys, so the database file is created accessible only by its owner.
+    """
+
+    # Seconds between the checks of the token requested by another process
+    poll_interval = 0.05
+
+    def __init__(self, path: str, timeout: float = 60):
+        """Create the database if necessary.
+
+        The `timeout` is the number of seconds to wait for another process requesting the token,
+        the process requests the token itself afterwards.
+        """
+        self.path = path
+        self.timeout = timeout
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY, 0o600))
+        connection = self._connect()
+        try:
+            # Write-ahead log lets the processes read tokens while another one is storing a new one
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, assertion BLOB NOT NULL, expires TEXT)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, expires REAL NOT NULL)")
+        finally:
+            connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return a new connection to the database with manual transaction control."""
+        return sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+    @staticmethod
+    def _select(connection: sqlite3.Connection, key: str) -> Optional[Token]:
+        """Return the stored token."""
+        row = connection.execute("SELECT assertion, expires FROM tokens WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        assertion, expires = row
+        return Token(fromstring(assertion), datetime.fromisoformat(expires) if expires else None)
+
+    @staticmethod
+    def _insert(connection: sqlite3.Connection, key: str, token: Token) -> None:
+        """Store the token."""
+        connection.execute(
+            "INSERT OR REPLACE INTO tokens (key, assertion, expires) VALUES (?, ?, ?)",
+            (key, tostring(token.assertion), token.expires.isoformat() if token.expires else None),
+        )
+
+    def get(self, key: str) -> Optional[Token]:
+        """Return the stored token."""
+        connection = self._connect()
+        try:
+            return self._select(connection, key)
+        finally:
+            connection.close()
+
+    def set(self, key: str, token: Token) -> None:
+        """Store the token and release the lease of its request."""
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            self._insert(connection, key, token)
+            connection.execute("DELETE FROM leases WHERE key = ?", (key,))
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def _claim(self, key: str, margin: float) -> tuple[Optional[Token], bool]:
+        """Return the stored token valid for at least `margin` seconds or try to claim the request of a new one.
+
+        Returns the valid token, if any, and whether the request was claimed.
+        The request is not claimed while another process holds an unexpired lease.
+        """
+        connection = self._connect()
+        try:
+            # The write lock is held only for the checks, another process may have stored the token meanwhile
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                token = self._select(connection, key)
+                if token is not None and token.is_valid(margin):
+                    return token, False
+                row = connection.execute("SELECT expires FROM leases WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] > time():
+                    return None, False
+                connection.execute(
+                    "INSERT OR REPLACE INTO leases (key, expires) VALUES (?, ?)", (key, time() + self.timeout)
+                )
+                return None, True
+            finally:
+                connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+    def _release(self, key: str) -> None:
+        """Release the lease of the request."""
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM leases WHERE key = ?", (key,))
+        finally:
+            connection.close()
+
+    def get_or_request(self, key: str, margin: float, request: Callable[[], Token]) -> Token:
+        """Return the stored token valid for at least `margin` seconds or store and return a new one from `request`.
+
+        Processes calling this at the same time wait for the first one to request the token,
+        but at most `timeout` seconds.
+        """
+        token = self.get(key)
+        if token is not None and token.is_valid(margin):
+            return token
+        deadline = monotonic() + self.timeout
+        while True:
+            token, claimed = self._claim(key, margin)
+            if token is not None:
+                return token
+            if claimed or monotonic() >= deadline:
+                break
+            sleep(self.poll_interval)
+        try:
+            token = request()
+        except BaseException:
+            if claimed:
+                self._release(key)
+            raise
+        self.set(key, token)
+        return token
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls, so only one runs at a time.
+
+    Threads calling `do` while another call is in progress wait for it and get its result or exception.
+    """
+
+    def __init__(self):
+        """Prepare the state."""
+        self._lock = Lock()
+        self._future: Optional[Future] = None
+
+    def do(self, function: Callable[[], T]) -> T:
+        """Call the function unless another call is in progress and return its result."""
+        with self._lock:
+            future = self._future
+            leader = future is None
+            if future is None:
+                future = self._future = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._future = None
+
+
+class AsyncSingleFlight(Generic[T]):
+    """Coalesce concurrent calls, so only one runs at a time.
+
+    Counterpart of `SingleFlight` for coroutines within a single event loop.
+    """
+
+    def __init__(self):
+        """Prepare the state."""
+        self._task: Optional[asyncio.Future] = None
+
+    async def do(self, function: Callable[[], Awaitable[T]]) -> T:
+        """Await the function unless another call is in progress and return its result.
+
+        The function runs in its own task, so a cancelled caller, including the one which started it,
+        does not cancel the others.
+        """
+        task = self._task
+        if task is None or task.done():
+            task = self._task = asyncio.ensure_future(function())
+            task.add_done_callback(self._done)
+        return await asyncio.shield(task)
+
+    def _done(self, task: asyncio.Future) -> None:
+        """Clear the finished task."""
+        if self._task is task:
+            self._task = None
+        if not task.cancelled():
+            # Mark the exception as retrieved, there may be no callers left
+            task.exception()
@@ -2,6 +2,12 @@
 
 import datetime
 from base64 import b64decode
+from collections import OrderedDict
+from collections.abc import Callable
+from copy import deepcopy
+from hashlib import sha256
+from threading import Lock
+from typing import Any, Optional
 
 import xmlsec
 from lxml.etree import Element, ETXPath, QName, SubElement
@@ -14,21 +20,88 @@ from zeep.wsse.signature import (
     Signature as ZeepSignature,
     _make_sign_key,
     _make_verify_key,
-    _sign_node,
-    _verify_envelope_with_key as zeep_verify_envelope,
 )
 from zeep.wsse.utils import ensure_id, get_or_create_header, get_security_header, get_timestamp
 
+from cz_nia.instrumentation import SIGNING, VERIFICATION, Observer, phase
 
-def _signature_prepare(envelope, key, signature_method, digest_method, signatures=None):
-    """Prepare all the data for signature.
 
-    Mostly copied from zeep.wsse.signature.
+class _KeyCache:
+    """Thread-safe cache of the loaded xmlsec keys by the digest of the data they are loaded from.
+
+    Keys are only read once loaded, xmlsec duplicates the key for each signature context,
+    so the cached keys can be used from multiple threads.
     """
-    soap_env = detect_soap_env(envelope)
-    # Create the Signature node.
+
+    def __init__(self, maxsize: int = 32):
+        """Set up the cache, the least recently used keys are dropped if there are more than `maxsize`."""
+        self.maxsize = maxsize
+        self._keys: OrderedDict[bytes, xmlsec.Key] = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def _digest(*parts) -> bytes:
+        """Return the digest of the parts."""
+        digest = sha256()
+        for part in parts:
+            if part is None:
+                part = b""
+            elif isinstance(part, str):
+                part = part.encode()
+            # Length prefix keeps the parts separate
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.digest()
+
+    def get(self, factory: Callable[[], xmlsec.Key], *parts) -> xmlsec.Key:
+        """Return the key loaded by the `factory` from the data in `parts`."""
+        digest = self._digest(*parts)
+        with self._lock:
+            key = self._keys.get(digest)
+            if key is not None:
+                self._keys.move_to_end(digest)
+                return key
+        key = factory()
+        with self._lock:
+            self._keys[digest] = key
+            while len(self._keys) > self.maxsize:
+                self._keys.popitem(last=False)
+        return key
+
+    def clear(self) -> None:
+        """Drop all the keys."""
+        with self._lock:
+            self._keys.clear()
+
+
+_KEYS = _KeyCache()
+
+
+def _get_sign_key(key_data, cert_data, password) -> xmlsec.Key:
+    """Return the signing key, loaded only once for the same data."""
+    return _KEYS.get(lambda: _make_sign_key(key_data, cert_data, password), "sign", key_data, cert_data, password)
+
+
+def _get_verify_key(cert_data) -> xmlsec.Key:
+    """Return the verification key, loaded only once for the same certificate."""
+    return _KEYS.get(lambda: _make_verify_key(cert_data), "verify", cert_data)
+
+
+def _make_hmac_key(key_data: bytes) -> xmlsec.Key:
+    """Load the HMAC key."""
+    return xmlsec.Key.from_binary_data(xmlsec.KeyData.HMAC, key_data)  # type: ignore
+
+
+def _get_hmac_key(key_data: bytes) -> xmlsec.Key:
+    """Return the HMAC key, loaded only once for the same secret."""
+    return _KEYS.get(lambda: _make_hmac_key(key_data), "hmac", key_data)
+
+
+def _build_signature_template(signature_method, digest_method, references: int):
+    """Return a new Signature template with `references` empty references."""
+    # The node only provides the document for the template.
     signature = xmlsec.template.create(
-        envelope,
+        Element(QName(ns.DS, "Template")),
         xmlsec.Transform.EXCL_C14N,  # type: ignore[attr-defined]
         signature_method or xmlsec.Transform.RSA_SHA1,  # type: ignore[attr-defined]
     )  # type: ignore
@@ -40,9 +113,64 @@ def _signature_prepare(envelope, key, signature_method, digest_method, signature
     xmlsec.template.x509_data_add_issuer_serial(x509_data)  # type: ignore[attr-defined]
     xmlsec.template.x509_data_add_certificate(x509_data)  # type: ignore[attr-defined]
 
-    # Insert the Signature node in the wsse:Security header.
+    # Add the references, the URIs are filled in for each message by `_sign_nodes`.
+    for _ in range(references):
+        ref = xmlsec.template.add_reference(  # type: ignore[attr-defined]
+            signature,
+            digest_method or xmlsec.Transform.SHA1,  # type: ignore[attr-defined]
+            uri="#",
+        )
+        xmlsec.template.add_transform(ref, xmlsec.Transform.EXCL_C14N)  # type: ignore[attr-defined]
+
+    # Remove newlines from signature...
+    for element in signature.iter():
+        if element.text is not None and "\n" in element.text:
+            element.text = element.text.replace("\n", "")
+        if element.tail is not None and "\n" in element.tail:
+            element.tail = element.tail.replace("\n", "")
+    return signature
+
+
+_TEMPLATES: dict[tuple, Any] = {}
+_TEMPLATES_LOCK = Lock()
+
+
+def _get_signature_template(signature_method, digest_method, references: int):
+    """Return a copy of the Signature template.
+
+    Templates are built only once for each combination of the arguments and copied for each message.
+    """
+    template_key = (signature_method, digest_method, references)
+    template = _TEMPLATES.get(template_key)
+    if template is None:
+        with _TEMPLATES_LOCK:
+            template = _TEMPLATES.get(template_key)
+            if template is None:
+                template = _TEMPLATES[template_key] = _build_signature_template(
+                    signature_method, digest_method, references
+                )
+    return deepcopy(template)
+
+
+def _sign_nodes(ctx, signature, targets) -> None:
+    """Point the references of the `signature` template to the `targets`.
+
+    Equivalent to `zeep.wsse.signature._sign_node` for each target, except the references already exist.
+    """
+    references = signature.find(QName(ns.DS, "SignedInfo")).iterchildren(QName(ns.DS, "Reference"))
+    for target, reference in zip(targets, references):
+        # Ensure the target node has a wsu:Id attribute and register it, so XMLSec can find it.
+        reference.set("URI", "#" + ensure_id(target))
+        ctx.register_id(target, "Id", ns.WSU)
+
+
+def _signature_prepare(envelope, key, signature_method, digest_method, signatures=None):
+    """Prepare all the data for signature.
+
+    Mostly copied from zeep.wsse.signature, except the Signature node is a copy of the prebuilt template.
+    """
+    soap_env = detect_soap_env(envelope)
     security = get_security_header(envelope)
-    security.insert(0, signature)
 
     # Prepare Timestamp
     timestamp = Element(QName(ns.WSU, "Timestamp"))
@@ -54,39 +182,38 @@ def _signature_prepare(envelope, key, signature_method, digest_method, signature
     timestamp.append(expires)
     security.insert(0, timestamp)
 
-    # Perform the actual signing.
-    ctx = xmlsec.SignatureContext()
-    ctx.key = key
     # Sign default elements
-    _sign_node(ctx, signature, security.find(QName(ns.WSU, "Timestamp")), digest_method)
-
+    targets = [timestamp]
     # Sign elements defined in WSDL
     if signatures is not None:
         if signatures["body"] or signatures["everything"]:
-            _sign_node(ctx, signature, envelope.find(QName(soap_env, "Body")), digest_method)
+            targets.append(envelope.find(QName(soap_env, "Body")))
         header = get_or_create_header(envelope)
         if signatures["everything"]:
             for node in header.iterchildren():
                 # Everything doesn't mean everything ...
                 if node.nsmap.get(node.prefix) not in OMITTED_HEADERS:
-                    _sign_node(ctx, signature, node, digest_method)
+                    targets.append(node)
         else:
             for node in signatures["header"]:
-                _sign_node(ctx, signature, header.find(QName(node["Namespace"], node["Name"])), digest_method)
+                targets.append(header.find(QName(node["Namespace"], node["Name"])))
 
-    # Remove newlines from signature...
-    for element in signature.iter():
-        if element.text is not None and "\n" in element.text:
-            element.text = element.text.replace("\n", "")
-        if element.tail is not None and "\n" in element.tail:
-            element.tail = element.tail.replace("\n", "")
+    # Insert the Signature node in the wsse:Security header.
+    signature = _get_signature_template(signature_method, digest_method, len(targets))
+    security.insert(1, signature)
 
+    # Perform the actual signing.
+    ctx = xmlsec.SignatureContext()
+    ctx.key = key
+    _sign_nodes(ctx, signature, targets)
     ctx.sign(signature)
 
     # Place the X509 data inside a WSSE SecurityTokenReference within
     # KeyInfo. The recipient expects this structure, but we can't rearrange
     # like this until after signing, because otherwise xmlsec won't populate
     # the X509 data (because it doesn't understand WSSE).
+    key_info = signature.find(QName(ns.DS, "KeyInfo"))
+    x509_data = key_info.find(QName(ns.DS, "X509Data"))
     sec_token_ref = SubElement(key_info, QName(ns.WSSE, "SecurityTokenReference"))
     return security, sec_token_ref, x509_data
 
@@ -136,14 +263,22 @@ def _sign_envelope_with_saml(envelope, key, signature_method, digest_method, ass
         {"ValueType": "http://docs.oasis-open.org/wss/oasis-wss-saml-token-profile-1.0#SAMLAssertionID"},
     )
     key_iden_ref.text = assertion_id
-    security.insert(1, assertion)
+    # Insert a copy, so the assertion can be reused for other (possibly concurrent) requests
+    security.insert(1, deepcopy(assertion))
     x509_data.getparent().remove(x509_data)
 
 
-def _verify_envelope_with_key(envelope, key):
+# Precompiled paths used to verify the responses
+_FIND_REFERENCE_URIS = ETXPath("{{{ds}}}SignedInfo/{{{ds}}}Reference/@URI".format(ds=ns.DS))
+_FIND_IDENTIFIED = ETXPath("//*[@{{{wsu}}}Id]".format(wsu=ns.WSU))
+_ID = QName(ns.WSU, "Id").text
+
+
+def _verify_envelope_with_key(envelope, key, policy: str = "if-present"):
     """Verify WS-Security signature on given SOAP envelope with given cert.
 
-    Copy from zeep.wsse.signature except it does bail out if no signature is found.
+    Based on zeep.wsse.signature, except the missing signature is accepted unless the `policy` is `strict`
+    and the referenced nodes are found in a single pass over the envelope.
     """
     soap_env = detect_soap_env(envelope)
 
@@ -157,52 +292,80 @@ def _verify_envelope_with_key(envelope, key):
 
     signature = security.find(QName(ns.DS, "Signature"))
 
-    # Skip signature validation if not present, otherwise call the library function
+    # Skip signature validation if not present and not required
     if signature is None:
+        if policy == "strict":
+            raise SignatureVerificationFailed
         return
-    else:
-        zeep_verify_envelope(envelope, key)
 
+    ctx = xmlsec.SignatureContext()
+    # Find each signed element and register its ID with the signing context, the first element with the ID is used.
+    identified: dict[str, Any] = {}
+    for node in _FIND_IDENTIFIED(envelope):
+        identified.setdefault(node.get(_ID), node)
+    for uri in _FIND_REFERENCE_URIS(signature):
+        referenced = identified.get(uri[1:])
+        if referenced is None:
+            raise SignatureVerificationFailed
+        ctx.register_id(referenced, "Id", ns.WSU)
 
-class MemorySignature(ZeepMemorySignature):
-    """Overriden to use the changed `_sing_envelope_with_key`."""
+    ctx.key = key
+    try:
+        ctx.verify(signature)
+    except xmlsec.Error as error:
+        # xmlsec gives no details about the reason for the failure.
+        raise SignatureVerificationFailed from error
 
-    def apply(self, envelope, headers, signatures=None):
-        """Plugin entry point."""
-        key = _make_sign_key(self.key_data, self.cert_data, self.password)
-        _sign_envelope_with_key(envelope, key, self.signature_method, self.digest_method, signatures=signatures)
-        return envelope, headers
+
+class _PluginOptions:
+    """Options of the signature plugins and the verification of the responses.
+
+    The `verify_responses` policy is `strict` (signature is required), `if-present` (missing signature is accepted)
+    or `off`. Signing and verification are reported to the `observer` if provided.
+    """
+
+    cert_data: bytes
+
+    def __init__(self, *args, verify_responses: str = "if-present", observer: Optional[Observer] = None, **kwargs):
+        """Store the options, pass the remaining arguments to the signature."""
+        super().__init__(*args, **kwargs)
+        self.verify_responses = verify_responses
+        self.observer = observer
 
     def verify(self, envelope):
         """Plugin exit point.
 
         Overriden to call overloaded function.
         """
-        key = _make_verify_key(self.cert_data)
-        _verify_envelope_with_key(envelope, key)
+        if self.verify_responses != "off":
+            with phase(self.observer, VERIFICATION):
+                _verify_envelope_with_key(envelope, _get_verify_key(self.cert_data), self.verify_responses)
         return envelope
 
 
-class Signature(ZeepSignature):
+class MemorySignature(_PluginOptions, ZeepMemorySignature):
     """Overriden to use the changed `_sing_envelope_with_key`."""
 
     def apply(self, envelope, headers, signatures=None):
         """Plugin entry point."""
-        key = _make_sign_key(self.key_data, self.cert_data, self.password)
-        _sign_envelope_with_key(envelope, key, self.signature_method, self.digest_method, signatures=signatures)
+        with phase(self.observer, SIGNING):
+            key = _get_sign_key(self.key_data, self.cert_data, self.password)
+            _sign_envelope_with_key(envelope, key, self.signature_method, self.digest_method, signatures=signatures)
         return envelope, headers
 
-    def verify(self, envelope):
-        """Plugin exit point.
 
-        Overriden to call overloaded function.
-        """
-        key = _make_verify_key(self.cert_data)
-        _verify_envelope_with_key(envelope, key)
-        return envelope
+class Signature(_PluginOptions, ZeepSignature):
+    """Overriden to use the changed `_sing_envelope_with_key`."""
 
+    def apply(self, envelope, headers, signatures=None):
+        """Plugin entry point."""
+        with phase(self.observer, SIGNING):
+            key = _get_sign_key(self.key_data, self.cert_data, self.password)
+            _sign_envelope_with_key(envelope, key, self.signature_method, self.digest_method, signatures=signatures)
+        return envelope, headers
 
-class BinarySignature(ZeepSignature):
+
+class BinarySignature(_PluginOptions, ZeepSignature):
     """Sign given SOAP envelope with WSSE sif using given key file and cert file.
 
     Place the ky information into BinarySecurityElement.
@@ -210,19 +373,13 @@ class BinarySignature(ZeepSignature):
 
     def apply(self, envelope, headers, signatures=None):
         """Plugin entry point."""
-        key = _make_sign_key(self.key_data, self.cert_data, self.password)
-        _sign_envelope_with_key_binary(envelope, key, self.signature_method, self.digest_method, signatures=signatures)
+        with phase(self.observer, SIGNING):
+            key = _get_sign_key(self.key_data, self.cert_data, self.password)
+            _sign_envelope_with_key_binary(
+                envelope, key, self.signature_method, self.digest_method, signatures=signatures
+            )
         return envelope, headers
 
-    def verify(self, envelope):
-        """Plugin exit point.
-
-        Overriden to call overloaded function.
-        """
-        key = _make_verify_key(self.cert_data)
-        _verify_envelope_with_key(envelope, key)
-        return envelope
-
 
 class SAMLTokenSignature:
     """Sign given SOAP envelope with WSSE sig using given HMAC key."""
@@ -232,8 +389,13 @@ class SAMLTokenSignature:
         assertion,
         signature_method=xmlsec.Transform.HMAC_SHA1,  # type: ignore
         digest_method=None,
+        verify_responses="if-present",
+        observer: Optional[Observer] = None,
     ):
-        """Parse necessary data from the assertion."""
+        """Parse necessary data from the assertion.
+
+        See `_PluginOptions` for the `verify_responses` policy and the `observer`.
+        """
         # XXX: For now we assume that the Assertion is lxml tree
         # XXX: This can change later...
         find = ETXPath("//{}/text()".format(QName("http://docs.oasis-open.org/ws-sx/ws-trust/200512", "BinarySecret")))
@@ -242,23 +404,27 @@ class SAMLTokenSignature:
         self.assertion_id = assertion.get("AssertionID")
         self.signature_method = signature_method
         self.digest_method = digest_method
+        self.verify_responses = verify_responses
+        self.observer = observer
 
     def apply(self, envelope, headers, signatures=None):
         """Plugin entry point."""
-        key = xmlsec.Key.from_binary_data(xmlsec.KeyData.HMAC, self.key_data)  # type: ignore
-        _sign_envelope_with_saml(
-            envelope,
-            key,
-            self.signature_method,
-            self.digest_method,
-            self.assertion,
-            self.assertion_id,
-            signatures=signatures,
-        )
+        with phase(self.observer, SIGNING):
+            key = _get_hmac_key(self.key_data)
+            _sign_envelope_with_saml(
+                envelope,
+                key,
+                self.signature_method,
+                self.digest_method,
+                self.assertion,
+                self.assertion_id,
+                signatures=signatures,
+            )
         return envelope, headers
 
     def verify(self, envelope):
         """Plugin exit point."""
-        key = xmlsec.Key.from_binary_data(xmlsec.KeyData.HMAC, self.key_data)  # type: ignore
-        _verify_envelope_with_key(envelope, key)
+        if self.verify_responses != "off":
+            with phase(self.observer, VERIFICATION):
+                _verify_envelope_with_key(envelope, _get_hmac_key(self.key_data), self.verify_responses)
         return envelope
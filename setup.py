@@ -14,7 +14,7 @@ setup(
     long_description=open("README.md").read(),
     long_description_content_type="text/markdown",
     python_requires="~=3.9",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     zip_safe=False,
     include_package_data=True,
     install_requires=[
@@ -23,8 +23,9 @@ setup(
         "lxml ~= 6.0",
     ],
     extras_require={
+        "aio": ["httpx"],
         "quality": ["ruff", "mypy"],
-        "tests": ["responses"],
+        "tests": ["responses", "httpx"],
         "types": ["types-requests"],
     },
 )